@@ -4,4 +4,8 @@ from pathlib import Path
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
+# backend.app imports its sibling modules (migrations, ...) by plain name
+BACKEND = ROOT / 'backend'
+if str(BACKEND) not in sys.path:
+    sys.path.append(str(BACKEND))
 from backend.app import app as app
@@ -142,8 +142,10 @@ async function login() {
             loginModal.style.display = 'none';
             document.querySelector('.user-profile span').textContent = userName + ' (' + userRole + ')';
             setupRoleUI();
+            await primeRequests(startupRequests(false));
             fetchProducts();
             fetchCategories();
+            syncOfflineSales();
             if (loginBtnEl) loginBtnEl.style.display = 'none';
             if (logoutBtnEl) logoutBtnEl.style.display = '';
         } else {
@@ -169,10 +171,12 @@ if (authToken) {
     if (loginBtnEl) loginBtnEl.style.display = 'none';
     if (logoutBtnEl) logoutBtnEl.style.display = '';
     setupRoleUI();
-    fetchProducts();
-    fetchCategories();
-    loadBrandLogo();
-    loadBrandLogo();
+    primeRequests(startupRequests(true)).then(() => {
+        fetchProducts();
+        fetchCategories();
+        loadBrandLogo();
+    });
+    syncOfflineSales();
     if (barcodeInput) {
         barcodeInput.focus();
     }
@@ -213,6 +217,12 @@ async function apiCall(url, options = {}) {
         headers['Authorization'] = `Bearer ${authToken}`;
     }
     
+    if (!options.method && primedResponses.has(url)) {
+        const primed = primedResponses.get(url);
+        primedResponses.delete(url);
+        if (Date.now() - primed.at < PRIMED_RESPONSE_TTL_MS) return primed.response;
+    }
+
     const fullUrl = url.startsWith('/api/') && API_BASE ? (API_BASE + url) : url;
     let response;
     try {
@@ -241,6 +251,187 @@ async function apiCall(url, options = {}) {
     
     return response;
 }
+// Start-up GETs fetched together through /api/batch, so a till on a slow
+// link pays one round trip instead of one per request. Each primed answer
+// is handed to the first apiCall() for the same URL, then dropped.
+const PRIMED_RESPONSE_TTL_MS = 30000;
+const primedResponses = new Map();
+
+async function primeRequests(urls) {
+    try {
+        const response = await apiCall('/api/batch', {
+            method: 'POST',
+            body: JSON.stringify({ requests: urls }),
+            allow401: true
+        });
+        if (!response.ok) return;
+        const result = await response.json();
+        for (const r of result.responses || []) {
+            if (!('body' in r)) continue;
+            primedResponses.set(r.path, {
+                at: Date.now(),
+                response: new Response(JSON.stringify(r.body), {
+                    status: r.status,
+                    headers: { 'Content-Type': 'application/json' }
+                })
+            });
+        }
+    } catch (e) {
+        // Older backend or offline: each call fetches on its own.
+    }
+}
+
+function startupRequests(withLogo) {
+    const urls = withLogo ? ['/api/categories', '/api/branding/logo'] : ['/api/categories'];
+    if (userRole === 'admin') urls.push('/api/products/low-stock');
+    return urls;
+}
+
+// Offline till mode: sales made while the backend is unreachable are queued
+// in IndexedDB with a client-generated key and synced in batches to
+// /api/sales/sync, which applies each key at most once.
+const OFFLINE_DB_NAME = 'pos_offline';
+const OFFLINE_SYNC_BATCH = 100;
+const OFFLINE_SYNC_INTERVAL_MS = 30000;
+let offlineDbPromise = null;
+let offlineSyncing = false;
+
+function openOfflineDb() {
+    if (!offlineDbPromise) {
+        offlineDbPromise = new Promise((resolve, reject) => {
+            if (typeof indexedDB === 'undefined') {
+                reject(new Error('IndexedDB not available'));
+                return;
+            }
+            const req = indexedDB.open(OFFLINE_DB_NAME, 1);
+            req.onupgradeneeded = () => {
+                const db = req.result;
+                if (!db.objectStoreNames.contains('sales')) db.createObjectStore('sales', { keyPath: 'client_key' });
+                if (!db.objectStoreNames.contains('catalog')) db.createObjectStore('catalog');
+            };
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+        offlineDbPromise.catch(() => { offlineDbPromise = null; });
+    }
+    return offlineDbPromise;
+}
+
+async function offlineStore(storeName, mode, fn) {
+    const db = await openOfflineDb();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(storeName, mode);
+        const req = fn(tx.objectStore(storeName));
+        tx.oncomplete = () => resolve(req ? req.result : undefined);
+        tx.onerror = () => reject(tx.error);
+        tx.onabort = () => reject(tx.error);
+    });
+}
+
+function newClientKey() {
+    if (typeof crypto !== 'undefined' && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+}
+
+// POST with an Idempotency-Key, retrying timeouts and network errors. The
+// server runs the request at most once per key and replays the stored reply.
+async function postIdempotent(url, body, key, { attempts = 3, timeoutMs = 8000 } = {}) {
+    let lastError;
+    for (let attempt = 0; attempt < attempts; attempt++) {
+        const controller = typeof AbortController !== 'undefined' ? new AbortController() : null;
+        const timer = controller ? setTimeout(() => controller.abort(), timeoutMs) : null;
+        try {
+            const response = await apiCall(url, {
+                method: 'POST',
+                body: JSON.stringify(body),
+                headers: { 'Idempotency-Key': key },
+                signal: controller ? controller.signal : undefined
+            });
+            // 409: the first attempt is still running on the server
+            if (response.status !== 409 || attempt === attempts - 1) return response;
+        } catch (error) {
+            if (error.message === 'Unauthorized') throw error;
+            lastError = error;
+        } finally {
+            if (timer) clearTimeout(timer);
+        }
+        await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+    }
+    throw lastError || new Error('Request failed');
+}
+
+async function queueOfflineSale(saleData, clientKey) {
+    const sale = {
+        ...saleData,
+        client_key: clientKey || newClientKey(),
+        date: new Date().toISOString(),
+        cashier: userName || ''
+    };
+    await offlineStore('sales', 'readwrite', store => store.put(sale));
+    updateOfflineIndicator();
+    return sale;
+}
+
+async function pendingOfflineSales() {
+    try {
+        const all = await offlineStore('sales', 'readonly', store => store.getAll());
+        return (all || []).filter(s => !s.cashier || s.cashier === userName);
+    } catch (e) {
+        return [];
+    }
+}
+
+async function updateOfflineIndicator() {
+    const el = document.getElementById('offline-indicator');
+    if (!el) return;
+    const pending = (await pendingOfflineSales()).length;
+    el.textContent = pending ? `${pending} offline sale${pending === 1 ? '' : 's'} waiting to sync` : '';
+    el.style.display = pending ? '' : 'none';
+}
+
+async function syncOfflineSales() {
+    if (offlineSyncing || !authToken) return;
+    offlineSyncing = true;
+    try {
+        const pending = await pendingOfflineSales();
+        const rejected = [];
+        let synced = 0;
+        for (let i = 0; i < pending.length; i += OFFLINE_SYNC_BATCH) {
+            const batch = pending.slice(i, i + OFFLINE_SYNC_BATCH);
+            const response = await apiCall('/api/sales/sync', {
+                method: 'POST',
+                body: JSON.stringify({ sales: batch })
+            });
+            if (!response.ok) break;
+            const result = await response.json();
+            const done = [];
+            (result.results || []).forEach((r, idx) => {
+                if (r.status === 'rejected') rejected.push({ sale: batch[idx], error: r.error });
+                done.push(batch[idx].client_key);
+            });
+            await offlineStore('sales', 'readwrite', store => { done.forEach(k => store.delete(k)); });
+            synced += done.length;
+        }
+        if (synced) fetchProducts();
+        if (rejected.length) {
+            console.warn('Offline sales rejected by server:', rejected);
+            alert(`${rejected.length} offline sale(s) could not be synced:\n` +
+                rejected.map(r => `${new Date(r.sale.date).toLocaleString()} KES ${Number(r.sale.total || 0).toLocaleString()}: ${r.error}`).join('\n'));
+        }
+    } catch (e) {
+        if (e.message !== 'Unauthorized') console.warn('Offline sync failed, will retry:', e);
+    } finally {
+        offlineSyncing = false;
+        updateOfflineIndicator();
+    }
+}
+
+if (typeof window !== 'undefined') {
+    window.syncOfflineSales = syncOfflineSales;
+    window.addEventListener('online', syncOfflineSales);
+    setInterval(() => { if (navigator.onLine !== false) syncOfflineSales(); }, OFFLINE_SYNC_INTERVAL_MS);
+}
+
 window.setApiBase = async function() {
     const current = API_BASE || '';
     const next = prompt('Enter Backend URL (e.g., https://example.com)', current);
@@ -718,7 +909,7 @@ window.uploadLogoClick = function() {
 
 async function loadBrandLogo() {
     try {
-        const response = await fetch('/api/branding/logo');
+        const response = await apiCall('/api/branding/logo', { allow401: true });
         if (!response.ok) return;
         const result = await response.json();
         const url = result.image_url;
@@ -834,9 +1025,110 @@ window.changeMyPassword = async function() {
 // --- POS Functions ---
 
 // Fetch products from API
+// Decode the binary catalog snapshot served by /api/pos/catalog.bin (layout in backend/catalog.py)
+function decodeCatalog(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'POSC' || view.getUint16(4, true) !== 1) {
+        throw new Error('Unsupported catalog format');
+    }
+    const width = view.getUint16(6, true);
+    const n = view.getUint32(12, true);
+    const stringCount = view.getUint32(16, true);
+    const stringBytes = view.getUint32(20, true);
+    const littleEndian = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+    let pos = 24;
+    const take = (Type, count) => {
+        const bytes = count * Type.BYTES_PER_ELEMENT;
+        let arr;
+        if (littleEndian || Type.BYTES_PER_ELEMENT === 1) {
+            arr = new Type(buffer, pos, count);
+        } else {
+            arr = new Type(count);
+            const get = Type === Float64Array ? 'getFloat64' : Type === Int32Array ? 'getInt32' : 'getUint32';
+            for (let i = 0; i < count; i++) arr[i] = view[get](pos + i * Type.BYTES_PER_ELEMENT, true);
+        }
+        pos += bytes + ((4 - bytes % 4) % 4);
+        return arr;
+    };
+    const prices = take(Float64Array, n);
+    const minPrices = take(Float64Array, n);
+    const ids = take(Uint32Array, n);
+    const stocks = take(Int32Array, n);
+    const names = take(Uint32Array, n);
+    const categories = take(Uint32Array, n);
+    const images = take(Uint32Array, n);
+    const flags = take(Uint8Array, n);
+    const barcodes = take(Uint8Array, n * width);
+    const decoder = new TextDecoder();
+    const strings = decoder.decode(new Uint8Array(buffer, pos, stringBytes)).split('\0');
+    // Fixed-width barcodes decode in one call while they are all ASCII
+    const barcodeText = decoder.decode(barcodes);
+    const asciiBarcodes = barcodeText.length === barcodes.length;
+    const NONE = 0xFFFFFFFF;
+    const result = new Array(n);
+    for (let i = 0; i < n; i++) {
+        let barcode = asciiBarcodes
+            ? barcodeText.substr(i * width, width)
+            : decoder.decode(barcodes.subarray(i * width, (i + 1) * width));
+        const nul = barcode.indexOf('\0');
+        if (nul !== -1) barcode = barcode.slice(0, nul);
+        result[i] = {
+            id: ids[i],
+            name: names[i] === NONE ? null : strings[names[i]],
+            category: categories[i] === NONE ? null : strings[categories[i]],
+            price: prices[i],
+            min_price: Number.isNaN(minPrices[i]) ? null : minPrices[i],
+            stock: stocks[i],
+            barcode: barcode || null,
+            image_url: images[i] === NONE ? null : strings[images[i]],
+            low_stock: (flags[i] & 1) === 1
+        };
+    }
+    return result;
+}
+
+async function fetchCatalogSnapshot() {
+    if (typeof TextDecoder === 'undefined') return null;
+    let response;
+    try {
+        response = await apiCall('/api/pos/catalog.bin');
+    } catch (error) {
+        if (error.message === 'Unauthorized') throw error;
+        // Offline: start from the last snapshot this till saw
+        try {
+            const saved = await offlineStore('catalog', 'readonly', store => store.get('snapshot'));
+            if (saved) return decodeCatalog(saved);
+        } catch (e) { /* no offline copy */ }
+        throw error;
+    }
+    try {
+        if (!response || !response.ok) return null;
+        const buffer = await response.arrayBuffer();
+        const decoded = decodeCatalog(buffer);
+        offlineStore('catalog', 'readwrite', store => store.put(buffer, 'snapshot')).catch(() => {});
+        return decoded;
+    } catch (error) {
+        console.warn('Binary catalog unavailable, falling back to JSON:', error);
+        return null;
+    }
+}
+
+const POS_PRODUCT_FIELDS = 'id,name,category,price,min_price,stock,barcode,image_url,low_stock';
+
 async function fetchProducts() {
     try {
-        let response = await apiCall('/api/pos/products');
+        const snapshot = await fetchCatalogSnapshot();
+        if (snapshot) {
+            products = snapshot;
+            renderProducts(products);
+            if (userRole === 'admin') {
+                fetchLowStockAlerts();
+            }
+            return;
+        }
+        // Same columns as the binary catalog.
+        let response = await apiCall('/api/pos/products?fields=' + POS_PRODUCT_FIELDS);
         if (!response || response.status === 404 || response.status === 405) {
             response = await apiCall('/api/products');
         }
@@ -1400,10 +1692,29 @@ checkoutBtn.addEventListener('click', async () => {
         checkoutBtn.disabled = true;
         checkoutBtn.innerHTML = '<i class="fa-solid fa-spinner fa-spin"></i> Processing...';
 
-        const response = await apiCall('/api/sales', {
-            method: 'POST',
-            body: JSON.stringify(saleData)
-        });
+        // One key per checkout: retries and the offline copy all share it,
+        // so the sale is recorded once however it reaches the server.
+        const saleKey = newClientKey();
+        let response;
+        try {
+            if (navigator.onLine === false) throw new TypeError('offline');
+            response = await postIdempotent('/api/sales', saleData, saleKey);
+        } catch (networkError) {
+            if (networkError.message === 'Unauthorized') throw networkError;
+            // Backend unreachable: keep selling and sync later
+            const queued = await queueOfflineSale(saleData, saleKey);
+            const items = [...cart];
+            items.forEach(item => {
+                const p = products.find(pp => pp.id === item.productId);
+                if (p) p.stock -= item.quantity;
+            });
+            cart = [];
+            renderCart();
+            renderProducts(products);
+            showReceipt('OFFLINE-' + queued.client_key.slice(0, 8).toUpperCase(), items, subtotal, vat, total,
+                saleData.payment_method, saleData.payment_reference);
+            return;
+        }
 
         const result = await response.json();
         
@@ -1461,10 +1772,7 @@ window.promptMpesa = async function() {
     const amount = subtotal + vat;
     try {
         mpesaStatusEl && (mpesaStatusEl.textContent = 'Sending prompt...');
-        const response = await apiCall('/api/pay/mpesa/stkpush', {
-            method: 'POST',
-            body: JSON.stringify({ amount, phone })
-        });
+        const response = await postIdempotent('/api/pay/mpesa/stkpush', { amount, phone }, newClientKey());
         const result = await response.json();
         if (!response.ok) {
             mpesaStatusEl && (mpesaStatusEl.textContent = 'Error: ' + (result.error || 'Failed'));
@@ -0,0 +1,169 @@
+"""Vectorised item velocity and reorder suggestions.
+
+ReorderAnalytics keeps every sold line from the last history_days as three
+int64 NumPy arrays: product id, day number and quantity. The first refresh
+fills them in one bulk read. Later refreshes only read sales and
+refund/void audit rows above the previous high-water ids, folding them in
+as positive and negative quantities. Addition commutes, so the order in which sales and
+reversals are seen does not matter. A periodic full reload (and the one at
+the start of each day, when the window moves) corrects any drift, e.g.
+from PostgreSQL ids committing out of order.
+
+Per product, with everything done by np.bincount over the arrays:
+
+- velocity_7 / _28 / _90: units per day over the trailing windows
+- velocity: 0.5 * v7 + 0.3 * v28 + 0.2 * v90, favouring recent demand
+- days_of_cover: stock / velocity
+- reorder_qty: enough to cover lead time plus cover_days of demand, plus
+  safety stock z * sigma_daily * sqrt(lead_time), less stock on hand.
+  sigma_daily is taken over the last 28 days.
+
+NumPy is optional. It is imported on first use, and the endpoint reports
+it as unavailable when it is missing.
+"""
+import datetime
+import math
+import threading
+import time
+
+WINDOWS = (7, 28, 90)
+WINDOW_WEIGHTS = (0.5, 0.3, 0.2)
+SIGMA_DAYS = 28
+
+_numpy = None
+
+
+def get_numpy():
+    """Import numpy on first use; returns None when it is not installed."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+class ReorderAnalytics:
+    def __init__(self, repo, history_days=max(WINDOWS), full_reload_seconds=3600.0, batch_size=50000):
+        self.repo = repo
+        self.history_days = history_days
+        self.full_reload_seconds = full_reload_seconds
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._loaded_day = None
+        self._loaded_at = 0.0
+        self._sale_mark = 0
+        self._audit_mark = 0
+        self._product = self._day = self._qty = None
+        self._velocity = None
+        self.stats = {'full_loads': 0, 'incremental_loads': 0, 'rows': 0, 'last_refresh_ms': None}
+
+    # --- loading ---
+
+    def _read(self, batches):
+        """Concatenate (product_id, day_number, quantity) batches into int64 columns."""
+        np = get_numpy()
+        parts = [np.asarray(rows, dtype=np.int64).reshape(-1, 3) for rows in batches]
+        return np.concatenate(parts) if parts else np.empty((0, 3), np.int64)
+
+    def refresh(self):
+        """Bring the arrays up to date; returns 'full', 'incremental' or None."""
+        np = get_numpy()
+        today = datetime.datetime.utcnow().date()
+        with self._lock:
+            t = time.perf_counter()
+            full = (self._product is None or self._loaded_day != today
+                    or time.monotonic() - self._loaded_at >= self.full_reload_seconds)
+            sale_mark, audit_mark = self.repo.sales_high_water()
+            if not full and sale_mark == self._sale_mark and audit_mark == self._audit_mark:
+                return None
+            if full:
+                since = (today - datetime.timedelta(days=self.history_days - 1)).isoformat()
+                # Sale ids grow with time, so start the scan at the window's
+                # first sale; the date filter still drops back-dated rows.
+                first = self.repo.first_sale_id_since(since)
+                after_sale = first - 1 if first is not None else sale_mark
+                after_audit = 0
+            else:
+                since = None
+                after_sale, after_audit = self._sale_mark, self._audit_mark
+            sold = self._read(self.repo.item_sale_batches(after_sale, sale_mark, since, self.batch_size))
+            reversed_ = self._read(self.repo.reversed_item_batches(after_audit, audit_mark, since, self.batch_size))
+            reversed_[:, 2] *= -1
+            rows = np.concatenate([sold, reversed_])
+            if full:
+                self._product, self._day, self._qty = rows[:, 0], rows[:, 1], rows[:, 2]
+                self._loaded_day = today
+                self._loaded_at = time.monotonic()
+            else:
+                self._product = np.concatenate([self._product, rows[:, 0]])
+                self._day = np.concatenate([self._day, rows[:, 1]])
+                self._qty = np.concatenate([self._qty, rows[:, 2]])
+            self._sale_mark, self._audit_mark = sale_mark, audit_mark
+            self._velocity = None
+            self.stats['full_loads' if full else 'incremental_loads'] += 1
+            self.stats['rows'] = int(self._product.size)
+            self.stats['last_refresh_ms'] = round((time.perf_counter() - t) * 1000, 1)
+            return 'full' if full else 'incremental'
+
+    # --- computing ---
+
+    def _demand(self, ids):
+        """Per-window velocities and daily sigma for the sorted product ids."""
+        np = get_numpy()
+        n = ids.size
+        today = (self._loaded_day - datetime.date(1970, 1, 1)).days
+        age = today - self._day
+        idx = np.searchsorted(ids, self._product)
+        known = idx < n
+        known[known] = ids[idx[known]] == self._product[known]
+        keep = known & (age >= 0) & (age < self.history_days)
+        idx, age, qty = idx[keep], age[keep], self._qty[keep].astype(np.float64)
+
+        velocities = [np.bincount(idx[age < w], weights=qty[age < w], minlength=n) / w for w in WINDOWS]
+        recent = age < SIGMA_DAYS
+        daily = np.bincount(idx[recent] * SIGMA_DAYS + age[recent], weights=qty[recent], minlength=n * SIGMA_DAYS)
+        sigma = daily.reshape(n, SIGMA_DAYS).std(axis=1)
+        return velocities, sigma
+
+    def reorder(self, lead_time_days=7, cover_days=14, service_z=1.65, include_all=False, limit=200):
+        """Reorder suggestions, most urgent (fewest days of cover) first."""
+        np = get_numpy()
+        self.refresh()
+        parts = [np.asarray(rows, dtype=np.int64).reshape(-1, 2) for rows in self.repo.product_stock_batches(self.batch_size)]
+        if not parts:
+            return []
+        products = np.concatenate(parts)
+        ids, stock = products[:, 0], products[:, 1].astype(np.float64)
+
+        with self._lock:
+            cached = self._velocity
+            if cached is None or cached[0].size != ids.size or not np.array_equal(cached[0], ids):
+                cached = (ids,) + self._demand(ids)
+                self._velocity = cached
+        _, velocities, sigma = cached
+
+        velocity = sum(w * v for w, v in zip(WINDOW_WEIGHTS, velocities))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cover = np.where(velocity > 0, stock / velocity, np.inf)
+        safety = service_z * sigma * math.sqrt(lead_time_days)
+        target = velocity * (lead_time_days + cover_days) + safety
+        reorder_qty = np.ceil(np.maximum(target - stock, 0))
+
+        selected = np.arange(ids.size) if include_all else np.flatnonzero(reorder_qty > 0)
+        selected = selected[np.argsort(cover[selected], kind='stable')][:limit]
+        info = self.repo.get_products_by_ids(int(ids[i]) for i in selected)
+        return [{
+            "id": int(ids[i]),
+            "name": info.get(int(ids[i]), {}).get('name'),
+            "category": info.get(int(ids[i]), {}).get('category'),
+            "stock": int(stock[i]),
+            "velocity": round(float(velocity[i]), 3),
+            "velocity_7": round(float(velocities[0][i]), 3),
+            "velocity_28": round(float(velocities[1][i]), 3),
+            "velocity_90": round(float(velocities[2][i]), 3),
+            "days_of_cover": round(float(cover[i]), 1) if np.isfinite(cover[i]) else None,
+            "reorder_qty": int(reorder_qty[i]),
+        } for i in selected]
@@ -1,43 +1,63 @@
+import time
+# Taken before the heavier imports so the startup report covers them.
+_STARTUP_T0 = time.perf_counter()
 import sqlite3
 import json
 import os
 import shutil
 import datetime
+import threading
 import jwt
 from functools import wraps
-from flask import Flask, jsonify, request, send_from_directory, make_response
+from flask import Flask, jsonify, request, send_from_directory, send_file, make_response, g
 import csv
 import io
+import tempfile
+import zipfile
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
-import cloudinary
-import cloudinary.uploader
 from werkzeug.utils import secure_filename
 import base64
-try:
-    import requests
-except Exception:
-    requests = None
+import hashlib
+import migrations
+import journal
+import repository
+import readpool
+import reportcache
+import columnar
+import analytics
+import buckets
+import catalog
+import audit
+import coherence
+import singleflight
+import maintenance
+import backup
+import profiler
+
+STARTUP_TIMINGS = {'imports_ms': round((time.perf_counter() - _STARTUP_T0) * 1000, 1)}
 
 # Determine paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERLESS = bool(os.environ.get('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+# Fast-start defers the DB bootstrap (copy to /tmp + migrations) to the first
+# request that needs the database. Always on in serverless environments.
+FAST_START = SERVERLESS or os.environ.get('POS_FAST_START') == '1'
+# Under a preloading server (see gunicorn.conf.py) the master imports the
+# app and runs migrations once, then forks workers. Threads do not survive
+# fork, so background threads are started per worker in after_fork().
+PRELOADED = os.environ.get('POS_PRELOADED') == '1'
+_in_worker = False
 
-if os.environ.get('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+if SERVERLESS:
     # Use /tmp for writable database in serverless environments
     DB_NAME = "/tmp/pos.db"
-    # Copy initial DB if it exists
-    original_db = os.path.join(BASE_DIR, "pos.db")
-    if os.path.exists(original_db) and not os.path.exists(DB_NAME):
-        try:
-            shutil.copy2(original_db, DB_NAME)
-        except Exception as e:
-            print(f"Warning: Could not copy initial database: {e}")
 else:
     DB_NAME = os.environ.get('DB_PATH') or os.path.join(BASE_DIR, "pos.db")
 
 FRONTEND_DIR = os.path.join(BASE_DIR, '..')
 
-if os.environ.get('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+if SERVERLESS:
     # In serverless, we can't write to the source directory.
     # We use /tmp for temporary uploads or disable local storage.
     PRODUCT_UPLOAD_DIR = os.path.join("/tmp", 'uploads', 'products')
@@ -49,198 +69,366 @@ else:
 app = Flask(__name__, static_url_path='', static_folder=FRONTEND_DIR)
 app.config['SECRET_KEY'] = 'your_secret_key_change_this_in_production'
 CORS(app)
-cloudinary.config(cloudinary_url=os.environ.get('CLOUDINARY_URL', ''), secure=True)
 
-def get_db_connection():
+_cloudinary_uploader = None
+_requests = None
+
+def get_cloudinary_uploader():
+    """Import and configure cloudinary on first use (it is slow to import)."""
+    global _cloudinary_uploader
+    if _cloudinary_uploader is None:
+        t = time.perf_counter()
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(cloudinary_url=os.environ.get('CLOUDINARY_URL', ''), secure=True)
+        _cloudinary_uploader = cloudinary.uploader
+        STARTUP_TIMINGS['cloudinary_import_ms'] = round((time.perf_counter() - t) * 1000, 1)
+    return _cloudinary_uploader
+
+def get_requests():
+    """Import requests on first use; returns None when it is not installed."""
+    global _requests
+    if _requests is None:
+        t = time.perf_counter()
+        try:
+            import requests
+            _requests = requests
+        except Exception:
+            _requests = False
+        STARTUP_TIMINGS['requests_import_ms'] = round((time.perf_counter() - t) * 1000, 1)
+    return _requests or None
+
+def _connect():
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL
-        )
-    ''')
-
-    # Create Products table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            parent_id INTEGER,
-            price REAL NOT NULL,
-            stock INTEGER NOT NULL,
-            category TEXT,
-            barcode TEXT,
-            low_stock_threshold INTEGER,
-            image_url TEXT,
-            min_price REAL
-        )
-    ''')
-    cols = [row['name'] for row in cursor.execute("PRAGMA table_info(products)").fetchall()]
-    if 'parent_id' not in cols:
-        cursor.execute("ALTER TABLE products ADD COLUMN parent_id INTEGER")
-    if 'barcode' not in cols:
-        cursor.execute("ALTER TABLE products ADD COLUMN barcode TEXT")
-    if 'low_stock_threshold' not in cols:
-        cursor.execute("ALTER TABLE products ADD COLUMN low_stock_threshold INTEGER")
-    if 'image_url' not in cols:
-        cursor.execute("ALTER TABLE products ADD COLUMN image_url TEXT")
-    if 'min_price' not in cols:
-        cursor.execute("ALTER TABLE products ADD COLUMN min_price REAL")
-    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode) WHERE barcode IS NOT NULL")
-    seed_barcodes = {
-        'Samsung 43\" Smart TV': '890100000001',
-        'Blender 500W': '890100000002',
-        'Double Bedsheet Set': '890100000003',
-        'Non-stick Cookware Set': '890100000004',
-        'Bluetooth Speaker': '890100000005',
-        'Electric Kettle': '890100000006',
-        'King Size Duvet': '890100000007',
-        'Iron Box': '890100000008'
-    }
-    for name, code in seed_barcodes.items():
-        cursor.execute("UPDATE products SET barcode = ? WHERE name = ? AND (barcode IS NULL OR barcode = '')", (code, name))
-    
-    # Create Sales table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sales (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            total REAL NOT NULL,
-            subtotal REAL,
-            vat REAL,
-            cashier TEXT,
-            payment_method TEXT,
-            payment_reference TEXT,
-            date TEXT DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'completed'
-        )
-    ''')
-    sales_cols = [row['name'] for row in cursor.execute("PRAGMA table_info(sales)").fetchall()]
-    if 'subtotal' not in sales_cols:
-        cursor.execute("ALTER TABLE sales ADD COLUMN subtotal REAL")
-    if 'vat' not in sales_cols:
-        cursor.execute("ALTER TABLE sales ADD COLUMN vat REAL")
-    if 'cashier' not in sales_cols:
-        cursor.execute("ALTER TABLE sales ADD COLUMN cashier TEXT")
-    if 'payment_method' not in sales_cols:
-        cursor.execute("ALTER TABLE sales ADD COLUMN payment_method TEXT")
-    if 'payment_reference' not in sales_cols:
-        cursor.execute("ALTER TABLE sales ADD COLUMN payment_reference TEXT")
-    if 'status' not in sales_cols:
-        cursor.execute("ALTER TABLE sales ADD COLUMN status TEXT DEFAULT 'completed'")
-
-    # Create Sale Items table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sale_items (
-            sale_id INTEGER,
-            product_id INTEGER,
-            quantity INTEGER NOT NULL,
-            price REAL NOT NULL,
-            FOREIGN KEY(sale_id) REFERENCES sales(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS audit_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sale_id INTEGER,
-            action TEXT,
-            reason TEXT,
-            actor TEXT,
-            date TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Seed products if empty
-    cursor.execute("SELECT count(*) as count FROM products")
-    if cursor.fetchone()['count'] == 0:
-        products = [
-            ('Samsung 43" Smart TV', 35000, 10, 'Electronics', '890100000001'),
-            ('Blender 500W', 4500, 20, 'Kitchenware', '890100000002'),
-            ('Double Bedsheet Set', 2500, 30, 'Beddings', '890100000003'),
-            ('Non-stick Cookware Set', 8000, 15, 'Kitchenware', '890100000004'),
-            ('Bluetooth Speaker', 3000, 25, 'Electronics', '890100000005'),
-            ('Electric Kettle', 1500, 40, 'Kitchenware', '890100000006'),
-            ('King Size Duvet', 5000, 12, 'Beddings', '890100000007'),
-            ('Iron Box', 1200, 50, 'Electronics', '890100000008')
-        ]
-        cursor.executemany("INSERT INTO products (name, price, stock, category, barcode) VALUES (?, ?, ?, ?, ?)", products)
-        print("Seeded initial products")
-    cursor.execute("UPDATE products SET low_stock_threshold = COALESCE(low_stock_threshold, 5)")
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS banks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL
-        )
-    ''')
-    bcount = cursor.execute("SELECT COUNT(*) as c FROM banks").fetchone()['c']
-    if bcount == 0:
-        cursor.executemany("INSERT INTO banks (name) VALUES (?)", [
-            ('KCB Bank',),
-            ('Co-op Bank',),
-            ('Equity Bank',)
-        ])
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL
+# Durable sale journal (see journal.py). Enabled by pointing POS_JOURNAL_DIR at
+# storage that outlives the instance.
+JOURNAL = None
+if os.environ.get('POS_JOURNAL_DIR'):
+    JOURNAL = journal.SaleJournal(
+        journal.LocalDirectoryStore(os.environ['POS_JOURNAL_DIR']),
+        flush_interval=float(os.environ.get('POS_JOURNAL_FLUSH_SECONDS', '1')),
+        sync_interval=float(os.environ.get('POS_JOURNAL_SYNC_SECONDS', '30')),
+    )
+
+# Report results (see reportcache.py). Closed date ranges are kept for good
+# and, with POS_REPORT_CACHE_DIR, persisted; today's figures are dropped on
+# every sale, refund and void.
+REPORT_CACHE = reportcache.ReportCache(
+    maxsize=int(os.environ.get('POS_REPORT_CACHE_SIZE', '256')),
+    disk_dir=os.environ.get('POS_REPORT_CACHE_DIR') or None,
+    live_ttl=float(os.environ.get('POS_REPORT_CACHE_LIVE_TTL', '30')),
+)
+
+def cached_report(name, compute, start=None, end=None, closed=None, **params):
+    key = reportcache.make_key(name, start=start, end=end, **params)
+    if closed is None:
+        closed = reportcache.is_closed(start, end)
+    return REPORT_CACHE.get_or_compute(key, compute, closed=closed)
+
+_db_ready = False
+_db_lock = threading.Lock()
+
+def bootstrap_db():
+    """Prepare the database file and apply migrations, once per process."""
+    global _db_ready
+    with _db_lock:
+        if _db_ready:
+            return
+        t = time.perf_counter()
+        if REPO.engine == 'postgres':
+            REPO.ensure_schema()
+            _db_ready = True
+            STARTUP_TIMINGS['db_bootstrap_ms'] = round((time.perf_counter() - t) * 1000, 1)
+            return
+        if SERVERLESS:
+            # Copy initial DB if it exists
+            original_db = os.path.join(BASE_DIR, "pos.db")
+            if os.path.exists(original_db) and not os.path.exists(DB_NAME):
+                try:
+                    shutil.copy2(original_db, DB_NAME)
+                except Exception as e:
+                    print(f"Warning: Could not copy initial database: {e}")
+        init_db()
+        if READ_POOL is not None and READ_POOL.mode == 'ro':
+            # Before any worker serves, rather than under load on the first report.
+            READ_POOL.enable_wal()
+        if JOURNAL is not None:
+            conn = _connect()
+            try:
+                replayed = JOURNAL.replay(conn)
+                if replayed:
+                    REPORT_CACHE.clear()
+            finally:
+                conn.close()
+            STARTUP_TIMINGS['journal_replayed'] = replayed
+            if not PRELOADED or _in_worker:
+                JOURNAL.start(connect=_connect, on_replayed=REPORT_CACHE.clear)
+        _db_ready = True
+        STARTUP_TIMINGS['db_bootstrap_ms'] = round((time.perf_counter() - t) * 1000, 1)
+
+def ensure_db():
+    if not _db_ready:
+        bootstrap_db()
+
+def get_db_connection():
+    ensure_db()
+    return _connect()
+
+def init_db(conn=None):
+    """Apply pending schema migrations (a no-op once the schema is current)."""
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        migrations.migrate(conn)
+    finally:
+        if own_conn:
+            conn.close()
+
+# Storage backend. SQLite by default; DATABASE_URL=postgresql://... switches to
+# PostgreSQL with a connection pool (needs psycopg2). The sale journal is
+# SQLite-only: a shared Postgres server already outlives the instance.
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+if DATABASE_URL.startswith(('postgres://', 'postgresql://')):
+    REPO = repository.PostgresRepository(
+        DATABASE_URL,
+        minconn=int(os.environ.get('POS_PG_POOL_MIN', '1')),
+        maxconn=int(os.environ.get('POS_PG_POOL_MAX', '10')),
+        read_dsn=os.environ.get('POS_READ_DATABASE_URL') or None,
+    )
+    if JOURNAL is not None:
+        print("Warning: POS_JOURNAL_DIR is ignored when DATABASE_URL points at PostgreSQL")
+        JOURNAL = None
+else:
+    # Reports and exports read through their own pool (see readpool.py).
+    # POS_READ_MODE: "ro" (default, live file in WAL mode), "snapshot"
+    # (backup copy refreshed every POS_READ_SNAPSHOT_SECONDS) or "off".
+    READ_MODE = os.environ.get('POS_READ_MODE', 'ro')
+    READ_POOL = None
+    if READ_MODE != 'off':
+        READ_POOL = readpool.ReadPool(
+            DB_NAME,
+            mode=READ_MODE,
+            size=int(os.environ.get('POS_READ_POOL_SIZE', '4')),
+            refresh_seconds=float(os.environ.get('POS_READ_SNAPSHOT_SECONDS', '60')),
+            prepare=ensure_db,
         )
-    ''')
-    ccount = cursor.execute("SELECT COUNT(*) as c FROM categories").fetchone()['c']
-    if ccount == 0:
-        cursor.executemany("INSERT INTO categories (name) VALUES (?)", [
-            ('Home Appliances',),
-            ('Electronics',),
-            ('Beddings',),
-            ('Household Items',)
-        ])
-    
-    # Seed default users: superadmin, admin, cashier
-    # Super Admin
-    existing_super = cursor.execute("SELECT 1 FROM users WHERE username = ?", ('superadmin',)).fetchone()
-    if not existing_super:
-        super_pw = generate_password_hash('super123')
-        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                       ('superadmin', super_pw, 'super_admin'))
-    # Admin
-    existing_admin = cursor.execute("SELECT role FROM users WHERE username = ?", ('admin',)).fetchone()
-    if not existing_admin:
-        admin_pw = generate_password_hash('admin123')
-        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                       ('admin', admin_pw, 'admin'))
-    else:
-        if existing_admin['role'] == 'super_admin':
-            cursor.execute("UPDATE users SET role = 'admin' WHERE username = 'admin'")
-    # Cashier
-    existing_cashier = cursor.execute("SELECT 1 FROM users WHERE username = ?", ('cashier',)).fetchone()
-    if not existing_cashier:
-        cashier_pw = generate_password_hash('cashier123')
-        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                       ('cashier', cashier_pw, 'cashier'))
-    print("Default users ensured (superadmin/super123, admin/admin123, cashier/cashier123)")
-    
-    conn.commit()
-    conn.close()
+    REPO = repository.SQLiteRepository(get_db_connection, read_pool=READ_POOL)
+
+# Velocity/reorder analytics (see analytics.py); arrays refresh incrementally.
+REORDER = analytics.ReorderAnalytics(REPO)
+
+# Cross-process cache coherence (see coherence.py). Every API request first
+# checks whether another worker has committed, and drops the caches that
+# depend on the tables it wrote. PostgreSQL polls every
+# POS_COHERENCE_POLL_SECONDS instead.
+COHERENCE = coherence.Coherence(
+    REPO,
+    db_path=None if REPO.engine == 'postgres' else DB_NAME,
+    poll_interval=float(os.environ.get('POS_COHERENCE_POLL_SECONDS', '1')),
+    prepare=ensure_db,
+)
+COHERENCE.watch('sales', REPORT_CACHE.invalidate_live)
+COHERENCE.watch('sales_history', lambda: REPORT_CACHE.clear(disk=False))
+
+# Binary till catalog (see catalog.py); rebuilt once per products revision.
+CATALOG = catalog.CatalogCache(REPO, revision=lambda: COHERENCE.revision('products'))
 
-# Initialize DB
-init_db()
+# ?fields= on the product lists. Computed fields pull in the columns they
+# are derived from; those are dropped again unless asked for.
+PRODUCT_COMPUTED_FIELDS = {'low_stock': ('stock', 'low_stock_threshold'), 'reserved': ('id',)}
+PRODUCT_LIST_CACHE_SIZE = 16
+# Serialised /api/pos/products bodies: {(fields, grouped): (products revision, bytes)}.
+PRODUCT_LISTS = {}
+
+def requested_product_fields(computed):
+    """Fields named by ?fields=, in canonical order, or None for all of them.
+
+    Raises ValueError for names outside repository.PRODUCT_FIELDS and computed.
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    names = {f.strip() for f in raw.split(',') if f.strip()}
+    allowed = repository.PRODUCT_FIELDS + tuple(computed)
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}")
+    return tuple(f for f in allowed if f in names)
+
+def product_columns(fields, required=()):
+    """Columns to select for fields (None: every column)."""
+    if fields is None:
+        return None
+    needed = set(fields) | set(required)
+    for name in fields:
+        needed.update(PRODUCT_COMPUTED_FIELDS.get(name, ()))
+    return [c for c in repository.PRODUCT_FIELDS if c in needed]
+
+def shape_product(d, fields, reserved=None):
+    """Add the computed fields to a product row and drop what was not asked for."""
+    if fields is None or 'low_stock' in fields:
+        thr = d.get('low_stock_threshold')
+        d['low_stock'] = thr is not None and d.get('stock', 0) <= int(thr)
+    if reserved is not None and (fields is None or 'reserved' in fields):
+        d['reserved'] = reserved.get(d['id'], 0)
+    if fields is not None:
+        for key in set(d) - set(fields):
+            del d[key]
+    return d
+
+def list_products_with(fields, reserved=None):
+    """Product dicts restricted to fields, with low_stock (and reserved) computed."""
+    return [shape_product(d, fields, reserved) for d in REPO.list_products(product_columns(fields))]
+
+def group_products(rows, fields, reserved=None):
+    """Nest REPO.product_groups() rows: every product gets a variants list,
+    and each top-level one the variant_stock and variant_count of its tree."""
+    groups, nodes = [], {}
+    for row in rows:
+        depth, variant_stock, variant_count = row.pop('depth'), row.pop('variant_stock'), row.pop('variant_count')
+        del row['root_id']
+        product_id, parent_id = row['id'], row['parent_id']
+        node = nodes[product_id] = shape_product(row, fields, reserved)
+        node['variants'] = []
+        if depth == 0:
+            node['variant_stock'] = int(variant_stock or 0)
+            node['variant_count'] = int(variant_count)
+            groups.append(node)
+        else:
+            nodes[parent_id]['variants'].append(node)
+    return groups
+
+def grouped_products_with(fields, reserved=None, root_id=None):
+    rows = REPO.product_groups(root_id, product_columns(fields, required=('id', 'parent_id')))
+    return group_products(rows, fields, reserved)
+
+# Token holders by user id. Dropped whenever the users table changes, so
+# role changes, password resets and deletions apply on the next request.
+USER_CACHE = {}
+COHERENCE.watch('users', USER_CACHE.clear)
+
+def cached_user(user_id):
+    user = USER_CACHE.get(user_id)
+    if user is None:
+        user = REPO.get_user_by_id(user_id)
+        if user is not None:
+            USER_CACHE[user_id] = user
+    return user
+
+# Identical concurrent GETs share one computation (see singleflight.py).
+# Requests only join a flight that started at the same coherence version,
+# so a till that has just rung up a sale never gets a product list
+# computed before it.
+SINGLE_FLIGHT = singleflight.SingleFlight(timeout=float(os.environ.get('POS_COALESCE_TIMEOUT', '30')))
+COALESCE_ENABLED = os.environ.get('POS_COALESCE', '1') != '0'
+
+def coalesced(f):
+    """Share one response between identical concurrent requests.
+
+    Only for handlers whose response depends on nothing but the path, the
+    query string and the caller's role. Apply it below the auth decorators.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not COALESCE_ENABLED:
+            return f(*args, **kwargs)
+        key = (request.path, request.query_string, request.current_user['role'], COHERENCE.version)
+
+        def run():
+            resp = make_response(f(*args, **kwargs))
+            return resp.get_data(), resp.status_code, list(resp.headers.items())
+        (data, status, headers), shared = SINGLE_FLIGHT.do(key, run, name=request.endpoint)
+        resp = app.response_class(data, status, headers)
+        if shared:
+            resp.headers['X-Coalesced'] = '1'
+        return resp
+    return decorated
+
+# Product change audit trail (see audit.py): buffered, batch-written, and
+# archived monthly to POS_AUDIT_ARCHIVE_DIR once past POS_AUDIT_RETAIN_MONTHS.
+AUDIT = audit.AuditLog(
+    REPO,
+    flush_interval=0 if SERVERLESS else float(os.environ.get('POS_AUDIT_FLUSH_SECONDS', '1')),
+    batch_size=int(os.environ.get('POS_AUDIT_BATCH_SIZE', '500')),
+    archive_dir=os.environ.get('POS_AUDIT_ARCHIVE_DIR') or None,
+    retain_months=int(os.environ.get('POS_AUDIT_RETAIN_MONTHS', '12')),
+)
+if not PRELOADED:
+    AUDIT.start()
+
+# SQLite upkeep in quiet periods (see maintenance.py): WAL checkpoints,
+# planner statistics and incremental vacuum. PostgreSQL has autovacuum.
+MAINTENANCE = None
+if REPO.engine == 'sqlite' and not SERVERLESS and os.environ.get('POS_MAINTENANCE', '1') != '0':
+    MAINTENANCE = maintenance.Maintenance(
+        DB_NAME,
+        checkpoint_interval=float(os.environ.get('POS_MAINT_CHECKPOINT_SECONDS', '300')),
+        optimize_interval=float(os.environ.get('POS_MAINT_OPTIMIZE_SECONDS', '21600')),
+        vacuum_interval=float(os.environ.get('POS_MAINT_VACUUM_SECONDS', '3600')),
+        quiet_seconds=float(os.environ.get('POS_MAINT_QUIET_SECONDS', '30')),
+    )
+    if not PRELOADED:
+        MAINTENANCE.start()
+
+# Online snapshots (see backup.py), enabled by pointing POS_BACKUP_DIR at a
+# directory, ideally on another disk. Taken every POS_BACKUP_INTERVAL_SECONDS
+# (0: only when an admin asks) and rotated to the newest POS_BACKUP_KEEP.
+BACKUPS = None
+if REPO.engine == 'sqlite' and not SERVERLESS and os.environ.get('POS_BACKUP_DIR'):
+    BACKUPS = backup.BackupService(
+        DB_NAME,
+        os.environ['POS_BACKUP_DIR'],
+        keep=int(os.environ.get('POS_BACKUP_KEEP', '7')),
+        pages_per_step=int(os.environ.get('POS_BACKUP_PAGES_PER_STEP', '256')),
+        interval=float(os.environ.get('POS_BACKUP_INTERVAL_SECONDS', '86400')),
+    )
+    if not PRELOADED:
+        BACKUPS.start_schedule()
+
+# Request sampling profiler (see profiler.py), switched on by an admin for
+# POS_PROFILE_SECONDS at a time. POS_PROFILE_DIR shares the switch and the
+# samples between gunicorn workers.
+PROFILER = profiler.Profiler(
+    state_dir=os.environ.get('POS_PROFILE_DIR') or None,
+    rate=float(os.environ.get('POS_PROFILE_RATE', '0.1')),
+    interval=float(os.environ.get('POS_PROFILE_INTERVAL_MS', '10')) / 1000,
+    duration=float(os.environ.get('POS_PROFILE_SECONDS', '600')),
+)
+
+# Initialize DB (deferred to first use in fast-start mode)
+if not FAST_START:
+    bootstrap_db()
+
+def after_fork():
+    """Per-worker setup after a preloading server forks (gunicorn's post_fork)."""
+    global _in_worker
+    _in_worker = True
+    REPO.after_fork()
+    PROFILER.after_fork()
+    AUDIT.start()
+    if MAINTENANCE is not None:
+        MAINTENANCE.start()
+    if BACKUPS is not None:
+        BACKUPS.start_schedule()
+    if JOURNAL is not None:
+        JOURNAL.after_fork()
+        if _db_ready:
+            JOURNAL.start(connect=_connect, on_replayed=REPORT_CACHE.clear)
 
 # --- Auth Helpers ---
 
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
+        batch_user = g.get('batch_user')
+        if batch_user is not None:
+            # A sub-request of /api/batch: the batch itself was authenticated.
+            request.current_user = batch_user
+            return f(*args, **kwargs)
         token = None
         if 'Authorization' in request.headers:
             auth_header = request.headers['Authorization']
@@ -252,9 +440,7 @@ def token_required(f):
         
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            conn = get_db_connection()
-            user = conn.execute('SELECT * FROM users WHERE id = ?', (data['user_id'],)).fetchone()
-            conn.close()
+            user = cached_user(data['user_id'])
             if not user:
                  return jsonify({'message': 'User not found!'}), 401
             request.current_user = user
@@ -292,6 +478,97 @@ def role_required_strict(allowed_roles):
         return decorated_function
     return decorator
 
+# Idempotency-Key support for POSTs a till may retry after a timeout.
+# The first request with a key runs and its response is stored; repeats
+# with the same key and body get the stored response back without running
+# again. A key reused with a different body is rejected. Keys belong to
+# the user who sent them and expire after POS_IDEMPOTENCY_TTL_HOURS.
+IDEMPOTENCY_TTL_SECONDS = int(float(os.environ.get('POS_IDEMPOTENCY_TTL_HOURS', '24')) * 3600)
+IDEMPOTENCY_LOCK_SECONDS = 60
+IDEMPOTENCY_PURGE_SECONDS = 300
+_idempotency_purged_at = [0.0]
+
+def idempotency_scope():
+    """Storage key for this request's Idempotency-Key, or None when not sent."""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key:
+        return None
+    return f"{request.current_user['id']}:{request.path}:{key}"
+
+def idempotent(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key too long"}), 400
+        scope = idempotency_scope()
+        request_hash = hashlib.sha256(request.method.encode() + b' ' + request.path.encode() + b'\n'
+                                      + request.get_data()).hexdigest()
+        now = time.time()
+        if now - _idempotency_purged_at[0] >= IDEMPOTENCY_PURGE_SECONDS:
+            _idempotency_purged_at[0] = now
+            REPO.purge_idempotency_keys()
+        stored = REPO.claim_idempotency_key(scope, request_hash, IDEMPOTENCY_LOCK_SECONDS)
+        if stored is not None:
+            if stored['request_hash'] != request_hash:
+                return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+            if stored['status_code'] is None:
+                resp = jsonify({"error": "A request with this Idempotency-Key is still in progress"})
+                resp.status_code = 409
+                resp.headers['Retry-After'] = '1'
+                return resp
+            resp = make_response(stored['response'], stored['status_code'])
+            resp.headers['Content-Type'] = 'application/json'
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+
+        try:
+            resp = make_response(f(*args, **kwargs))
+        except Exception:
+            REPO.release_idempotency_key(scope)
+            raise
+        if resp.status_code >= 500:
+            # Server-side failures may be transient; let the retry run again.
+            REPO.release_idempotency_key(scope)
+        else:
+            # No-op when the handler already stored it (idempotency_before_commit).
+            REPO.complete_idempotency_key(scope, resp.status_code, resp.get_data(as_text=True), IDEMPOTENCY_TTL_SECONDS)
+        return resp
+    return decorated
+
+def idempotency_before_commit(response_for):
+    """before_commit hook storing the idempotent response in the same transaction.
+
+    response_for(sale_id) builds the JSON body. With the response written
+    atomically with the sale, a crash after commit cannot let a retry create
+    the sale again. Returns None when the request carries no Idempotency-Key.
+    """
+    scope = idempotency_scope()
+    if scope is None:
+        return None
+    def hook(conn, sale_id, totals):
+        body = json.dumps(response_for(sale_id))
+        REPO.complete_idempotency_key(scope, 200, body, IDEMPOTENCY_TTL_SECONDS, conn=conn)
+    return hook
+
+def chain_hooks(*hooks):
+    """Combine before_commit hooks, skipping None."""
+    hooks = [h for h in hooks if h is not None]
+    if not hooks:
+        return None
+    def hook(*args):
+        for h in hooks:
+            h(*args)
+    return hook
+
+def update_product_audited(product_id, field, value):
+    """Update one product field and queue an audit entry with the old and new values."""
+    old = REPO.update_product_field(product_id, field, value)
+    AUDIT.record(f"{field}_change", actor=request.current_user['username'], product_id=product_id,
+                 details={"old": old, "new": value})
+
 # --- Routes ---
 
 # Login Route
@@ -317,9 +594,7 @@ def login():
     if not auth or not auth.get('username') or not auth.get('password'):
         return jsonify({'message': 'Could not verify', 'WWW-Authenticate': 'Basic realm="Login required!"'}), 401
     
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE username = ?', (auth.get('username'),)).fetchone()
-    conn.close()
+    user = REPO.get_user_by_username(auth.get('username'))
     
     if not user:
         return jsonify({'message': 'User not found'}), 401
@@ -355,45 +630,324 @@ def serve_static(path):
 def ping():
     return jsonify({"message": "pong"})
 
-# --- Held Orders (Pause/Resume) ---
-def ensure_holds_table():
-    conn = get_db_connection()
+# Several GETs in one round trip, for tills on slow links. Sub-requests go
+# through the normal handlers (role checks included), but reuse the batch's
+# authenticated user and share one database connection.
+BATCH_MAX_REQUESTS = int(os.environ.get('POS_BATCH_MAX_REQUESTS', '20'))
+
+def run_batch_request(sub):
+    """{"id", "path", "status", "body"} for one sub-request of /api/batch."""
+    if not isinstance(sub, dict):
+        sub = {'path': sub}
+    path = sub.get('path')
+    result = {"id": sub.get('id'), "path": path}
+    method = str(sub.get('method') or 'GET').upper()
+    if (not isinstance(path, str) or not path.startswith('/api/') or method != 'GET'
+            or path.split('?', 1)[0].rstrip('/') == '/api/batch'):
+        return dict(result, status=400, body={"error": "Only GET /api/ paths can be batched"})
+    with app.test_request_context(path, method='GET', base_url=request.host_url):
+        try:
+            resp = app.full_dispatch_request()
+        except Exception as e:
+            return dict(result, status=500, body={"error": str(e)})
+        if resp.is_streamed:
+            # Also werkzeug's own error pages (404, 405); only keep their status.
+            resp.close()
+            if resp.status_code >= 400:
+                return dict(result, status=resp.status_code, body={"error": resp.status})
+            return dict(result, status=400, body={"error": "Streaming responses cannot be batched"})
+        result['status'] = resp.status_code
+        if resp.is_json:
+            result['body'] = resp.get_json()
+        else:
+            result['content_type'] = resp.content_type
+            result['body_base64'] = base64.b64encode(resp.get_data()).decode('ascii')
+        etag = resp.headers.get('ETag')
+        if etag:
+            result['etag'] = etag
+    return result
+
+@app.route('/api/batch', methods=['POST'])
+@token_required
+def batch_requests():
+    data = request.get_json(silent=True) or {}
+    subs = data.get('requests')
+    if not isinstance(subs, list) or not subs:
+        return jsonify({"error": "requests must be a non-empty list"}), 400
+    if len(subs) > BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"At most {BATCH_MAX_REQUESTS} requests per batch"}), 400
+    g.batch_user = request.current_user
     try:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS holds (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT DEFAULT CURRENT_TIMESTAMP,
-                cashier TEXT,
-                note TEXT,
-                items TEXT NOT NULL,
-                payment_method TEXT,
-                payment_reference TEXT,
-                subtotal REAL,
-                vat REAL,
-                total REAL
-            )
-        ''')
-        conn.commit()
+        with REPO.pinned_connection():
+            responses = [run_batch_request(sub) for sub in subs]
     finally:
-        conn.close()
-ensure_holds_table()
+        g.pop('batch_user', None)
+    return jsonify({"message": "success", "responses": responses})
+
+@app.route('/api/diagnostics/journal', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def journal_status():
+    if JOURNAL is None:
+        return jsonify({"message": "success", "enabled": False})
+    return jsonify({"message": "success", "enabled": True, "pending": JOURNAL.pending(),
+                    "node_id": JOURNAL.node_id, "data": JOURNAL.stats})
+
+@app.route('/api/diagnostics/reportcache', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def report_cache_status():
+    return jsonify({"message": "success", "data": REPORT_CACHE.info()})
+
+@app.route('/api/diagnostics/catalog', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def catalog_status():
+    return jsonify({"message": "success", "data": CATALOG.info()})
+
+@app.route('/api/diagnostics/coherence', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def coherence_status():
+    return jsonify({"message": "success", "data": dict(COHERENCE.info(), cached_users=len(USER_CACHE))})
+
+@app.route('/api/diagnostics/coalescing', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def coalescing_status():
+    return jsonify({"message": "success", "enabled": COALESCE_ENABLED, "data": SINGLE_FLIGHT.info()})
+
+@app.route('/api/diagnostics/maintenance', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def maintenance_status():
+    if MAINTENANCE is None:
+        return jsonify({"message": "success", "enabled": False})
+    return jsonify({"message": "success", "enabled": True, "data": MAINTENANCE.info()})
+
+@app.route('/api/diagnostics/maintenance/run', methods=['POST'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def run_maintenance():
+    if MAINTENANCE is None:
+        return jsonify({"error": "Maintenance is not enabled for this database"}), 400
+    tasks = (request.get_json(silent=True) or {}).get('tasks') or list(maintenance.TASKS)
+    if not isinstance(tasks, list) or set(tasks) - set(maintenance.TASKS):
+        return jsonify({"error": f"tasks must be a list of: {', '.join(maintenance.TASKS)}"}), 400
+    record = MAINTENANCE.run(tasks)
+    if record is None:
+        return jsonify({"error": "Maintenance is already running in another worker"}), 409
+    return jsonify({"message": "success", "data": record})
+
+@app.route('/api/diagnostics/profiler', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def profiler_status():
+    return jsonify({"message": "success", "data": PROFILER.info()})
+
+@app.route('/api/diagnostics/profiler', methods=['POST'])
+@token_required
+@role_required_strict(['admin', 'super_admin'])
+def configure_profiler():
+    """{"enabled": true, "rate": 0.1, "interval_ms": 10, "duration_seconds": 600}; enabling starts a new session."""
+    data = request.get_json(silent=True) or {}
+    try:
+        rate = float(data['rate']) if data.get('rate') is not None else None
+        interval_ms = float(data['interval_ms']) if data.get('interval_ms') is not None else None
+        duration = float(data['duration_seconds']) if data.get('duration_seconds') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "rate, interval_ms and duration_seconds must be numbers"}), 400
+    if rate is not None and not 0 < rate <= 1:
+        return jsonify({"error": "rate must be in (0, 1]"}), 400
+    if interval_ms is not None and not 1 <= interval_ms <= 1000:
+        return jsonify({"error": "interval_ms must be between 1 and 1000"}), 400
+    if duration is not None and not 1 <= duration <= 86400:
+        return jsonify({"error": "duration_seconds must be between 1 and 86400"}), 400
+    info = PROFILER.configure(bool(data.get('enabled')), rate=rate,
+                              interval=interval_ms / 1000 if interval_ms is not None else None, duration=duration)
+    return jsonify({"message": "success", "data": info})
+
+@app.route('/api/diagnostics/profiler/profile', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def profiler_profile():
+    """Samples so far: ?format=collapsed (flamegraph.pl) or speedscope, optionally for one ?endpoint=."""
+    fmt = request.args.get('format', 'collapsed')
+    endpoint = request.args.get('endpoint') or None
+    if fmt == 'collapsed':
+        resp = make_response(PROFILER.collapsed(endpoint))
+        resp.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        return resp
+    if fmt == 'speedscope':
+        resp = jsonify(PROFILER.speedscope(endpoint))
+        resp.headers['Content-Disposition'] = 'attachment; filename="pos-profile.speedscope.json"'
+        return resp
+    return jsonify({"error": "format must be collapsed or speedscope"}), 400
+
+@app.route('/api/audit', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def list_audit():
+    args = request.args
+    try:
+        sale_id = int(args['sale_id']) if args.get('sale_id') else None
+        before_id = int(args['before_id']) if args.get('before_id') else None
+        limit = min(max(int(args.get('limit', 100)), 1), 1000)
+        start = datetime.date.fromisoformat(args['start'][:10]).isoformat() if args.get('start') else None
+        # end is inclusive: match everything before the following day
+        end = (datetime.date.fromisoformat(args['end'][:10]) + datetime.timedelta(days=1)).isoformat() if args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "sale_id, before_id and limit must be integers; start and end YYYY-MM-DD"}), 400
+    rows = REPO.query_audit(sale_id=sale_id, actor=args.get('actor') or None, action=args.get('action') or None,
+                            start=start, end=end, before_id=before_id, limit=limit)
+    for r in rows:
+        if r.get('details'):
+            try:
+                r['details'] = json.loads(r['details'])
+            except ValueError:
+                pass
+    return jsonify({"message": "success", "data": rows,
+                    "next_before_id": rows[-1]['id'] if len(rows) == limit else None})
+
+@app.route('/api/audit/archives', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def list_audit_archives():
+    return jsonify({"message": "success", "data": REPO.list_audit_archives(), "status": AUDIT.info()})
+
+@app.route('/api/audit/archive', methods=['POST'])
+@token_required
+@role_required_strict(['admin', 'super_admin'])
+def archive_audit():
+    if not AUDIT.archive_dir:
+        return jsonify({"error": "POS_AUDIT_ARCHIVE_DIR is not set"}), 501
+    try:
+        AUDIT.flush()
+        done = AUDIT.archive_due()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"message": "success", "archived": [{"file": os.path.basename(p), "rows": n} for p, n in done]})
+
+@app.route('/api/backups', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def list_backups():
+    if BACKUPS is None:
+        return jsonify({"message": "success", "enabled": False})
+    return jsonify({"message": "success", "enabled": True, "data": BACKUPS.info()})
+
+@app.route('/api/backups', methods=['POST'])
+@token_required
+@role_required_strict(['admin', 'super_admin'])
+def start_backup():
+    if BACKUPS is None:
+        return jsonify({"error": "POS_BACKUP_DIR is not set"}), 501
+    if not BACKUPS.start():
+        return jsonify({"error": "A backup is already running", "status": BACKUPS.status()}), 409
+    return jsonify({"message": "started"}), 202
+
+@app.route('/api/backups/<name>/verify', methods=['POST'])
+@token_required
+@role_required_strict(['admin', 'super_admin'])
+def verify_backup(name):
+    if BACKUPS is None:
+        return jsonify({"error": "POS_BACKUP_DIR is not set"}), 501
+    try:
+        result = BACKUPS.verify(name)
+    except backup.BackupError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"message": "success", "data": result})
+
+@app.route('/api/diagnostics/readpool', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def read_pool_status():
+    pool = REPO.read_pool
+    if pool is None:
+        return jsonify({"message": "success", "enabled": False})
+    if REPO.engine == 'postgres':
+        return jsonify({"message": "success", "enabled": True, "mode": "replica"})
+    return jsonify({"message": "success", "enabled": True, "mode": pool.mode, "data": pool.stats})
+
+# --- Startup timing report ---
+_first_response_done = False
+
+@app.before_request
+def _startup_mark_request():
+    if not _first_response_done:
+        g.startup_request_t0 = time.perf_counter()
+
+@app.before_request
+def _profile_request():
+    # /api/batch sub-requests run on the batch's thread, which stays
+    # registered (or not) under the batch for all of them.
+    if g.get('batch_user') is None:
+        PROFILER.begin_request(request.endpoint)
+
+@app.teardown_request
+def _profile_request_done(exc):
+    if g.get('batch_user') is None:
+        PROFILER.end_request()
+
+@app.before_request
+def _check_coherence():
+    if request.path.startswith('/api/'):
+        COHERENCE.check()
+        if MAINTENANCE is not None:
+            MAINTENANCE.note_activity()
+
+@app.after_request
+def _startup_report(response):
+    global _first_response_done
+    if not _first_response_done and 'startup_request_t0' in g:
+        _first_response_done = True
+        now = time.perf_counter()
+        STARTUP_TIMINGS['first_request_handler_ms'] = round((now - g.startup_request_t0) * 1000, 1)
+        STARTUP_TIMINGS['first_response_ms'] = round((now - _STARTUP_T0) * 1000, 1)
+        print("Startup timings: " + ", ".join(f"{k}={v}" for k, v in STARTUP_TIMINGS.items()))
+    return response
+
+@app.route('/api/diagnostics/startup', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def startup_timings():
+    return jsonify({"message": "success", "fast_start": FAST_START, "serverless": SERVERLESS,
+                    "data": STARTUP_TIMINGS})
+
+# --- Held Orders (Pause/Resume) ---
+
+# Holds expire after POS_HOLD_TTL_HOURS (0 = never) and are purged in the
+# background of hold requests. POS_HOLD_RESERVE=1 soft-reserves held stock
+# by default; a request can override it with "reserve".
+HOLD_TTL_SECONDS = int(float(os.environ.get('POS_HOLD_TTL_HOURS', '24')) * 3600)
+HOLD_RESERVE_DEFAULT = os.environ.get('POS_HOLD_RESERVE', '0') == '1'
+HOLD_PURGE_SECONDS = 300
+_holds_purged_at = [0.0]
+
+def purge_expired_holds():
+    now = time.time()
+    if now - _holds_purged_at[0] < HOLD_PURGE_SECONDS:
+        return
+    _holds_purged_at[0] = now
+    try:
+        REPO.purge_expired_holds()
+    except Exception as e:
+        print(f"Warning: purging expired holds failed: {e}")
 
 @app.route('/api/holds', methods=['GET'])
 @token_required
 @role_required(['cashier', 'admin', 'assistant', 'super_admin'])
 def list_holds():
     mine = request.args.get('mine', '1') != '0'
-    conn = get_db_connection()
+    purge_expired_holds()
     try:
         if mine and request.current_user:
-            rows = conn.execute("SELECT id, date, cashier, note, subtotal, vat, total FROM holds WHERE cashier = ? ORDER BY date DESC", (request.current_user['username'],)).fetchall()
+            rows = REPO.list_holds(cashier=request.current_user['username'])
         else:
-            rows = conn.execute("SELECT id, date, cashier, note, subtotal, vat, total FROM holds ORDER BY date DESC").fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+            rows = REPO.list_holds()
+        return jsonify({"message": "success", "data": rows})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/holds', methods=['POST'])
 @token_required
@@ -409,53 +963,40 @@ def create_hold():
     subtotal = float(data.get('subtotal') or 0)
     vat = float(data.get('vat') or 0)
     total = float(data.get('total') or 0)
+    reserve = data.get('reserve')
+    reserve = HOLD_RESERVE_DEFAULT if reserve is None else bool(reserve)
     cashier = request.current_user['username'] if request.current_user else None
-    conn = get_db_connection()
+    purge_expired_holds()
     try:
-        cur = conn.execute("""
-            INSERT INTO holds (cashier, note, items, payment_method, payment_reference, subtotal, vat, total)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (cashier, note, json.dumps(items), payment_method, payment_reference, subtotal, vat, total))
-        conn.commit()
-        return jsonify({"message": "success", "id": cur.lastrowid})
+        new_id = REPO.create_hold(cashier, note, items, payment_method, payment_reference, subtotal, vat, total,
+                                  ttl_seconds=HOLD_TTL_SECONDS, reserve=reserve)
+        return jsonify({"message": "success", "id": new_id, "reserved": reserve})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/holds/<int:hold_id>', methods=['GET'])
 @token_required
 @role_required(['cashier', 'admin', 'assistant', 'super_admin'])
 def get_hold(hold_id):
-    conn = get_db_connection()
     try:
-        row = conn.execute("SELECT * FROM holds WHERE id = ?", (hold_id,)).fetchone()
-        if not row:
+        d = REPO.get_hold(hold_id)
+        if not d:
             return jsonify({"error": "not found"}), 404
-        d = dict(row)
-        try:
-            d['items'] = json.loads(d.get('items') or '[]')
-        except Exception:
-            d['items'] = []
         return jsonify({"message": "success", "data": d})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/holds/<int:hold_id>', methods=['DELETE'])
 @token_required
 @role_required(['cashier', 'admin', 'assistant', 'super_admin'])
 def delete_hold(hold_id):
-    conn = get_db_connection()
     try:
-        conn.execute("DELETE FROM holds WHERE id = ?", (hold_id,))
-        conn.commit()
+        REPO.delete_hold(hold_id)
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 def get_mpesa_config():
     cfg = {
@@ -469,19 +1010,21 @@ def get_mpesa_config():
     return cfg
 
 def mpesa_access_token(cfg):
-    if not requests:
+    http = get_requests()
+    if not http:
         raise Exception("requests not installed")
     if not (cfg["consumer_key"] and cfg["consumer_secret"]):
         raise Exception("M-Pesa credentials not configured")
     base = "https://sandbox.safaricom.co.ke" if cfg["env"] == "sandbox" else "https://api.safaricom.co.ke"
     url = base + "/oauth/v1/generate?grant_type=client_credentials"
-    r = requests.get(url, auth=(cfg["consumer_key"], cfg["consumer_secret"]), timeout=15)
+    r = http.get(url, auth=(cfg["consumer_key"], cfg["consumer_secret"]), timeout=15)
     if r.status_code != 200:
         raise Exception("Failed to get access token")
     return r.json()["access_token"]
 
 def mpesa_stkpush_request(cfg, token, amount, phone, account_ref="POS", trans_desc="Payment"):
-    if not requests:
+    http = get_requests()
+    if not http:
         raise Exception("requests not installed")
     if not (cfg["shortcode"] and cfg["passkey"]):
         raise Exception("M-Pesa shortcode/passkey not configured")
@@ -503,13 +1046,14 @@ def mpesa_stkpush_request(cfg, token, amount, phone, account_ref="POS", trans_de
         "TransactionDesc": trans_desc
     }
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json=payload, timeout=20)
+    r = http.post(url, headers=headers, json=payload, timeout=20)
     if r.status_code != 200:
         raise Exception(r.text)
     return r.json()
 
 def mpesa_query_request(cfg, token, checkout_id):
-    if not requests:
+    http = get_requests()
+    if not http:
         raise Exception("requests not installed")
     timestamp = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")
     password = base64.b64encode((cfg["shortcode"] + cfg["passkey"] + timestamp).encode()).decode()
@@ -522,7 +1066,7 @@ def mpesa_query_request(cfg, token, checkout_id):
         "CheckoutRequestID": checkout_id
     }
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json=payload, timeout=20)
+    r = http.post(url, headers=headers, json=payload, timeout=20)
     if r.status_code != 200:
         raise Exception(r.text)
     return r.json()
@@ -530,6 +1074,7 @@ def mpesa_query_request(cfg, token, checkout_id):
 @app.route('/api/pay/mpesa/stkpush', methods=['POST'])
 @token_required
 @role_required(['cashier', 'admin'])
+@idempotent
 def mpesa_stkpush():
     data = request.get_json() or {}
     amount = float(data.get('amount') or 0)
@@ -572,14 +1117,10 @@ def mpesa_query():
 @app.route('/api/banks', methods=['GET'])
 @token_required
 def list_banks():
-    conn = get_db_connection()
     try:
-        rows = conn.execute("SELECT id, name FROM banks ORDER BY name").fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        return jsonify({"message": "success", "data": REPO.list_banks()})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/banks', methods=['POST'])
 @token_required
@@ -589,28 +1130,20 @@ def add_bank():
     name = (data.get('name') or '').strip()
     if not name:
         return jsonify({"error": "name required"}), 400
-    conn = get_db_connection()
     try:
-        conn.execute("INSERT INTO banks (name) VALUES (?)", (name,))
-        conn.commit()
+        REPO.add_bank(name)
         return jsonify({"message": "success"})
-    except sqlite3.IntegrityError:
+    except repository.IntegrityError:
         return jsonify({"error": "bank already exists"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/categories', methods=['GET'])
 @token_required
 def list_categories():
-    conn = get_db_connection()
     try:
-        rows = conn.execute("SELECT id, name FROM categories ORDER BY name").fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        return jsonify({"message": "success", "data": REPO.list_categories()})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/categories', methods=['POST'])
 @token_required
@@ -620,60 +1153,95 @@ def add_category():
     name = (data.get('name') or '').strip()
     if not name:
         return jsonify({"error": "name required"}), 400
-    conn = get_db_connection()
     try:
-        conn.execute("INSERT INTO categories (name) VALUES (?)", (name,))
-        conn.commit()
+        REPO.add_category(name)
         return jsonify({"message": "success"})
-    except sqlite3.IntegrityError:
+    except repository.IntegrityError:
         return jsonify({"error": "category already exists"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 # GET /products
 @app.route('/products', methods=['GET'])
 @app.route('/api/products', methods=['GET']) # Alias for frontend compatibility
 @token_required
+@coalesced
 def get_products():
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products').fetchall()
-    conn.close()
-    data = []
-    for ix in products:
-        d = dict(ix)
-        thr = d.get('low_stock_threshold')
-        d['low_stock'] = thr is not None and d.get('stock', 0) <= int(thr)
-        data.append(d)
-    return jsonify({"message": "success", "data": data})
+    try:
+        fields = requested_product_fields(('low_stock', 'reserved'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    reserved = REPO.reserved_stock() if fields is None or 'reserved' in fields else None
+    if request.args.get('grouped') in ('1', 'true'):
+        return jsonify({"message": "success", "data": grouped_products_with(fields, reserved)})
+    return jsonify({"message": "success", "data": list_products_with(fields, reserved)})
+
+@app.route('/api/products/<int:product_id>/tree', methods=['GET'])
+@token_required
+@coalesced
+def get_product_tree(product_id):
+    """A product with its variants nested below it, and their total stock."""
+    try:
+        fields = requested_product_fields(('low_stock', 'reserved'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    reserved = REPO.reserved_stock() if fields is None or 'reserved' in fields else None
+    tree = grouped_products_with(fields, reserved, root_id=product_id)
+    if not tree:
+        return jsonify({"error": "Product not found"}), 404
+    return jsonify({"message": "success", "data": tree[0]})
 
 @app.route('/products/barcode/<barcode>', methods=['GET'])
 @app.route('/api/products/barcode/<barcode>', methods=['GET'])
 @token_required
 def get_product_by_barcode(barcode):
-    conn = get_db_connection()
-    product = conn.execute('SELECT * FROM products WHERE barcode = ?', (barcode,)).fetchone()
-    conn.close()
+    product = REPO.get_product_by_barcode(barcode)
     if product:
-        return jsonify({"message": "success", "data": dict(product)})
+        return jsonify({"message": "success", "data": product})
     return jsonify({"error": "Product not found"}), 404
 
 # POS-friendly products endpoint (explicitly allows all authenticated roles)
 @app.route('/pos/products', methods=['GET'])
 @app.route('/api/pos/products', methods=['GET'])
 @token_required
+@coalesced
 def get_products_for_pos():
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products').fetchall()
-    conn.close()
-    data = []
-    for ix in products:
-        d = dict(ix)
-        thr = d.get('low_stock_threshold')
-        d['low_stock'] = thr is not None and d.get('stock', 0) <= int(thr)
-        data.append(d)
-    return jsonify({"message": "success", "data": data})
+    try:
+        fields = requested_product_fields(('low_stock',))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Read the revision first: a body built from newer rows is merely
+    # rebuilt once more, never served as current when it is stale.
+    grouped = request.args.get('grouped') in ('1', 'true')
+    key = (fields, grouped)
+    revision = COHERENCE.revision('products')
+    cached = PRODUCT_LISTS.get(key)
+    if cached is None or cached[0] != revision:
+        data = grouped_products_with(fields) if grouped else list_products_with(fields)
+        body = app.json.dumps({"message": "success", "data": data})
+        if key not in PRODUCT_LISTS and len(PRODUCT_LISTS) >= PRODUCT_LIST_CACHE_SIZE:
+            PRODUCT_LISTS.clear()
+        cached = PRODUCT_LISTS[key] = (revision, body)
+    return app.response_class(cached[1], mimetype='application/json')
+
+@app.route('/api/pos/catalog.bin', methods=['GET'])
+@token_required
+def get_pos_catalog():
+    revision, data, gzipped = CATALOG.get()
+    etag = f'"catalog-{catalog.FORMAT_VERSION}-{revision}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        resp = make_response('', 304)
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        resp = make_response(gzipped)
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = make_response(data)
+    resp.headers['Content-Type'] = 'application/octet-stream'
+    resp.headers['ETag'] = etag
+    resp.headers['X-Catalog-Revision'] = str(revision)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
 
 @app.route('/uploads/products/<path:filename>')
 def serve_product_upload(filename):
@@ -694,6 +1262,8 @@ def create_product():
     stock = data.get('stock')
     barcode = (data.get('barcode') or '').strip() or None
     low_stock_threshold = data.get('low_stock_threshold')
+    if low_stock_threshold is None:
+        low_stock_threshold = 5
     image_url = (data.get('image_url') or '').strip() or None
     min_price = data.get('min_price')
     
@@ -708,31 +1278,18 @@ def create_product():
         return jsonify({"error": "Invalid price or stock"}), 400
     if category == '':
         category = 'General'
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        if min_price is not None:
-            cursor.execute(
-                "INSERT INTO products (name, price, stock, category, barcode, low_stock_threshold, image_url, min_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (name, price, stock, category, barcode, low_stock_threshold, image_url, min_price)
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO products (name, price, stock, category, barcode, low_stock_threshold, image_url) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (name, price, stock, category, barcode, low_stock_threshold, image_url)
-            )
-        new_id = cursor.lastrowid
-        conn.commit()
+        new_id = REPO.create_product(name, price, stock, category, barcode, low_stock_threshold, image_url, min_price)
+        AUDIT.record('product_create', actor=request.current_user['username'], product_id=new_id,
+                     details={"name": name, "price": price, "stock": stock, "min_price": min_price})
         return jsonify({"message": "success", "id": new_id})
-    except sqlite3.IntegrityError as e:
+    except repository.IntegrityError as e:
         err = str(e)
-        if 'idx_products_barcode' in err or 'UNIQUE' in err:
+        if 'idx_products_barcode' in err or 'UNIQUE' in err.upper():
             return jsonify({"error": "Barcode already exists"}), 400
         return jsonify({"error": err}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/products/<int:product_id>/variants', methods=['POST', 'OPTIONS'])
 @app.route('/api/products/<int:product_id>/variants/', methods=['POST', 'OPTIONS'])
@@ -748,54 +1305,30 @@ def create_variants(product_id):
     variants = data.get('variants') or []
     if not isinstance(variants, list) or not variants:
         return jsonify({"error": "variants list required"}), 400
-    conn = get_db_connection()
     try:
-        parent = conn.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
-        if not parent:
+        created_ids = REPO.create_variants(product_id, variants)
+        if created_ids is None:
             return jsonify({"error": "Parent product not found"}), 404
-        cursor = conn.cursor()
-        created_ids = []
-        for v in variants:
-            color = (v.get('color') or '').strip()
-            size = (v.get('size') or '').strip()
-            name_suffix = " ".join([s for s in [size, color] if s]).strip()
-            child_name = parent['name'] + (f" ({name_suffix})" if name_suffix else "")
-            price = v.get('price', parent['price'])
-            stock = v.get('stock', 0)
-            barcode = (v.get('barcode') or '').strip() or None
-            min_price = v.get('min_price', parent['min_price'])
-            cursor.execute(
-                "INSERT INTO products (name, parent_id, price, stock, category, barcode, low_stock_threshold, image_url, min_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (child_name, parent['id'], float(price), int(stock), parent['category'], barcode, parent['low_stock_threshold'], parent['image_url'], float(min_price) if min_price is not None else None)
-            )
-            created_ids.append(cursor.lastrowid)
-        conn.commit()
+        for new_id in created_ids:
+            AUDIT.record('variant_create', actor=request.current_user['username'], product_id=new_id,
+                         details={"parent_id": product_id})
         return jsonify({"message": "success", "ids": created_ids})
-    except sqlite3.IntegrityError as e:
+    except repository.IntegrityError as e:
         err = str(e)
-        if 'idx_products_barcode' in err or 'UNIQUE' in err:
+        if 'idx_products_barcode' in err or 'UNIQUE' in err.upper():
             return jsonify({"error": "Barcode already exists"}), 400
         return jsonify({"error": err}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/users', methods=['GET'])
 @token_required
 @role_required(['admin'])
 def list_users():
     role = request.args.get('role')
-    conn = get_db_connection()
     try:
-        if role:
-            rows = conn.execute("SELECT id, username, role FROM users WHERE role = ?", (role,)).fetchall()
-        else:
-            rows = conn.execute("SELECT id, username, role FROM users").fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        return jsonify({"message": "success", "data": REPO.list_users(role)})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/users', methods=['POST'])
 @token_required
 @role_required_strict(['admin'])
@@ -813,19 +1346,14 @@ def create_user():
             role = 'cashier'
     elif role not in allowed_roles:
         role = 'cashier'
-    conn = get_db_connection()
     try:
         hashed = generate_password_hash(password)
-        conn.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", (username, hashed, role))
-        conn.commit()
-        new_id = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()['id']
+        new_id = REPO.create_user(username, hashed, role)
         return jsonify({"message": "success", "id": new_id})
-    except sqlite3.IntegrityError:
+    except repository.IntegrityError:
         return jsonify({"error": "username already exists"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/me/password', methods=['POST'])
 @token_required
 def change_my_password():
@@ -834,19 +1362,14 @@ def change_my_password():
     new_pw = (data.get('new_password') or '').strip()
     if not old_pw or not new_pw:
         return jsonify({"error": "old_password and new_password required"}), 400
-    conn = get_db_connection()
     try:
-        user = conn.execute("SELECT * FROM users WHERE id = ?", (request.current_user['id'],)).fetchone()
+        user = REPO.get_user_by_id(request.current_user['id'])
         if not user or not check_password_hash(user['password_hash'], old_pw):
             return jsonify({"error": "invalid old password"}), 400
-        hashed = generate_password_hash(new_pw)
-        conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (hashed, user['id']))
-        conn.commit()
+        REPO.set_password_hash(user['id'], generate_password_hash(new_pw))
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/users/<int:user_id>/password', methods=['PUT'])
 @token_required
 @role_required(['admin'])
@@ -855,19 +1378,14 @@ def admin_set_password(user_id):
     new_pw = (data.get('new_password') or '').strip()
     if not new_pw:
         return jsonify({"error": "new_password required"}), 400
-    conn = get_db_connection()
     try:
-        user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        user = REPO.get_user_by_id(user_id)
         if not user:
             return jsonify({"error": "user not found"}), 404
-        hashed = generate_password_hash(new_pw)
-        conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (hashed, user_id))
-        conn.commit()
+        REPO.set_password_hash(user_id, generate_password_hash(new_pw))
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/products/<int:id>/image/upload', methods=['POST'])
 @token_required
@@ -885,15 +1403,11 @@ def upload_product_image(id):
     path = os.path.join(PRODUCT_UPLOAD_DIR, fname)
     file.save(path)
     url = f"/uploads/products/{fname}"
-    conn = get_db_connection()
     try:
-        conn.execute("UPDATE products SET image_url = ? WHERE id = ?", (url, id))
-        conn.commit()
+        update_product_audited(id, 'image_url', url)
         return jsonify({"message": "success", "image_url": url})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/branding/logo', methods=['POST'])
 @token_required
@@ -924,101 +1438,196 @@ def get_brand_logo():
         return jsonify({"error": "not_found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+SALE_PAYMENT_METHODS = {'cash', 'mpesa', 'bank', 'card', 'cheque', 'credit'}
+SYNC_MAX_SALES = int(os.environ.get('POS_SYNC_MAX_SALES', '200'))
+OFFLINE_MAX_AGE_DAYS = int(os.environ.get('POS_OFFLINE_MAX_AGE_DAYS', '30'))
+
+def parse_sale_payload(data):
+    """(items, payment_method, payment_reference) from a sale body; raises ValueError if invalid."""
+    items = data.get('items') # List of {productId, quantity, price}
+    payment_method = data.get('payment_method') or data.get('paymentMethod')
+    payment_reference = data.get('payment_reference') or data.get('paymentReference')
+
+    if not items:
+        raise ValueError("No items in sale")
+    if payment_method not in SALE_PAYMENT_METHODS:
+        raise ValueError("Invalid payment method")
+    if payment_method in SALE_PAYMENT_METHODS - {'cash'} and payment_reference is not None:
+        payment_reference = str(payment_reference).strip() or None
+    return items, payment_method, payment_reference
+
+def parse_offline_date(value, now=None):
+    """Normalise a till's ISO-8601 sale time to stored UTC text; None means 'now'.
+
+    Times in the future are clamped to now; times older than
+    OFFLINE_MAX_AGE_DAYS are rejected.
+    """
+    if not value:
+        return None
+    try:
+        when = datetime.datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("Invalid sale date")
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    now = now or datetime.datetime.utcnow()
+    if when > now:
+        return None
+    if now - when > datetime.timedelta(days=OFFLINE_MAX_AGE_DAYS):
+        raise ValueError("Sale is too old to sync")
+    return when.strftime('%Y-%m-%d %H:%M:%S')
+
 # POST /sale
 @app.route('/sale', methods=['POST'])
 @app.route('/api/sales', methods=['POST']) # Alias for frontend compatibility
 @token_required
 @role_required(['cashier', 'admin', 'super_admin'])
+@idempotent
 def create_sale():
     data = request.get_json()
-    items = data.get('items') # List of {productId, quantity, price}
-    payment_method = data.get('payment_method') or data.get('paymentMethod')
-    payment_reference = data.get('payment_reference') or data.get('paymentReference')
-    
-    if not items:
-        return jsonify({"error": "No items in sale"}), 400
-    allowed_methods = {'cash', 'mpesa', 'bank', 'card', 'cheque', 'credit'}
-    if payment_method not in allowed_methods:
-        return jsonify({"error": "Invalid payment method"}), 400
-    if payment_method in {'mpesa', 'bank', 'card', 'cheque', 'credit'} and payment_reference is not None:
-        payment_reference = str(payment_reference).strip() or None
+    try:
+        items, payment_method, payment_reference = parse_sale_payload(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    conn = get_db_connection()
+    cashier = request.current_user['username']
+    journaled = []
     try:
-        conn.execute("BEGIN TRANSACTION")
-        
-        subtotal = 0
-        for item in items:
-            subtotal += float(item['price']) * int(item['quantity'])
-        vat = round(subtotal * 0.16)
-        total = subtotal + vat
-        cashier = request.current_user['username']
-
-        cursor = conn.cursor()
-        cols = [row['name'] for row in conn.execute("PRAGMA table_info(sales)").fetchall()]
-        if 'items' in cols:
-            cursor.execute(
-                "INSERT INTO sales (total, subtotal, vat, cashier, payment_method, payment_reference, items) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (total, subtotal, vat, cashier, payment_method, payment_reference, json.dumps(items))
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO sales (total, subtotal, vat, cashier, payment_method, payment_reference) VALUES (?, ?, ?, ?, ?, ?)",
-                (total, subtotal, vat, cashier, payment_method, payment_reference)
-            )
-        sale_id = cursor.lastrowid
-        
-        for item in items:
-            product_id = item['productId']
-            quantity = item['quantity']
-            price = item['price']
-            
-            cur = conn.execute("SELECT stock, min_price FROM products WHERE id = ?", (product_id,)).fetchone()
-            if not cur:
-                raise Exception("Product not found")
-            if cur['min_price'] is not None and float(price) < float(cur['min_price']):
-                raise Exception("Price below minimum allowed")
-            if cur['stock'] < quantity:
-                raise Exception("Insufficient stock")
-            
-            conn.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
-            
-            conn.execute("INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)", 
-                         (sale_id, product_id, quantity, price))
-        
-        conn.commit()
+        # The Idempotency-Key doubles as the offline-queue key: if this
+        # request committed but the till never saw the reply, the queued copy
+        # it syncs later is recognised as a duplicate.
+        sale_id = REPO.create_sale(items, payment_method, payment_reference, cashier,
+                                   client_key=request.headers.get('Idempotency-Key', '').strip() or None,
+                                   before_commit=chain_hooks(
+                                       journal_sale(journaled, items, cashier, payment_method, payment_reference),
+                                       idempotency_before_commit(lambda sid: {"message": "success", "saleId": sid})))
+        REPORT_CACHE.invalidate_live()
+        for entry in journaled:
+            JOURNAL.append(entry)
         return jsonify({"message": "success", "saleId": sale_id})
-        
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
+
+# Offline till queue: apply a batch of sales recorded while disconnected
+@app.route('/api/sales/sync', methods=['POST'])
+@token_required
+@role_required(['cashier', 'admin', 'super_admin'])
+def sync_sales():
+    data = request.get_json(silent=True) or {}
+    queued = data.get('sales')
+    if not isinstance(queued, list) or not queued:
+        return jsonify({"error": "No sales to sync"}), 400
+    if len(queued) > SYNC_MAX_SALES:
+        return jsonify({"error": f"At most {SYNC_MAX_SALES} sales per sync"}), 400
+
+    cashier = request.current_user['username']
+    results = [None] * len(queued)
+    valid, positions = [], []
+    for i, sale in enumerate(queued):
+        key = str((sale or {}).get('client_key') or '').strip()
+        try:
+            if not key or len(key) > 64:
+                raise ValueError("Missing or invalid client_key")
+            items, payment_method, payment_reference = parse_sale_payload(sale)
+            date = parse_offline_date(sale.get('date') or sale.get('created_at'))
+        except (ValueError, AttributeError) as e:
+            results[i] = {"client_key": key or None, "status": "rejected", "error": str(e)}
+            continue
+        valid.append({"client_key": key, "items": items, "payment_method": payment_method,
+                      "payment_reference": payment_reference, "date": date})
+        positions.append(i)
+
+    journaled = []
+    def before_commit(conn, sale_id, totals, sale):
+        hook = journal_sale(journaled, sale['items'], cashier, sale['payment_method'], sale['payment_reference'])
+        if hook is not None:
+            hook(conn, sale_id, totals)
+
+    if valid:
+        try:
+            applied = REPO.sync_sales(valid, cashier, before_commit=before_commit)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        for i, result in zip(positions, applied):
+            results[i] = result
+        if any(r['status'] == 'applied' for r in applied):
+            today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+            if any(s['date'] and s['date'][:10] < today for s, r in zip(valid, applied) if r['status'] == 'applied'):
+                # Back-dated sales change days the report cache treats as closed.
+                REPORT_CACHE.clear()
+            else:
+                REPORT_CACHE.invalidate_live()
+        for entry in journaled:
+            JOURNAL.append(entry)
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('applied', 'duplicate', 'rejected')}
+    return jsonify({"message": "success", "results": results, **counts})
 
 @app.route('/api/sales/<int:sale_id>', methods=['GET'])
 @token_required
 @role_required(['cashier', 'admin', 'assistant', 'super_admin'])
 def get_sale(sale_id):
-    conn = get_db_connection()
     try:
-        sale = conn.execute("SELECT id, date, cashier, payment_method, payment_reference, subtotal, vat, total, status FROM sales WHERE id = ?", (sale_id,)).fetchone()
+        sale, items = REPO.get_sale(sale_id)
         if not sale:
             return jsonify({"error": "Sale not found"}), 404
-        items = conn.execute("""
-            SELECT si.product_id, si.quantity, si.price, COALESCE(p.name, '') as name
-            FROM sale_items si
-            LEFT JOIN products p ON si.product_id = p.id
-            WHERE si.sale_id = ?
-        """, (sale_id,)).fetchall()
         return jsonify({
             "message": "success",
-            "sale": dict(sale),
-            "items": [dict(ix) for ix in items]
+            "sale": sale,
+            "items": items
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+def journal_sale(entries, items, cashier, payment_method, payment_reference):
+    """before_commit hook journaling a new sale into entries (None when disabled)."""
+    if JOURNAL is None:
+        return None
+    def hook(conn, sale_id, totals):
+        sale_row = conn.execute("SELECT date FROM sales WHERE id = ?", (sale_id,)).fetchone()
+        entry = {
+            "type": "sale",
+            "entry_id": journal.new_entry_id(),
+            "sale": dict(totals, cashier=cashier, payment_method=payment_method,
+                         payment_reference=payment_reference, date=sale_row['date']),
+            "items": [{"product_id": it['productId'], "quantity": it['quantity'], "price": it['price']} for it in items]
+        }
+        journal.record_entry(conn, entry['entry_id'], sale_id, 'sale')
+        entries.append(entry)
+    return hook
+
+def journal_sale_event(entries, action, reason, actor):
+    """before_commit hook journaling a refund/void into entries (None when disabled)."""
+    if JOURNAL is None:
+        return None
+    def hook(conn, sale_id):
+        entry = {
+            "type": action,
+            "entry_id": journal.new_entry_id(),
+            # None for a sale that predates the journal (e.g. from the
+            # bundled pos.db); replay then finds it by sale_ref instead.
+            "sale_entry_id": journal.sale_entry_id(conn, sale_id),
+            "sale_ref": journal.sale_ref(conn, sale_id),
+            "reason": reason,
+            "actor": actor,
+            "date": datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        journal.record_entry(conn, entry['entry_id'], sale_id, action)
+        entries.append(entry)
+    return hook
+
+def invalidate_reversal(sale_date):
+    """Drop the cached reports a refund/void of a sale dated sale_date can change.
+
+    The sale's hour bucket and day figures change, so a sale from before
+    today invalidates closed ranges too. Other workers follow through the
+    sales_history revision (migration 13).
+    """
+    today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+    if sale_date and str(sale_date)[:10] < today:
+        REPORT_CACHE.clear()
+    else:
+        REPORT_CACHE.invalidate_live()
+
 @app.route('/api/sales/<int:sale_id>/refund', methods=['POST'])
 @token_required
 @role_required(['admin'])
@@ -1027,28 +1636,17 @@ def refund_sale(sale_id):
     reason = (data.get('reason') or '').strip()
     if not reason:
         return jsonify({"error": "Reason required"}), 400
-    conn = get_db_connection()
+    actor = request.current_user['username']
+    journaled = []
     try:
-        conn.execute("BEGIN TRANSACTION")
-        sale = conn.execute("SELECT * FROM sales WHERE id = ?", (sale_id,)).fetchone()
-        if not sale:
-            raise Exception("Sale not found")
-        if sale['status'] != 'completed':
-            raise Exception("Sale not refundable")
-        items = conn.execute("SELECT product_id, quantity FROM sale_items WHERE sale_id = ?", (sale_id,)).fetchall()
-        for it in items:
-            conn.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (it['quantity'], it['product_id']))
-        conn.execute("UPDATE sales SET status = 'refunded' WHERE id = ?", (sale_id,))
-        actor = request.current_user['username']
-        conn.execute("INSERT INTO audit_log (sale_id, action, reason, actor) VALUES (?, ?, ?, ?)",
-                     (sale_id, 'refund', reason, actor))
-        conn.commit()
+        sale_date = REPO.reverse_sale(sale_id, 'refund', reason, actor,
+                                      before_commit=journal_sale_event(journaled, 'refund', reason, actor))
+        invalidate_reversal(sale_date)
+        for entry in journaled:
+            JOURNAL.append(entry)
         return jsonify({"message": "success"})
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/sales/recent', methods=['GET'])
 @token_required
@@ -1062,31 +1660,11 @@ def recent_sales():
     except Exception:
         limit = 50
     limit = max(1, min(limit, 200))
-    conn = get_db_connection()
     try:
-        base = """
-            SELECT id, date, cashier, payment_method, payment_reference, subtotal, vat, total, status
-            FROM sales
-        """
-        params = []
-        where = []
-        if start and end:
-            where.append("DATE(date) BETWEEN ? AND ?")
-            params.extend([start, end])
-        if q:
-            where.append("(CAST(id AS TEXT) LIKE ? OR cashier LIKE ? OR payment_reference LIKE ?)")
-            like = f"%{q}%"
-            params.extend([like, like, like])
-        if where:
-            base += " WHERE " + " AND ".join(where)
-        base += " ORDER BY date DESC LIMIT ?"
-        params.append(limit)
-        rows = conn.execute(base, tuple(params)).fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        rows = REPO.recent_sales(start, end, q, limit)
+        return jsonify({"message": "success", "data": rows})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 @app.route('/api/sales/<int:sale_id>/void', methods=['POST'])
 @token_required
 @role_required(['admin'])
@@ -1095,32 +1673,17 @@ def void_sale(sale_id):
     reason = (data.get('reason') or '').strip()
     if not reason:
         return jsonify({"error": "Reason required"}), 400
-    conn = get_db_connection()
+    actor = request.current_user['username']
+    journaled = []
     try:
-        conn.execute("BEGIN TRANSACTION")
-        sale = conn.execute("SELECT * FROM sales WHERE id = ?", (sale_id,)).fetchone()
-        if not sale:
-            raise Exception("Sale not found")
-        if sale['status'] != 'completed':
-            raise Exception("Sale not voidable")
-        sale_date = conn.execute("SELECT DATE(date) as d FROM sales WHERE id = ?", (sale_id,)).fetchone()['d']
-        today = conn.execute("SELECT DATE('now') as d").fetchone()['d']
-        if sale_date != today:
-            raise Exception("Void only allowed same day")
-        items = conn.execute("SELECT product_id, quantity FROM sale_items WHERE sale_id = ?", (sale_id,)).fetchall()
-        for it in items:
-            conn.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (it['quantity'], it['product_id']))
-        conn.execute("UPDATE sales SET status = 'voided' WHERE id = ?", (sale_id,))
-        actor = request.current_user['username']
-        conn.execute("INSERT INTO audit_log (sale_id, action, reason, actor) VALUES (?, ?, ?, ?)",
-                     (sale_id, 'void', reason, actor))
-        conn.commit()
+        sale_date = REPO.reverse_sale(sale_id, 'void', reason, actor,
+                                      before_commit=journal_sale_event(journaled, 'void', reason, actor))
+        invalidate_reversal(sale_date)
+        for entry in journaled:
+            JOURNAL.append(entry)
         return jsonify({"message": "success"})
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 # PUT /products/<id>/stock
 @app.route('/products/<int:id>/stock', methods=['PUT'])
@@ -1134,15 +1697,11 @@ def update_stock(id):
     if new_stock is None:
         return jsonify({"error": "Stock value required"}), 400
         
-    conn = get_db_connection()
     try:
-        conn.execute("UPDATE products SET stock = ? WHERE id = ?", (new_stock, id))
-        conn.commit()
+        update_product_audited(id, 'stock', new_stock)
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/products/<int:id>/threshold', methods=['PUT'])
 @token_required
@@ -1156,15 +1715,11 @@ def update_low_stock_threshold(id):
         thr_i = int(thr)
     except Exception:
         return jsonify({"error": "invalid threshold"}), 400
-    conn = get_db_connection()
     try:
-        conn.execute("UPDATE products SET low_stock_threshold = ? WHERE id = ?", (thr_i, id))
-        conn.commit()
+        update_product_audited(id, 'low_stock_threshold', thr_i)
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/products/<int:id>/min_price', methods=['PUT'])
 @token_required
 @role_required(['admin'])
@@ -1179,34 +1734,24 @@ def update_min_price(id):
             return jsonify({"error": "invalid min_price"}), 400
     except Exception:
         return jsonify({"error": "invalid min_price"}), 400
-    conn = get_db_connection()
     try:
-        conn.execute("UPDATE products SET min_price = ? WHERE id = ?", (val, id))
-        conn.commit()
+        update_product_audited(id, 'min_price', val)
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 @app.route('/api/products/low-stock', methods=['GET'])
 @token_required
 @role_required(['admin'])
+@coalesced
 def get_low_stock_products():
-    conn = get_db_connection()
     try:
-        rows = conn.execute(
-            "SELECT * FROM products WHERE low_stock_threshold IS NOT NULL AND stock <= low_stock_threshold"
-        ).fetchall()
         data = []
-        for ix in rows:
-            d = dict(ix)
+        for d in REPO.low_stock_products():
             d['low_stock'] = True
             data.append(d)
         return jsonify({"message": "success", "data": data})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/<int:id>/image', methods=['POST'])
 @token_required
@@ -1219,16 +1764,13 @@ def set_product_image(id):
     try:
         secure_url = None
         if os.environ.get('CLOUDINARY_URL'):
-            upload_result = cloudinary.uploader.upload(image_url, folder="pimut/products", public_id=f"product_{id}", overwrite=True)
+            upload_result = get_cloudinary_uploader().upload(image_url, folder="pimut/products", public_id=f"product_{id}", overwrite=True)
             secure_url = upload_result.get('secure_url') or upload_result.get('url')
             if not secure_url:
                 return jsonify({"error": "Upload failed"}), 400
         else:
             secure_url = image_url
-        conn = get_db_connection()
-        conn.execute("UPDATE products SET image_url = ? WHERE id = ?", (secure_url, id))
-        conn.commit()
-        conn.close()
+        update_product_audited(id, 'image_url', secure_url)
         return jsonify({"message": "success", "image_url": secure_url})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -1237,153 +1779,129 @@ def set_product_image(id):
 @token_required
 @role_required(['admin', 'assistant'])
 def remove_product_image(id):
+    if os.environ.get('CLOUDINARY_URL'):
+        try:
+            get_cloudinary_uploader().destroy(f"pimut/products/product_{id}", invalidate=True)
+        except Exception:
+            pass
     try:
-        cloudinary.uploader.destroy(f"pimut/products/product_{id}", invalidate=True)
-    except Exception:
-        pass
-    conn = get_db_connection()
-    try:
-        conn.execute("UPDATE products SET image_url = NULL WHERE id = ?", (id,))
-        conn.commit()
+        update_product_audited(id, 'image_url', None)
         return jsonify({"message": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    finally:
-        conn.close()
 
 # Daily Report (Extra, for frontend compatibility)
 @app.route('/api/sales/daily', methods=['GET'])
 @token_required
 @role_required(['admin', 'assistant'])
+@coalesced
 def get_daily_sales():
-    conn = get_db_connection()
     try:
-        query = """
-            SELECT DATE(date) as sale_date,
-                   COUNT(id) as total_sales,
-                   SUM(subtotal) as subtotal_sum,
-                   SUM(vat) as vat_sum,
-                   SUM(total) as total_revenue
-            FROM sales
-            GROUP BY DATE(date)
-            ORDER BY sale_date DESC
-        """
-        report = conn.execute(query).fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in report]})
+        return jsonify({"message": "success", "data": cached_report('daily_summary', REPO.daily_sales_summary)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/reports/daily', methods=['GET'])
 @token_required
 @role_required(['admin', 'assistant', 'super_admin'])
+@coalesced
 def report_daily():
     start = request.args.get('start')
     end = request.args.get('end')
-    conn = get_db_connection()
     try:
-        base = """
-            SELECT DATE(date) as sale_date,
-                   COUNT(id) as total_sales,
-                   SUM(subtotal) as subtotal_sum,
-                   SUM(vat) as vat_sum,
-                   SUM(total) as total_sum
-            FROM sales
-        """
-        if start and end:
-            base += " WHERE DATE(date) BETWEEN ? AND ?"
-            base += " GROUP BY DATE(date) ORDER BY sale_date DESC"
-            rows = conn.execute(base, (start, end)).fetchall()
-        else:
-            base += " GROUP BY DATE(date) ORDER BY sale_date DESC"
-            rows = conn.execute(base).fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        return jsonify({"message": "success", "data": cached_report(
+            'daily', lambda: REPO.report_daily(start, end), start, end)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/reports/cashier', methods=['GET'])
 @token_required
 @role_required(['admin', 'super_admin'])
+@coalesced
 def report_by_cashier():
     start = request.args.get('start')
     end = request.args.get('end')
-    conn = get_db_connection()
     try:
-        base = """
-            SELECT cashier,
-                   COUNT(id) as total_sales,
-                   SUM(subtotal) as subtotal_sum,
-                   SUM(vat) as vat_sum,
-                   SUM(total) as total_sum
-            FROM sales
-        """
-        if start and end:
-            base += " WHERE DATE(date) BETWEEN ? AND ?"
-            base += " GROUP BY cashier ORDER BY cashier"
-            rows = conn.execute(base, (start, end)).fetchall()
-        else:
-            base += " GROUP BY cashier ORDER BY cashier"
-            rows = conn.execute(base).fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        return jsonify({"message": "success", "data": cached_report(
+            'cashier', lambda: REPO.report_by_cashier(start, end), start, end)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/reports/items', methods=['GET'])
 @token_required
 @role_required(['admin', 'assistant', 'super_admin'])
+@coalesced
 def report_items_daily():
     period = (request.args.get('period') or 'daily').lower()
     start = request.args.get('start')
     end = request.args.get('end')
-    conn = get_db_connection()
     try:
         if period not in ('daily', 'weekly', 'monthly'):
             return jsonify({"error": "Invalid period"}), 400
-        if period == 'daily':
-            label = "DATE(s.date)"
-        elif period == 'weekly':
-            label = "strftime('%Y-W%W', s.date)"
-        else:
-            label = "strftime('%Y-%m', s.date)"
-        base = f"""
-            SELECT {label} AS period_label,
-                   COALESCE(p.name, 'Unknown') AS item_name,
-                   SUM(si.quantity) AS units_sold,
-                   SUM(si.quantity * si.price) AS revenue
-            FROM sale_items si
-            JOIN sales s ON si.sale_id = s.id
-            LEFT JOIN products p ON si.product_id = p.id
-        """
-        params = []
-        where = []
-        if start and end:
-            where.append("DATE(s.date) BETWEEN ? AND ?")
-            params.extend([start, end])
+        return jsonify({"message": "success", "data": cached_report(
+            'items', lambda: REPO.report_items(period, start, end), start, end, period=period)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/reorder', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+@coalesced
+def report_reorder():
+    if analytics.get_numpy() is None:
+        return jsonify({"error": "Reorder analytics unavailable: numpy is not installed"}), 501
+    try:
+        lead_time = max(0, int(request.args.get('lead_time', '7')))
+        cover_days = max(0, int(request.args.get('cover_days', '14')))
+        limit = max(1, min(int(request.args.get('limit', '200')), 5000))
+    except ValueError:
+        return jsonify({"error": "Invalid parameter"}), 400
+    include_all = request.args.get('all') == '1'
+    try:
+        data = REORDER.reorder(lead_time_days=lead_time, cover_days=cover_days, include_all=include_all, limit=limit)
+        return jsonify({"message": "success", "data": data})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/heatmap', methods=['GET'])
+@token_required
+@role_required(['admin', 'assistant', 'super_admin'])
+@coalesced
+def report_heatmap():
+    """Sales by local weekday x hour (?view=series for an hourly time series)."""
+    today = datetime.date.today().isoformat()
+    start = request.args.get('start') or (datetime.date.today() - datetime.timedelta(days=27)).isoformat()
+    end = request.args.get('end') or today
+    view = (request.args.get('view') or 'heatmap').lower()
+    by = request.args.get('by') or None
+    cashier = request.args.get('cashier') or None
+    payment_method = request.args.get('payment_method') or None
+    try:
+        datetime.date.fromisoformat(start)
+        datetime.date.fromisoformat(end)
+        offset = int(request.args.get('tz_offset', buckets.local_offset_minutes()))
+    except ValueError:
+        return jsonify({"error": "Invalid parameter"}), 400
+    if view not in ('heatmap', 'series') or by not in (None, 'cashier', 'payment_method'):
+        return jsonify({"error": "Invalid parameter"}), 400
+    # West of UTC a local day runs into the next UTC day.
+    utc_end = datetime.date.fromisoformat(end) + datetime.timedelta(days=1 if offset < 0 else 0)
+    closed = reportcache.is_closed(start, utc_end.isoformat())
+    try:
+        if view == 'series':
+            data = cached_report('series', lambda: buckets.series(REPO, start, end, offset, cashier, payment_method),
+                                 start, end, closed, tz=offset, cashier=cashier, method=payment_method)
         else:
-            if period == 'daily':
-                where.append("DATE(s.date) = DATE('now','localtime')")
-            elif period == 'weekly':
-                where.append("DATE(s.date) >= DATE('now','-6 days','localtime')")
-            else:
-                where.append("strftime('%Y-%m', s.date) = strftime('%Y-%m','now','localtime')")
-        if where:
-            base += " WHERE " + " AND ".join(where)
-        base += " GROUP BY period_label, item_name ORDER BY period_label DESC, units_sold DESC"
-        rows = conn.execute(base, tuple(params)).fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+            data = cached_report('heatmap', lambda: buckets.heatmap(REPO, start, end, offset, cashier, payment_method, by),
+                                 start, end, closed, tz=offset, cashier=cashier, method=payment_method, by=by)
+        return jsonify({"message": "success", "weekdays": buckets.WEEKDAYS, "start": start, "end": end, "data": data})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/reports/payment_methods', methods=['GET'])
 @token_required
 @role_required_strict(['admin', 'super_admin'])
+@coalesced
 def report_payment_methods():
     period = (request.args.get('period') or 'monthly').lower()
     start = request.args.get('start')
@@ -1395,36 +1913,46 @@ def report_payment_methods():
     user_role = request.current_user['role']
     if user_role == 'super_admin' and period not in ('daily', 'weekly'):
         return jsonify({"error": "Forbidden: super_admin limited to daily or weekly"}), 403
-    if period == 'daily':
-        label = "DATE(date)"
-    elif period == 'weekly':
-        label = "strftime('%Y-W%W', date)"
-    elif period == 'monthly':
-        label = "strftime('%Y-%m', date)"
-    else:
-        label = "strftime('%Y', date)"
-    conn = get_db_connection()
     try:
-        base = f"""
-            SELECT {label} as period_label,
-                   payment_method,
-                   COUNT(id) as total_sales,
-                   SUM(subtotal) as subtotal_sum,
-                   SUM(vat) as vat_sum,
-                   SUM(total) as total_sum
-            FROM sales
-        """
-        params = ()
-        if start and end:
-            base += " WHERE DATE(date) BETWEEN ? AND ?"
-            params = (start, end)
-        base += " GROUP BY period_label, payment_method ORDER BY period_label DESC, payment_method"
-        rows = conn.execute(base, params).fetchall()
-        return jsonify({"message": "success", "data": [dict(ix) for ix in rows]})
+        return jsonify({"message": "success", "data": cached_report(
+            'payment_methods', lambda: REPO.report_payment_methods(period, start, end), start, end, period=period)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# End-of-day close. A closed (UTC) day is frozen into z_reports and
+# z_report_lines; the reports above then read closed days from there and
+# scan sales only for the days still open.
+@app.route('/api/reports/z', methods=['GET'])
+@token_required
+@role_required(['admin', 'super_admin'])
+def list_z_reports():
+    try:
+        return jsonify({"message": "success", "data": REPO.list_z_reports(request.args.get('start'), request.args.get('end'))})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/z/close', methods=['POST'])
+@token_required
+@role_required_strict(['admin', 'super_admin'])
+def close_z_reports():
+    """Close {"day": D}, or every open day through {"through": D} (default: yesterday, UTC)."""
+    data = request.get_json(silent=True) or {}
+    actor = request.current_user['username']
+    try:
+        if data.get('day'):
+            return jsonify({"message": "success", "data": [REPO.close_day(data['day'], actor)]}), 201
+        today = datetime.datetime.utcnow().date()
+        through = datetime.date.fromisoformat(str(data.get('through') or today - datetime.timedelta(days=1))[:10])
+        if through >= today:
+            return jsonify({"error": f"{through} is still open; only past days can be closed"}), 400
+        closed = [REPO.close_day(day, actor) for day in REPO.open_days(through)]
+        return jsonify({"message": "success", "data": closed}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except repository.IntegrityError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/export/sales.csv', methods=['GET'])
 @token_required
@@ -1432,22 +1960,11 @@ def report_payment_methods():
 def export_sales_csv():
     start = request.args.get('start')
     end = request.args.get('end')
-    conn = get_db_connection()
     try:
-        base = """
-            SELECT id, date, cashier, payment_method, payment_reference, subtotal, vat, total, status
-            FROM sales
-        """
-        params = ()
-        if start and end:
-            base += " WHERE DATE(date) BETWEEN ? AND ?"
-            params = (start, end)
-        base += " ORDER BY date DESC"
-        rows = conn.execute(base, params).fetchall()
         output = io.StringIO()
         writer = csv.writer(output)
         writer.writerow(['id','date','cashier','payment_method','payment_reference','subtotal','vat','total','status'])
-        for r in rows:
+        for r in REPO.iter_sales_export(start, end):
             writer.writerow([r['id'], r['date'], r['cashier'], r['payment_method'], r['payment_reference'], r['subtotal'], r['vat'], r['total'], r['status']])
         resp = make_response(output.getvalue())
         resp.headers['Content-Type'] = 'text/csv'
@@ -1455,20 +1972,16 @@ def export_sales_csv():
         return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/export/products.csv', methods=['GET'])
 @token_required
 @role_required(['admin'])
 def export_products_csv():
-    conn = get_db_connection()
     try:
-        rows = conn.execute("SELECT id, name, category, price, stock, barcode, low_stock_threshold, min_price FROM products ORDER BY name").fetchall()
         output = io.StringIO()
         writer = csv.writer(output)
         writer.writerow(['id','name','category','price','stock','barcode','low_stock_threshold','min_price'])
-        for r in rows:
+        for r in REPO.iter_products_export():
             writer.writerow([r['id'], r['name'], r['category'], r['price'], r['stock'], r['barcode'], r['low_stock_threshold'], r['min_price']])
         resp = make_response(output.getvalue())
         resp.headers['Content-Type'] = 'text/csv'
@@ -1476,8 +1989,41 @@ def export_products_csv():
         return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+
+@app.route('/api/export/<any(sales, sale_items, products):table>.<any(parquet, arrow):fmt>', methods=['GET'])
+@token_required
+@role_required(['admin'])
+def export_columnar(table, fmt):
+    """Typed, compressed export for analysts. ?partition=day|month|year returns a zip."""
+    start = request.args.get('start')
+    end = request.args.get('end')
+    partition = request.args.get('partition')
+    if columnar.get_pyarrow() is None:
+        return jsonify({"error": "Columnar export unavailable: pyarrow is not installed"}), 501
+    if partition and (partition not in columnar.PARTITIONS or table not in columnar.DATED_TABLES):
+        return jsonify({"error": "Invalid partition"}), 400
+    try:
+        out = tempfile.TemporaryFile()
+        if partition:
+            with tempfile.TemporaryDirectory() as tmp:
+                files = columnar.export_partitioned(REPO, table, fmt, tmp, partition, start, end)
+                with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as zf:
+                    # Already compressed; store as-is.
+                    for path, _ in files:
+                        zf.write(path, os.path.relpath(path, tmp))
+            name, mimetype = f"{table}_{partition}.zip", 'application/zip'
+        else:
+            columnar.export_table(REPO, table, fmt, out, start, end)
+            name = table + columnar.FORMATS[fmt]
+            mimetype = 'application/vnd.apache.parquet' if fmt == 'parquet' else 'application/vnd.apache.arrow.file'
+        out.seek(0)
+        return send_file(out, mimetype=mimetype, as_attachment=True, download_name=name)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+STARTUP_TIMINGS['module_ready_ms'] = round((time.perf_counter() - _STARTUP_T0) * 1000, 1)
+
+# Development server. For production use serve.py (gunicorn, or waitress on Windows).
 if __name__ == '__main__':
     host = os.environ.get('POS_BIND_HOST', '0.0.0.0')
     port = int(os.environ.get('POS_PORT', '5000'))
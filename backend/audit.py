@@ -0,0 +1,263 @@
+"""Buffered audit log with monthly archival.
+
+Product stock, threshold, min_price and image changes are audited through
+AuditLog.record(). record() only appends to an in-memory buffer. A
+background thread writes the buffer to audit_log in one multi-row
+transaction every flush_interval seconds, or sooner once batch_size
+entries are waiting. Audited requests therefore never wait on an extra
+write. Each entry is stamped when it is recorded, not when it is flushed.
+Refunds and voids still write their audit row inside the refund/void
+transaction: that row is part of the financial record, and the reorder
+analytics read it.
+
+audit_log is indexed on (sale_id), (actor, date) and (date), which covers
+the lookups behind /api/audit. Months older than retain_months are moved
+out of the table into gzip-compressed JSON-lines files, one per month:
+
+    audit-2024-01-<first id>-<last id>.jsonl.gz
+
+A file is written and fsynced before its rows are deleted. The delete and
+the audit_archives bookkeeping row commit together, so a crash part-way
+through leaves rows in the table rather than losing them. The thread
+checks for due months every archive_check_interval seconds. From the
+command line:
+
+    python backend/audit.py --db backend/pos.db --archive-dir /var/lib/pos/audit [--retain-months 12]
+
+Serverless deployments (no background threads) pass flush_interval=0,
+and entries are then written as they are recorded.
+"""
+import argparse
+import atexit
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import repository
+
+# Keep at least the reorder analytics window (90 days) in the live table.
+MIN_RETAIN_MONTHS = 4
+
+
+def utc_now_text():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def month_start(day, months_back=0):
+    """'YYYY-MM-01' of the month months_back before day's month."""
+    index = day.year * 12 + day.month - 1 - months_back
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+
+def next_month(month):
+    """'YYYY-MM-01' following the 'YYYY-MM-01' month."""
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01"
+
+
+class AuditLog:
+    def __init__(self, repo, flush_interval=1.0, batch_size=500, archive_dir=None, retain_months=12,
+                 archive_check_interval=3600.0):
+        self.repo = repo
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.archive_dir = archive_dir
+        self.retain_months = max(int(retain_months), MIN_RETAIN_MONTHS)
+        self.archive_check_interval = archive_check_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._archive_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'recorded': 0, 'flushed': 0, 'batches': 0, 'flush_errors': 0,
+                      'archived_rows': 0, 'archive_files': 0, 'last_flush_ms': None}
+
+    # --- writing ---
+
+    def record(self, action, actor=None, sale_id=None, product_id=None, reason=None, details=None):
+        """Queue an audit entry; details is any JSON-serialisable value."""
+        row = (sale_id, product_id, action, reason, actor,
+               json.dumps(details, separators=(',', ':'), default=str) if details is not None else None,
+               utc_now_text())
+        if self.flush_interval <= 0:
+            self.repo.insert_audit_entries([row])
+            self.stats['recorded'] += 1
+            self.stats['flushed'] += 1
+            return
+        with self._lock:
+            self._buffer.append(row)
+            self.stats['recorded'] += 1
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        """Write buffered entries in one transaction; returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            t = time.perf_counter()
+            try:
+                self.repo.insert_audit_entries(batch)
+            except Exception:
+                with self._lock:
+                    self._buffer[:0] = batch
+                    self.stats['flush_errors'] += 1
+                raise
+            self.stats['flushed'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['last_flush_ms'] = round((time.perf_counter() - t) * 1000, 2)
+            return len(batch)
+
+    # --- archival ---
+
+    def due_months(self, today=None):
+        """Months ('YYYY-MM-01') with live rows that are older than retain_months."""
+        today = today or datetime.datetime.utcnow().date()
+        cutoff = month_start(today, self.retain_months)
+        oldest = self.repo.oldest_audit_date()
+        months = []
+        if not oldest:
+            return months
+        month = oldest[:7] + '-01'
+        while month < cutoff:
+            months.append(month)
+            month = next_month(month)
+        return months
+
+    def archive_month(self, month):
+        """Move one month of audit rows into a compressed file; returns (path, rows)."""
+        if not self.archive_dir:
+            raise RuntimeError("audit archive directory not configured")
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with self._archive_lock:
+            end = next_month(month)
+            tmp = os.path.join(self.archive_dir, f".audit-{month[:7]}.{os.getpid()}.tmp")
+            rows, first_id, last_id = 0, None, None
+            with open(tmp, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as out:
+                    for batch in self.repo.audit_rows(month, end):
+                        for r in batch:
+                            entry = dict(zip(('id', 'date', 'action', 'sale_id', 'product_id', 'actor', 'reason', 'details'), r))
+                            out.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+                            first_id = r[0] if first_id is None else first_id
+                            last_id = r[0]
+                            rows += 1
+                raw.flush()
+                os.fsync(raw.fileno())
+            if not rows:
+                os.remove(tmp)
+                return None, 0
+            name = f"audit-{month[:7]}-{first_id}-{last_id}.jsonl.gz"
+            path = os.path.join(self.archive_dir, name)
+            os.replace(tmp, path)
+            try:
+                self.repo.archive_audit_range(month, end, name, month[:7], first_id, last_id, rows)
+            except Exception:
+                os.remove(path)
+                raise
+            self.stats['archived_rows'] += rows
+            self.stats['archive_files'] += 1
+            return path, rows
+
+    def archive_due(self, today=None):
+        """Archive every month past retention; returns [(path, rows)]."""
+        done = []
+        for month in self.due_months(today):
+            path, rows = self.archive_month(month)
+            if rows:
+                done.append((path, rows))
+        return done
+
+    def info(self):
+        return dict(self.stats, pending=self.pending(), retain_months=self.retain_months,
+                    archive_dir=self.archive_dir, running=self._thread is not None)
+
+    # --- background thread ---
+
+    def start(self):
+        if self._thread is not None or self.flush_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Warning: audit log flush failed at shutdown: {e}")
+
+    def _run(self):
+        next_archive = time.monotonic() + 60
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Warning: audit log flush failed: {e}")
+            if self.archive_dir and time.monotonic() >= next_archive:
+                next_archive = time.monotonic() + self.archive_check_interval
+                try:
+                    self.archive_due()
+                except Exception as e:
+                    print(f"Warning: audit archival failed: {e}")
+
+
+def read_archive(path):
+    """Entries of one archive file, oldest first."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive audit_log months past retention into compressed files.")
+    parser.add_argument('--db', help="SQLite file (default: DB_PATH or backend/pos.db)")
+    parser.add_argument('--database-url', help="PostgreSQL URL instead of --db")
+    parser.add_argument('--archive-dir', required=True)
+    parser.add_argument('--retain-months', type=int, default=12)
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        repo = repository.PostgresRepository(args.database_url)
+    else:
+        db = args.db or os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos.db')
+
+        def connect():
+            conn = sqlite3.connect(db)
+            conn.row_factory = sqlite3.Row
+            return conn
+        import migrations
+        conn = connect()
+        try:
+            migrations.migrate(conn)
+        finally:
+            conn.close()
+        repo = repository.SQLiteRepository(connect)
+    log = AuditLog(repo, flush_interval=0, archive_dir=args.archive_dir, retain_months=args.retain_months)
+    t = time.perf_counter()
+    done = log.archive_due()
+    for path, rows in done:
+        print(f"{rows:,} rows -> {path}")
+    print(f"Archived {sum(r for _, r in done):,} rows in {time.perf_counter() - t:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""Online backups of the SQLite database.
+
+Copying pos.db with cp can catch it half-way through a commit, and the
+WAL holds recent commits that the main file does not have yet. Backups
+here use the sqlite3 backup API instead:
+
+- The copy is read pages_per_step pages at a time, pausing step_pause
+  seconds between steps so checkouts keep their share of the disk and
+  the GIL.
+- The source connection holds one read transaction for the whole copy.
+  In WAL mode that pins a single consistent snapshot and never blocks
+  writers. Without it, every commit made by another connection would
+  restart the copy from page one.
+- The copy is checked with PRAGMA integrity_check, then gzip-compressed
+  into backup_dir as pos-YYYYmmdd-HHMMSS.db.gz. Only the newest keep
+  files are kept.
+
+A backup runs on a background thread (start()). Every few steps its
+progress is written to <backup_dir>/status.json, so any gunicorn worker
+can report it, and an flock on <backup_dir>/.lock keeps two workers from
+running one at the same time. With interval set, the thread also takes
+a backup whenever the newest snapshot is older than interval.
+
+verify(name) decompresses a snapshot into a scratch file and runs the
+integrity check on it. restore() runs the same check, and only then
+replaces the target file. The server must be stopped for a restore:
+
+    python backend/backup.py --db backend/pos.db --dir /var/backups/pos           # take one
+    python backend/backup.py --dir /var/backups/pos --list
+    python backend/backup.py --db backend/pos.db --dir /var/backups/pos --restore pos-20240301-230000.db.gz
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: one waitress process, nothing to coordinate.
+    fcntl = None
+
+PREFIX = 'pos-'
+SUFFIX = '.db.gz'
+
+
+class BackupError(Exception):
+    pass
+
+
+def checkpoint(path):
+    """Fold path's WAL back into the main file; False if SQLite could not."""
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+    return not busy
+
+
+def integrity_check(path):
+    """'ok', or SQLite's first complaint about the file at path."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        return str(e)
+    finally:
+        conn.close()
+
+
+class BackupService:
+    def __init__(self, db_path, backup_dir, keep=7, pages_per_step=256, step_pause=0.005, interval=0.0,
+                 check_interval=300.0):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep = max(1, int(keep))
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self.interval = interval
+        self.check_interval = check_interval
+        self.status_path = os.path.join(backup_dir, 'status.json')
+        self._lock = threading.Lock()
+        self._job = None
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(backup_dir, exist_ok=True)
+
+    # --- snapshots on disk ---
+
+    def list(self):
+        """Snapshots, newest first: [{"name", "bytes", "created_at"}]."""
+        out = []
+        for name in os.listdir(self.backup_dir):
+            if name.startswith(PREFIX) and name.endswith(SUFFIX):
+                st = os.stat(os.path.join(self.backup_dir, name))
+                out.append({'name': name, 'bytes': st.st_size,
+                            'created_at': datetime.datetime.utcfromtimestamp(st.st_mtime).strftime('%Y-%m-%dT%H:%M:%SZ')})
+        return sorted(out, key=lambda s: s['name'], reverse=True)
+
+    def path_of(self, name):
+        if os.path.basename(name) != name or not (name.startswith(PREFIX) and name.endswith(SUFFIX)):
+            raise BackupError(f"not a snapshot name: {name}")
+        path = os.path.join(self.backup_dir, name)
+        if not os.path.exists(path):
+            raise BackupError(f"no such snapshot: {name}")
+        return path
+
+    def _rotate(self):
+        for snapshot in self.list()[self.keep:]:
+            os.remove(os.path.join(self.backup_dir, snapshot['name']))
+
+    # --- taking a backup ---
+
+    def status(self):
+        """The running or last backup's progress, from any process."""
+        try:
+            with open(self.status_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_status(self, job):
+        tmp = self.status_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp, self.status_path)
+
+    def running(self):
+        with self._lock:
+            return self._job is not None
+
+    def busy(self):
+        """True while a backup runs here or in another process."""
+        if self.running():
+            return True
+        lock_file = self._lock_file()
+        if lock_file is False:
+            return True
+        if lock_file is not None:
+            lock_file.close()
+        return False
+
+    def start(self):
+        """Start a backup on a background thread; False if one is already running."""
+        if self.busy():
+            return False
+        with self._lock:
+            if self._job is not None:
+                return False
+            self._job = {}
+        threading.Thread(target=self._run_job, name='db-backup', daemon=True).start()
+        return True
+
+    def _run_job(self):
+        try:
+            self.backup()
+        except Exception as e:
+            print(f"Warning: database backup failed: {e}")
+        finally:
+            with self._lock:
+                self._job = None
+
+    def backup(self):
+        """Take a snapshot now; returns its final status record."""
+        lock_file = self._lock_file()
+        if lock_file is False:
+            raise BackupError("a backup is already running")
+        try:
+            return self._backup()
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def _lock_file(self):
+        """The held cross-process lock, None where there is none, False if taken."""
+        if fcntl is None:
+            return None
+        f = open(os.path.join(self.backup_dir, '.lock'), 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        return f
+
+    def _backup(self):
+        now = datetime.datetime.utcnow()
+        name = f"{PREFIX}{now.strftime('%Y%m%d-%H%M%S')}{SUFFIX}"
+        job = {'state': 'copying', 'name': name, 'started_at': now.strftime('%Y-%m-%dT%H:%M:%SZ'),
+               'pages_total': None, 'pages_done': 0, 'percent': 0.0, 'steps': 0}
+        self._write_status(job)
+        t0 = time.perf_counter()
+        fd, raw = tempfile.mkstemp(prefix='.copy-', suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            src = sqlite3.connect(self.db_path, isolation_level=None)
+            dst = sqlite3.connect(raw)
+            try:
+                # One read transaction for the whole copy: a fixed snapshot.
+                src.execute("BEGIN")
+                src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+                def progress(status, remaining, total):
+                    job['steps'] += 1
+                    job['pages_total'], job['pages_done'] = total, total - remaining
+                    job['percent'] = round(100.0 * (total - remaining) / total, 1) if total else 100.0
+                    if job['steps'] % 8 == 0:
+                        self._write_status(job)
+                    if remaining and self.step_pause:
+                        time.sleep(self.step_pause)
+                src.backup(dst, pages=self.pages_per_step, progress=progress)
+                src.rollback()
+            finally:
+                dst.close()
+                src.close()
+            job['copy_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+
+            job['state'] = 'verifying'
+            self._write_status(job)
+            result = integrity_check(raw)
+            if result != 'ok':
+                raise BackupError(f"integrity check failed on the copy: {result}")
+
+            job['state'] = 'compressing'
+            self._write_status(job)
+            final = os.path.join(self.backup_dir, name)
+            with open(raw, 'rb') as f_in, gzip.open(final + '.tmp', 'wb', compresslevel=6) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            os.replace(final + '.tmp', final)
+            job.update(state='done', raw_bytes=os.path.getsize(raw), bytes=os.path.getsize(final),
+                       ms=round((time.perf_counter() - t0) * 1000, 1))
+        except Exception as e:
+            job.update(state='failed', error=str(e))
+            self._write_status(job)
+            raise
+        finally:
+            os.remove(raw)
+        self._rotate()
+        self._write_status(job)
+        return job
+
+    # --- checking and restoring ---
+
+    def _unpack(self, name, dest):
+        with gzip.open(self.path_of(name), 'rb') as f_in, open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+    def verify(self, name):
+        """{"name", "integrity", "ok", "tables"} for a snapshot, checked on a scratch copy."""
+        fd, scratch = tempfile.mkstemp(suffix='.db', dir=self.backup_dir)
+        os.close(fd)
+        try:
+            try:
+                self._unpack(name, scratch)
+            except (OSError, EOFError) as e:
+                return {'name': name, 'integrity': f"cannot decompress: {e}", 'ok': False}
+            result = integrity_check(scratch)
+            out = {'name': name, 'integrity': result, 'ok': result == 'ok'}
+            if out['ok']:
+                conn = sqlite3.connect(scratch)
+                try:
+                    out['schema_version'] = conn.execute("PRAGMA user_version").fetchone()[0]
+                    out['tables'] = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0]
+                                     for (t,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                                              "AND name IN ('products', 'sales', 'users')")}
+                finally:
+                    conn.close()
+            return out
+        finally:
+            os.remove(scratch)
+
+    def restore(self, name, target):
+        """Replace target with a snapshot, once it has passed the integrity check.
+
+        Only with the server stopped. The file it replaces is kept as
+        <target>.before-restore. Commits still in its WAL are checkpointed
+        into it first; if that fails (a damaged file), its -wal and -shm
+        are kept beside it as .before-restore-wal and .before-restore-shm.
+        """
+        tmp = target + '.restoring'
+        self._unpack(name, tmp)
+        result = integrity_check(tmp)
+        if result != 'ok':
+            os.remove(tmp)
+            raise BackupError(f"{name} failed the integrity check: {result}")
+        if os.path.exists(target):
+            checkpoint(target)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(target + suffix):
+                    os.replace(target + suffix, target + '.before-restore' + suffix)
+            os.replace(target, target + '.before-restore')
+        os.replace(tmp, target)
+        return result
+
+    # --- scheduled backups ---
+
+    def due(self):
+        snapshots = self.list()
+        if not snapshots:
+            return True
+        newest = os.path.getmtime(os.path.join(self.backup_dir, snapshots[0]['name']))
+        return time.time() - newest >= self.interval
+
+    def start_schedule(self):
+        if self._thread is not None or not self.interval:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._schedule, name='db-backup-schedule', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _schedule(self):
+        while not self._stop.wait(self.check_interval):
+            if self.due():
+                self.start()
+
+    def info(self):
+        return {'backup_dir': self.backup_dir, 'keep': self.keep, 'interval': self.interval,
+                'running': self.busy(), 'status': self.status(), 'snapshots': self.list()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up, verify or restore the POS SQLite database.")
+    parser.add_argument('--db', help="SQLite file (default: DB_PATH or backend/pos.db)")
+    parser.add_argument('--dir', required=True, help="Snapshot directory")
+    parser.add_argument('--keep', type=int, default=7)
+    parser.add_argument('--list', action='store_true', help="List snapshots")
+    parser.add_argument('--verify', metavar='NAME', help="Integrity-check a snapshot")
+    parser.add_argument('--restore', metavar='NAME', help="Replace --db with a verified snapshot (server stopped)")
+    args = parser.parse_args(argv)
+
+    db = args.db or os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos.db')
+    service = BackupService(db, args.dir, keep=args.keep)
+    if args.list:
+        for s in service.list():
+            print(f"{s['name']}  {s['bytes']:>12,}  {s['created_at']}")
+    elif args.verify:
+        print(json.dumps(service.verify(args.verify), indent=2))
+    elif args.restore:
+        service.restore(args.restore, db)
+        print(f"Restored {args.restore} to {db} (previous file kept as {db}.before-restore)")
+    else:
+        job = service.backup()
+        print(f"{job['name']}: {job['raw_bytes']:,} -> {job['bytes']:,} bytes in {job['ms']} ms "
+              f"({job['steps']} steps)")
+
+
+if __name__ == '__main__':
+    main()
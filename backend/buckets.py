@@ -0,0 +1,151 @@
+"""Hourly sales buckets behind the heatmap and time-series reports.
+
+sales_buckets holds one row per (UTC day, hour, cashier, payment_method).
+Each row carries sale, refund and void counts and totals. Rows are kept
+current inside the same transaction as each sale, refund or void,
+including sales applied by journal replay. The heatmap therefore reads at
+most days x 24 x cashiers x methods small rows instead of scanning sales.
+
+Buckets are keyed by the sale's own timestamp. A refund is counted in the
+hour the sale was rung up, which is the hour that matters for staffing.
+Hours are UTC on disk. heatmap() and series() shift them to the store's
+offset when reading.
+
+The SQL below is plain enough for both SQLite and PostgreSQL. To rebuild
+buckets from sales, e.g. after a bulk import or stress_data.py:
+
+    python backend/buckets.py --db backend/pos.db [--start 2024-01-01 --end 2024-12-31]
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+
+_KEY = "substr(date, 1, 10), CAST(substr(date, 12, 2) AS INTEGER), COALESCE(cashier, ''), COALESCE(payment_method, '')"
+
+
+def _upsert(count_col, total_col):
+    return f"""
+        INSERT INTO sales_buckets (day, hour, cashier, payment_method, {count_col}, {total_col})
+        SELECT {_KEY}, 1, COALESCE(total, 0) FROM sales WHERE id = ?
+        ON CONFLICT (day, hour, cashier, payment_method) DO UPDATE SET
+            {count_col} = sales_buckets.{count_col} + excluded.{count_col},
+            {total_col} = sales_buckets.{total_col} + excluded.{total_col}
+    """
+
+
+# Run with (sale_id,) inside the transaction that wrote the sale / reversal.
+ADD_SALE_SQL = _upsert('sales_count', 'sales_total')
+ADD_REVERSAL_SQL = {
+    'refund': _upsert('refund_count', 'refund_total'),
+    'void': _upsert('void_count', 'void_total'),
+}
+
+REBUILD_SQL = f"""
+    INSERT INTO sales_buckets (day, hour, cashier, payment_method, sales_count, sales_total,
+                               refund_count, refund_total, void_count, void_total)
+    SELECT {_KEY},
+           COUNT(*), SUM(COALESCE(total, 0)),
+           SUM(CASE WHEN status = 'refunded' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN status = 'refunded' THEN COALESCE(total, 0) ELSE 0 END),
+           SUM(CASE WHEN status = 'voided' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN status = 'voided' THEN COALESCE(total, 0) ELSE 0 END)
+    FROM sales
+    WHERE date IS NOT NULL {{where}}
+    GROUP BY {_KEY}
+"""
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def local_offset_minutes():
+    """This server's UTC offset, matching the 'localtime' used by other reports."""
+    return int(datetime.datetime.now().astimezone().utcoffset().total_seconds() // 60)
+
+
+def _cell():
+    return {"sales": 0, "total": 0.0, "refunds": 0, "voids": 0, "net": 0.0}
+
+
+def _add(cell, row):
+    cell["sales"] += row['sales_count']
+    cell["total"] += row['sales_total']
+    cell["refunds"] += row['refund_count']
+    cell["voids"] += row['void_count']
+    cell["net"] += row['sales_total'] - row['refund_total'] - row['void_total']
+
+
+def _local_rows(repo, start, end, offset_minutes, cashier=None, payment_method=None, group=None):
+    """Summed bucket rows with their local datetime, limited to local days start..end."""
+    start_day = datetime.date.fromisoformat(start)
+    end_day = datetime.date.fromisoformat(end)
+    # Local days can begin/end on the neighbouring UTC day.
+    utc_rows = repo.bucket_rows((start_day - datetime.timedelta(days=1)).isoformat(),
+                                (end_day + datetime.timedelta(days=1)).isoformat(), cashier, payment_method, group)
+    shift = datetime.timedelta(minutes=offset_minutes)
+    for row in utc_rows:
+        local = datetime.datetime.fromisoformat(row['day']) + datetime.timedelta(hours=row['hour']) + shift
+        if start_day <= local.date() <= end_day:
+            yield local, row
+
+
+def heatmap(repo, start, end, offset_minutes=0, cashier=None, payment_method=None, by=None):
+    """7 x 24 grid (Monday first) of local weekday x hour, optionally one grid per cashier/method."""
+    grids = {}
+    for local, row in _local_rows(repo, start, end, offset_minutes, cashier, payment_method, by):
+        group = row[by] if by else 'all'
+        grid = grids.get(group)
+        if grid is None:
+            grid = grids[group] = [[_cell() for _ in range(24)] for _ in range(7)]
+        _add(grid[local.weekday()][local.hour], row)
+    for grid in grids.values():
+        for day in grid:
+            for cell in day:
+                cell["total"] = round(cell["total"], 2)
+                cell["net"] = round(cell["net"], 2)
+    return grids
+
+
+def series(repo, start, end, offset_minutes=0, cashier=None, payment_method=None):
+    """Per local hour totals, oldest first; hours without sales are omitted."""
+    points = {}
+    for local, row in _local_rows(repo, start, end, offset_minutes, cashier, payment_method):
+        key = local.strftime('%Y-%m-%d %H:00')
+        _add(points.setdefault(key, _cell()), row)
+    return [dict(cell, hour=key, total=round(cell["total"], 2), net=round(cell["net"], 2))
+            for key, cell in sorted(points.items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the hourly sales buckets from the sales table.")
+    parser.add_argument('--db', help="SQLite file (default: DB_PATH or backend/pos.db)")
+    parser.add_argument('--database-url', help="PostgreSQL URL instead of --db")
+    parser.add_argument('--start', help="First UTC day to rebuild (default: all history)")
+    parser.add_argument('--end', help="Last UTC day to rebuild")
+    args = parser.parse_args(argv)
+
+    import repository  # repository imports this module for the SQL above
+    if args.database_url:
+        repo = repository.PostgresRepository(args.database_url)
+    else:
+        db = args.db or os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos.db')
+
+        def connect():
+            conn = sqlite3.connect(db)
+            conn.row_factory = sqlite3.Row
+            return conn
+        import migrations
+        conn = connect()
+        try:
+            migrations.migrate(conn)
+        finally:
+            conn.close()
+        repo = repository.SQLiteRepository(connect)
+    t = time.perf_counter()
+    rows = repo.rebuild_buckets(args.start, args.end)
+    print(f"Rebuilt {rows:,} buckets in {time.perf_counter() - t:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Compact binary catalog snapshot for till start-up (/api/pos/catalog.bin).
+
+A till needs id, name, category, price, min price, stock, barcode, image
+and the low-stock flag for every product. JSON repeats every key and
+category name per row. This format stores each column once as a
+fixed-width little-endian array, which the browser can view directly as
+typed arrays. Names, categories and image URLs go into a deduplicated
+UTF-8 string table. The browser splits the string table and the barcode
+block with a single TextDecoder call each, not one call per row.
+
+Layout (all little-endian, every section 4-byte aligned):
+
+    header    magic "POSC", u16 format version, u16 barcode width,
+              u32 catalog revision, u32 product count n,
+              u32 string count s, u32 string bytes
+    f64[n]    price
+    f64[n]    min_price (NaN = none)
+    u32[n]    id
+    i32[n]    stock
+    u32[n]    name, category, image_url: string indexes (0xFFFFFFFF = none)
+    u8[n]     flags (bit 0: low stock), padded to 4
+    u8[n*w]   barcode, UTF-8, NUL-padded to the barcode width w, padded to 4
+    u8[...]   string table: the s strings, UTF-8, each followed by a NUL
+
+The snapshot is rebuilt only when table_revisions.products changes.
+"""
+import array
+import gzip
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'POSC'
+FORMAT_VERSION = 1
+NONE = 0xFFFFFFFF
+HEADER = struct.Struct('<4sHHIIII')
+COLUMNS = ('id', 'name', 'category', 'price', 'min_price', 'stock', 'barcode', 'image_url', 'low_stock_threshold')
+
+
+def _le(kind, values):
+    a = array.array(kind, values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+
+def _pad4(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def build_snapshot(rows, revision):
+    """Encode catalog rows (tuples in COLUMNS order) into the binary snapshot."""
+    strings, index = [], {}
+
+    def intern(value):
+        if value is None:
+            return NONE
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(strings)
+            strings.append(value)
+        return i
+
+    ids, prices, min_prices, stocks, names, categories, images, flags, barcodes = [], [], [], [], [], [], [], [], []
+    for pid, name, category, price, min_price, stock, barcode, image_url, threshold in rows:
+        ids.append(pid)
+        names.append(intern(name))
+        categories.append(intern(category))
+        images.append(intern(image_url))
+        prices.append(float(price or 0))
+        min_prices.append(float(min_price) if min_price is not None else float('nan'))
+        stocks.append(int(stock or 0))
+        flags.append(1 if threshold is not None and (stock or 0) <= int(threshold) else 0)
+        barcodes.append(str(barcode).strip().encode('utf-8') if barcode else b'')
+
+    width = max((len(b) for b in barcodes), default=0)
+    # NUL never appears in names or URLs, so it can end each string.
+    blob = ''.join(s.replace('\0', '') + '\0' for s in strings).encode('utf-8')
+
+    return b''.join([
+        HEADER.pack(MAGIC, FORMAT_VERSION, width, revision & 0xFFFFFFFF, len(ids), len(strings), len(blob)),
+        _le('d', prices),
+        _le('d', min_prices),
+        _le('I', ids),
+        _le('i', stocks),
+        _le('I', names),
+        _le('I', categories),
+        _le('I', images),
+        _pad4(bytes(flags)),
+        _pad4(b''.join(b.ljust(width, b'\0') for b in barcodes)),
+        blob,
+    ])
+
+
+def read_snapshot(data):
+    """Decode a snapshot back into (revision, [dict, ...]); mirrors decodeCatalog() in app.js."""
+    magic, version, width, revision, n, s, blob_len = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("not a catalog snapshot")
+    pos = HEADER.size
+
+    def take(kind, count, size):
+        nonlocal pos
+        a = array.array(kind)
+        a.frombytes(data[pos:pos + count * size])
+        if sys.byteorder != 'little':
+            a.byteswap()
+        pos += count * size
+        return a
+
+    prices, min_prices = take('d', n, 8), take('d', n, 8)
+    ids, stocks = take('I', n, 4), take('i', n, 4)
+    names, categories, images = take('I', n, 4), take('I', n, 4), take('I', n, 4)
+    flags = data[pos:pos + n]
+    pos += n + (-n % 4)
+    barcodes = data[pos:pos + n * width]
+    pos += n * width + (-(n * width) % 4)
+    strings = data[pos:pos + blob_len].decode('utf-8').split('\0')[:s]
+
+    def text(i):
+        return None if i == NONE else strings[i]
+
+    products = []
+    for i in range(n):
+        barcode = barcodes[i * width:(i + 1) * width].rstrip(b'\0').decode('utf-8')
+        products.append({
+            "id": ids[i], "name": text(names[i]), "category": text(categories[i]),
+            "price": prices[i], "min_price": None if min_prices[i] != min_prices[i] else min_prices[i],
+            "stock": stocks[i], "barcode": barcode or None, "image_url": text(images[i]),
+            "low_stock": bool(flags[i] & 1),
+        })
+    return revision, products
+
+
+class CatalogCache:
+    """Builds the snapshot once per catalog revision; keeps raw and gzip bytes."""
+
+    def __init__(self, repo, revision=None):
+        self.repo = repo
+        self._revision = revision or (lambda: repo.table_revision('products'))
+        self._lock = threading.Lock()
+        self._current = None
+        self.stats = {'builds': 0, 'hits': 0, 'last_build_ms': None}
+
+    def get(self):
+        """(revision, raw bytes, gzip bytes) for the current catalog."""
+        revision = self._revision()
+        current = self._current
+        if current is not None and current[0] == revision:
+            self.stats['hits'] += 1
+            return current
+        with self._lock:
+            current = self._current
+            if current is not None and current[0] == revision:
+                self.stats['hits'] += 1
+                return current
+            t = time.perf_counter()
+            # The revision is read before the rows, so the rows are never
+            # older than the revision they are cached under.
+            data = build_snapshot(self.repo.catalog_rows(), revision)
+            self._current = (revision, data, gzip.compress(data, 6))
+            self.stats['builds'] += 1
+            self.stats['last_build_ms'] = round((time.perf_counter() - t) * 1000, 1)
+            return self._current
+
+    def info(self):
+        current = self._current
+        return dict(self.stats, revision=current[0] if current else None,
+                    bytes=len(current[1]) if current else None, gzip_bytes=len(current[2]) if current else None)
@@ -0,0 +1,111 @@
+"""Cross-process cache coherence for multi-worker deployments.
+
+Under several gunicorn workers each process keeps its own report cache,
+catalog snapshot and user lookups. Writes made by one worker have to reach
+the others' caches. Coherence checks for that at the start of every
+request, in two steps:
+
+1. PRAGMA data_version on a dedicated, never-writing SQLite connection.
+   The value changes whenever any other connection, in this process or
+   another, commits to the file. It is answered from memory, so an
+   unchanged value costs about a microsecond and ends the check.
+2. Only when it has moved is table_revisions read (one small query).
+   Triggers bump a per-table counter on every write (see migrations 5,
+   10 and 13). Listeners registered with watch() run for each table whose
+   counter changed since the last check.
+
+Invalidation therefore happens lazily, and only when a write has actually
+been committed. The watcher cannot tell its own process's commits from
+another's. Those caches were already invalidated eagerly, so the second
+invalidation costs one recompute.
+
+PostgreSQL has no data_version. There, table_revisions is polled at most
+every poll_interval seconds, which bounds how stale another worker's
+caches can get.
+
+The first check only records the baseline; caches are empty at that point.
+
+version counts the changes seen: every data_version move on SQLite, or
+every poll that found a revision change on PostgreSQL. Requests that read
+the same version saw the same committed writes. The request coalescing in
+app.py relies on that.
+"""
+import sqlite3
+import threading
+import time
+
+
+class Coherence:
+    def __init__(self, repo, db_path=None, poll_interval=1.0, prepare=None):
+        self.repo = repo
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._prepare = prepare
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._polled_at = 0.0
+        self._revisions = None
+        self._listeners = {}
+        self.version = 0
+        self.stats = {'checks': 0, 'unchanged': 0, 'revision_reads': 0, 'invalidations': 0}
+
+    def watch(self, table, callback):
+        """Call callback() whenever table's revision moves."""
+        self._listeners.setdefault(table, []).append(callback)
+
+    def check(self):
+        """Run listeners for tables written since the last check; returns their names."""
+        if self._prepare is not None:
+            self._prepare()
+        with self._lock:
+            self.stats['checks'] += 1
+            if not self._maybe_changed():
+                self.stats['unchanged'] += 1
+                return []
+            # data_version is read before the revisions, so the revisions
+            # are at least as new as the version they are recorded against.
+            revisions = self.repo.table_revisions()
+            self.stats['revision_reads'] += 1
+            previous, self._revisions = self._revisions, revisions
+            if self.db_path is not None or revisions != previous:
+                self.version += 1
+        if previous is None:
+            return []
+        changed = [name for name, revision in revisions.items() if previous.get(name) != revision]
+        for name in changed:
+            for callback in self._listeners.get(name, ()):
+                callback()
+                self.stats['invalidations'] += 1
+        return changed
+
+    def revision(self, table):
+        """table's revision as of a fresh check (0 if untracked)."""
+        self.check()
+        return (self._revisions or {}).get(table, 0)
+
+    def _maybe_changed(self):
+        if self.db_path is None:
+            now = time.monotonic()
+            if self._revisions is not None and now - self._polled_at < self.poll_interval:
+                return False
+            self._polled_at = now
+            return True
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version and self._revisions is not None:
+            return False
+        self._data_version = version
+        return True
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, mode='poll' if self.db_path is None else 'data_version', version=self.version,
+                        revisions=dict(self._revisions or {}), watched=sorted(self._listeners))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,196 @@
+"""Columnar (Parquet / Arrow IPC) exports of sales, sale_items and products.
+
+Rows are pulled from the repository in fetchmany batches and converted
+straight into Arrow record batches with typed columns. Nothing is
+materialised beyond one batch. Dates become timestamps,
+money is float64 and ids/quantities are int64. Output is zstd-compressed.
+
+Dated tables (sales, sale_items) can be split into Hive-style partitions,
+e.g. sales/month=2024-01/part-0.parquet. Rows arrive in date order, so only
+one partition file is open at a time.
+
+pyarrow is optional. It is imported on first use, and exports report it as
+unavailable when it is missing. From the command line:
+
+    python backend/columnar.py --db backend/pos.db --out /tmp/export --partition month
+"""
+import argparse
+import os
+import sqlite3
+import time
+import repository
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+PARTITIONS = {'day': 10, 'month': 7, 'year': 4}
+DATED_TABLES = ('sales', 'sale_items')
+
+# Arrow type per exported column (see repository.EXPORT_COLUMNS).
+COLUMN_TYPES = {
+    'id': 'int64', 'sale_id': 'int64', 'product_id': 'int64', 'parent_id': 'int64',
+    'quantity': 'int64', 'stock': 'int64', 'low_stock_threshold': 'int64',
+    'price': 'float64', 'subtotal': 'float64', 'vat': 'float64', 'total': 'float64', 'min_price': 'float64',
+    'date': 'timestamp', 'sale_date': 'timestamp',
+}
+
+_NO_PARTITION = object()
+_pyarrow = None
+
+
+def get_pyarrow():
+    """Import pyarrow on first use; returns None when it is not installed."""
+    global _pyarrow
+    if _pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+            _pyarrow = pyarrow
+        except ImportError:
+            _pyarrow = False
+    return _pyarrow or None
+
+
+def arrow_schema(pa, columns):
+    fields = []
+    for name in columns:
+        kind = COLUMN_TYPES.get(name, 'string')
+        if kind == 'timestamp':
+            fields.append(pa.field(name, pa.timestamp('s')))
+        else:
+            fields.append(pa.field(name, getattr(pa, kind)()))
+    return pa.schema(fields)
+
+
+def to_record_batch(pa, schema, rows):
+    arrays = []
+    for i, field in enumerate(schema):
+        values = [r[i] for r in rows]
+        if pa.types.is_timestamp(field.type):
+            # Stored as 'YYYY-MM-DD HH:MM:SS' text in both engines.
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Writer:
+    """One output file of either format."""
+
+    def __init__(self, pa, fmt, sink, schema, compression):
+        if fmt == 'parquet':
+            self._w = pa.parquet.ParquetWriter(sink, schema, compression=compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._w = pa.ipc.new_file(sink, schema, options=options)
+
+    def write(self, batch):
+        self._w.write_batch(batch)
+
+    def close(self):
+        self._w.close()
+
+
+def export_table(repo, table, fmt, sink, start=None, end=None, batch_size=50000, compression='zstd'):
+    """Write one table to sink (path or binary file object); returns rows written."""
+    pa = _require_pyarrow()
+    schema = arrow_schema(pa, repository.EXPORT_COLUMNS[table])
+    writer = _Writer(pa, fmt, sink, schema, compression)
+    rows_written = 0
+    try:
+        for rows in repo.export_batches(table, start, end, batch_size):
+            writer.write(to_record_batch(pa, schema, rows))
+            rows_written += len(rows)
+    finally:
+        writer.close()
+    return rows_written
+
+
+def export_partitioned(repo, table, fmt, out_dir, partition='month', start=None, end=None,
+                       batch_size=50000, compression='zstd'):
+    """Write table under out_dir/<table>/<partition>=<key>/part-0.<ext>; returns [(path, rows)]."""
+    if table not in DATED_TABLES:
+        raise ValueError(f"{table} has no date to partition by")
+    pa = _require_pyarrow()
+    columns = repository.EXPORT_COLUMNS[table]
+    schema = arrow_schema(pa, columns)
+    date_idx = columns.index('sale_date' if table == 'sale_items' else 'date')
+    width = PARTITIONS[partition]
+    files = []
+    writer, current = None, _NO_PARTITION
+    try:
+        for rows in repo.export_batches(table, start, end, batch_size):
+            # Rows are date-ordered, so each batch splits into contiguous runs.
+            run_start = 0
+            for i in range(len(rows) + 1):
+                key = rows[i][date_idx][:width] if i < len(rows) and rows[i][date_idx] else None
+                if i < len(rows) and key == current:
+                    continue
+                if i > run_start:
+                    writer.write(to_record_batch(pa, schema, rows[run_start:i]))
+                    files[-1][1] += i - run_start
+                if i == len(rows):
+                    break
+                if writer is not None:
+                    writer.close()
+                current = key
+                part_dir = os.path.join(out_dir, table, f"{partition}={key or 'unknown'}")
+                os.makedirs(part_dir, exist_ok=True)
+                path = os.path.join(part_dir, 'part-0' + FORMATS[fmt])
+                writer = _Writer(pa, fmt, path, schema, compression)
+                files.append([path, 0])
+                run_start = i
+    finally:
+        if writer is not None:
+            writer.close()
+    return [tuple(f) for f in files]
+
+
+def _require_pyarrow():
+    pa = get_pyarrow()
+    if pa is None:
+        raise RuntimeError("Columnar export needs pyarrow (pip install pyarrow)")
+    return pa
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export sales, sale_items and products to Parquet or Arrow.")
+    parser.add_argument('--db', help="SQLite file to read (default: DB_PATH or backend/pos.db)")
+    parser.add_argument('--database-url', help="PostgreSQL URL instead of --db")
+    parser.add_argument('--out', required=True, help="Output directory")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    parser.add_argument('--tables', default='sales,sale_items,products')
+    parser.add_argument('--start', help="First day (YYYY-MM-DD) of dated tables")
+    parser.add_argument('--end', help="Last day (YYYY-MM-DD) of dated tables")
+    parser.add_argument('--partition', choices=sorted(PARTITIONS), help="Split dated tables by period")
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--compression', default='zstd')
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        repo = repository.PostgresRepository(args.database_url)
+    else:
+        db = args.db or os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos.db')
+
+        def connect():
+            conn = sqlite3.connect(f"file:{os.path.abspath(db)}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            return conn
+        repo = repository.SQLiteRepository(connect)
+
+    os.makedirs(args.out, exist_ok=True)
+    for table in [t.strip() for t in args.tables.split(',') if t.strip()]:
+        t = time.perf_counter()
+        if args.partition and table in DATED_TABLES:
+            files = export_partitioned(repo, table, args.format, args.out, args.partition, args.start, args.end,
+                                       args.batch_size, args.compression)
+            rows = sum(n for _, n in files)
+            where = f"{len(files)} partitions under {os.path.join(args.out, table)}"
+        else:
+            path = os.path.join(args.out, table + FORMATS[args.format])
+            rows = export_table(repo, table, args.format, path, args.start, args.end, args.batch_size, args.compression)
+            where = path
+        print(f"{table}: {rows:,} rows in {time.perf_counter() - t:.2f}s -> {where}")
+
+
+if __name__ == '__main__':
+    main()
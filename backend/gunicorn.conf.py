@@ -0,0 +1,94 @@
+"""Production gunicorn profile (Linux/macOS). From the backend directory:
+
+    gunicorn app:app                 # this file is picked up automatically
+    python serve.py                  # same, and falls back to waitress on Windows
+
+Sizing for SQLite in WAL mode. Readers run in parallel, but commits are
+serialised by the database lock. Extra processes therefore buy parallel
+Python for reads and JSON encoding, not more write throughput. Threads
+release the GIL while SQLite works, which covers I/O and lock waits. The
+defaults are one process per core, capped at 4, with 4 threads each.
+With DATABASE_URL on PostgreSQL, POS_WORKERS can go higher; keep
+POS_PG_POOL_MAX at or above POS_THREADS.
+
+preload_app imports the app once in the master. Migrations, seeding and
+journal replay therefore run once rather than racing in every worker.
+Workers fork with that state, and post_fork below starts each worker's
+own background threads and database pools (app.after_fork).
+
+Reloads:
+- kill -HUP <master>: re-reads this file and replaces the workers
+  gracefully. Because the app is preloaded, they come back with the code
+  the master already has.
+- To deploy new code without dropping connections, use kill -USR2
+  <master> (a new master with the new code starts alongside the old one),
+  then kill -WINCH and kill -QUIT the old master once the new one is
+  serving.
+- Either way, in-flight requests get graceful_timeout seconds to finish.
+
+keepalive is sized for tills on the LAN that poll the catalog and post
+sales over a reused connection. The server holds an idle connection a
+little longer than a typical till's request interval.
+
+Measured with backend/loadtest.py (16 clients, 20 s) against a
+stress_data.py database of 2,000 products and 135k sales. The VM had a
+single core, which it shared with the load generator:
+
+    mix catalog=1 (keep-alive 304s)          req/s   p50 ms   p99 ms
+    app.run (Flask development server)        492     31.7     58.9
+    gunicorn 1 worker x 1 thread              655     24.5     36.1
+    gunicorn 1 worker x 4 threads             705     22.4     35.9
+    gunicorn 2 workers x 4 threads            676     23.9     53.1
+    waitress 8 threads (serve.py, Windows)    675     22.7     44.0
+
+    mix catalog=6,sale=3,report=1             req/s   p50 ms   p99 ms
+    app.run (Flask development server)       46.9    348     1188
+    gunicorn 1 worker x 1 thread             48.2    304      622
+    gunicorn 1 worker x 4 threads            39.2    321     1124
+    gunicorn 2 workers x 4 threads           34.4    380     1652
+    waitress 8 threads                       36.1    377     1461
+
+The mixed run is CPU-bound on one core. Every sale changes stock, so the
+next catalog request rebuilds the snapshot and the next daily report
+recomputes. On a single core, extra workers only add contention. That is
+why the default follows the core count. Threads still matter there for
+requests that wait on I/O, such as M-Pesa calls (up to 20 s). Before this
+profile, concurrent sales on the development server failed with "database
+is locked". Those failures came from deferred transactions upgrading to
+writes. Write transactions now begin IMMEDIATE.
+
+Every setting can be overridden with the environment variables below or on
+the gunicorn command line.
+"""
+import multiprocessing
+import os
+
+# Read by app.py: start background threads in post_fork, not in the master.
+os.environ.setdefault('POS_PRELOADED', '1')
+
+bind = f"{os.environ.get('POS_BIND_HOST', '0.0.0.0')}:{os.environ.get('POS_PORT', '5000')}"
+workers = int(os.environ.get('POS_WORKERS', min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('POS_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = True
+
+keepalive = int(os.environ.get('POS_KEEPALIVE_SECONDS', '15'))
+timeout = int(os.environ.get('POS_WORKER_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('POS_GRACEFUL_TIMEOUT', '30'))
+# Recycling a worker throws away its report, catalog and user caches, so it
+# is off unless asked for (e.g. to contain a leak).
+max_requests = int(os.environ.get('POS_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# Worker heartbeats on tmpfs, so a slow disk cannot get workers killed.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('POS_ACCESS_LOG') or None
+errorlog = '-'
+forwarded_allow_ips = os.environ.get('POS_FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
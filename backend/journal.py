@@ -0,0 +1,265 @@
+"""Append-only sale journal for serverless deployments.
+
+On Vercel/Lambda the database lives in /tmp and disappears with the
+instance, so every sale, refund and void is also appended to this journal.
+Appends only touch an in-memory buffer, so checkout never waits on the
+durable store. A background thread writes the buffer out as immutable
+JSON-lines segments every flush_interval seconds. On cold start (and
+periodically afterwards) segments written by any instance are replayed
+into the local database.
+
+Each entry carries a unique entry_id, and applied ids are recorded in the
+journal_entries table, so replay is idempotent. An entry is either:
+
+    {"type": "sale", "entry_id", "ts", "sale": {...}, "items": [...]}
+    {"type": "refund" | "void", "entry_id", "ts", "sale_entry_id", "sale_ref", "reason", "actor", "date"}
+
+sale_ref is the sale's natural identity (id, date, total, cashier). It
+finds a sale that was never journaled, such as one from the bundled
+pos.db: every instance starts from the same file, so the id matches as
+long as date and total do too.
+
+Stores implement put(name, data), list() and get(name).
+LocalDirectoryStore is the offline stand-in. An object-store backend only
+needs those three calls.
+"""
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+import buckets
+
+
+class LocalDirectoryStore:
+    """Durable store stand-in: one file per segment in a directory."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, name, data):
+        tmp = os.path.join(self.root, f".{name}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.root, name))
+
+    def list(self):
+        return sorted(n for n in os.listdir(self.root) if n.endswith('.jsonl'))
+
+    def get(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+
+def new_entry_id():
+    return uuid.uuid4().hex
+
+
+class SaleJournal:
+    def __init__(self, store, flush_interval=1.0, sync_interval=30.0, node_id=None):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.node_id = node_id or uuid.uuid4().hex[:8]
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._seen_segments = set()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {'appended': 0, 'flushed': 0, 'segments_written': 0, 'replayed': 0, 'flush_errors': 0}
+
+    # --- writing ---
+
+    def append(self, entry):
+        """Queue entry for the next flush. Never blocks on the store."""
+        entry.setdefault('entry_id', new_entry_id())
+        entry.setdefault('ts', time.time())
+        with self._lock:
+            self._buffer.append(entry)
+            self.stats['appended'] += 1
+        return entry['entry_id']
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        """Write buffered entries as one segment; returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            name = f"{int(time.time() * 1000):013d}-{self.node_id}-{next(self._seq):06d}.jsonl"
+            data = "".join(json.dumps(e, separators=(',', ':')) + "\n" for e in batch).encode('utf-8')
+            try:
+                self.store.put(name, data)
+            except Exception:
+                # Keep the entries (in order) for the next attempt.
+                with self._lock:
+                    self._buffer[:0] = batch
+                    self.stats['flush_errors'] += 1
+                raise
+            self._seen_segments.add(name)
+            self.stats['flushed'] += len(batch)
+            self.stats['segments_written'] += 1
+            return len(batch)
+
+    # --- replay ---
+
+    def read_new_entries(self):
+        """Entries from segments this process has not read yet, oldest first."""
+        entries = []
+        for name in self.store.list():
+            if name in self._seen_segments:
+                continue
+            for line in self.store.get(name).decode('utf-8').splitlines():
+                if line.strip():
+                    entries.append(json.loads(line))
+            self._seen_segments.add(name)
+        entries.sort(key=lambda e: (e.get('ts', 0), e['entry_id']))
+        return entries
+
+    def replay(self, conn):
+        """Apply every unseen journal entry to conn; returns entries applied."""
+        applied = 0
+        for entry in self.read_new_entries():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if apply_entry(conn, entry):
+                    applied += 1
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self.stats['replayed'] += applied
+        return applied
+
+    # --- background thread ---
+
+    def start(self, connect=None, on_replayed=None):
+        """Start the flush thread; with connect, also replay other instances' segments.
+
+        on_replayed() is called after a sync that applied at least one entry.
+        """
+        if self._thread is not None:
+            return
+        self._connect = connect
+        self._on_replayed = on_replayed
+        self._thread = threading.Thread(target=self._run, name='sale-journal', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def after_fork(self):
+        """Give a forked worker its own node id, so segment names cannot collide."""
+        self.node_id = uuid.uuid4().hex[:8]
+        self._seq = itertools.count(1)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Warning: sale journal flush failed at shutdown: {e}")
+
+    def _run(self):
+        next_sync = time.monotonic() + self.sync_interval
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Warning: sale journal flush failed: {e}")
+            if self._connect is not None and time.monotonic() >= next_sync:
+                next_sync = time.monotonic() + self.sync_interval
+                conn = self._connect()
+                try:
+                    if self.replay(conn) and self._on_replayed is not None:
+                        self._on_replayed()
+                except Exception as e:
+                    print(f"Warning: sale journal sync failed: {e}")
+                finally:
+                    conn.close()
+
+
+def record_entry(conn, entry_id, sale_id, kind):
+    """Mark entry_id as applied to this database (inside the caller's transaction)."""
+    conn.execute("INSERT INTO journal_entries (entry_id, sale_id, kind) VALUES (?, ?, ?)", (entry_id, sale_id, kind))
+
+
+def sale_entry_id(conn, sale_id):
+    row = conn.execute("SELECT entry_id FROM journal_entries WHERE sale_id = ? AND kind = 'sale'",
+                       (sale_id,)).fetchone()
+    return row[0] if row else None
+
+
+def sale_ref(conn, sale_id):
+    row = conn.execute("SELECT id, date, total, cashier FROM sales WHERE id = ?", (sale_id,)).fetchone()
+    return {'id': row[0], 'date': row[1], 'total': row[2], 'cashier': row[3]} if row else None
+
+
+def find_sale(conn, entry):
+    """Local id of the sale a refund/void entry reverses, or None."""
+    row = conn.execute("SELECT sale_id FROM journal_entries WHERE entry_id = ? AND kind = 'sale'",
+                       (entry.get('sale_entry_id'),)).fetchone()
+    if row:
+        return row[0]
+    ref = entry.get('sale_ref')
+    if not ref:
+        return None
+    row = conn.execute("SELECT id FROM sales WHERE id = ? AND date = ? AND total = ?",
+                       (ref['id'], ref['date'], ref['total'])).fetchone()
+    if row is None:
+        row = conn.execute("SELECT id FROM sales WHERE date = ? AND total = ? AND cashier IS ? ORDER BY id LIMIT 1",
+                           (ref['date'], ref['total'], ref.get('cashier'))).fetchone()
+    return row[0] if row else None
+
+
+def apply_entry(conn, entry):
+    """Apply one journal entry inside the caller's transaction; False if already applied."""
+    if conn.execute("SELECT 1 FROM journal_entries WHERE entry_id = ?", (entry['entry_id'],)).fetchone():
+        return False
+    kind = entry['type']
+    if kind == 'sale':
+        s = entry['sale']
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(sales)").fetchall()]
+        fields = ['total', 'subtotal', 'vat', 'cashier', 'payment_method', 'payment_reference', 'date', 'status']
+        values = [s.get('total'), s.get('subtotal'), s.get('vat'), s.get('cashier'), s.get('payment_method'),
+                  s.get('payment_reference'), s.get('date'), 'completed']
+        if 'items' in cols:
+            fields.append('items')
+            values.append(json.dumps(entry['items']))
+        cur = conn.execute(f"INSERT INTO sales ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})", values)
+        sale_id = cur.lastrowid
+        for it in entry['items']:
+            conn.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (it['quantity'], it['product_id']))
+            conn.execute("INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                         (sale_id, it['product_id'], it['quantity'], it['price']))
+        conn.execute(buckets.ADD_SALE_SQL, (sale_id,))
+        record_entry(conn, entry['entry_id'], sale_id, 'sale')
+        return True
+    if kind in ('refund', 'void'):
+        sale_id = find_sale(conn, entry)
+        if sale_id is not None:
+            status = conn.execute("SELECT status FROM sales WHERE id = ?", (sale_id,)).fetchone()
+            if status and status[0] == 'completed':
+                for product_id, quantity in conn.execute(
+                        "SELECT product_id, quantity FROM sale_items WHERE sale_id = ?", (sale_id,)).fetchall():
+                    conn.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (quantity, product_id))
+                conn.execute("UPDATE sales SET status = ? WHERE id = ?",
+                             ('refunded' if kind == 'refund' else 'voided', sale_id))
+                conn.execute("INSERT INTO audit_log (sale_id, action, reason, actor, date) VALUES (?, ?, ?, ?, ?)",
+                             (sale_id, kind, entry.get('reason'), entry.get('actor'), entry.get('date')))
+                conn.execute(buckets.ADD_REVERSAL_SQL[kind], (sale_id,))
+        record_entry(conn, entry['entry_id'], sale_id, kind)
+        return True
+    raise ValueError(f"unknown journal entry type: {kind}")
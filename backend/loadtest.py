@@ -0,0 +1,195 @@
+"""HTTP load generator for comparing server configurations.
+
+Drives a running server with a weighted mix of till traffic. Each client
+thread keeps one keep-alive connection:
+
+- catalog: GET /api/pos/catalog.bin with the last ETag (mostly 304s)
+- products: GET /api/pos/products (the full JSON list)
+- sale: POST /api/sales with one to three random lines
+- report: GET /api/reports/daily
+
+It prints requests per second and latency percentiles per kind:
+
+    python backend/loadtest.py --url http://127.0.0.1:5000 --clients 16 --seconds 20 \\
+        --mix catalog=6,sale=3,report=1
+
+Sales are real and stay in the database, so point it at a scratch copy
+(e.g. one built by stress_data.py).
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+DEFAULT_MIX = 'catalog=6,sale=3,report=1'
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"unknown request kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+class Client:
+    def __init__(self, url, token, products, rng):
+        parsed = urllib.parse.urlsplit(url)
+        self.conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.products = products
+        self.rng = rng
+        self.etag = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(self.headers, **(headers or {}))
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Reconnect on the next request, e.g. after a worker restart.
+            self.conn.close()
+            raise
+        return response, data
+
+    def catalog(self):
+        response, data = self.request('GET', '/api/pos/catalog.bin',
+                                      headers={'If-None-Match': self.etag} if self.etag else None)
+        self.etag = response.getheader('ETag') or self.etag
+        return response.status in (200, 304), data
+
+    def products_list(self):
+        response, data = self.request('GET', '/api/pos/products')
+        return response.status == 200, data
+
+    def sale(self):
+        lines = self.rng.sample(self.products, min(len(self.products), self.rng.randint(1, 3)))
+        items = [{'productId': p['id'], 'quantity': 1, 'price': p['price']} for p in lines]
+        response, data = self.request('POST', '/api/sales', {'items': items, 'payment_method': 'cash'})
+        return response.status in (200, 201), data
+
+    def report(self):
+        response, data = self.request('GET', '/api/reports/daily')
+        return response.status == 200, data
+
+
+KINDS = {'catalog': Client.catalog, 'products': Client.products_list, 'sale': Client.sale, 'report': Client.report}
+
+
+def login(url, username, password):
+    parsed = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+    try:
+        conn.request('POST', '/api/login', body=json.dumps({'username': username, 'password': password}),
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        data = json.loads(response.read() or b'{}')
+        if response.status != 200 or 'token' not in data:
+            raise SystemExit(f"Login failed ({response.status}): {data}")
+        token = data['token']
+        conn.request('GET', '/api/pos/products', headers={'Authorization': f'Bearer {token}'})
+        products = json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+    products = products.get('data', products) if isinstance(products, dict) else products
+    # Only lines that are always sellable, so failed sales mean server errors.
+    sellable = [p for p in products if (p.get('stock') or 0) > 1000 and p.get('price')]
+    return token, sellable or products
+
+
+def run(url, token, products, mix, clients, seconds, seed=0):
+    kinds, weights = list(mix), list(mix.values())
+    results = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    first_error = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        client = Client(url, token, products, rng)
+        latencies = {kind: [] for kind in kinds}
+        failed = {kind: 0 for kind in kinds}
+        while time.monotonic() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            t = time.perf_counter()
+            try:
+                ok, body = KINDS[kind](client)
+            except (http.client.HTTPException, OSError) as e:
+                ok, body = False, repr(e)
+            latencies[kind].append(time.perf_counter() - t)
+            if not ok:
+                failed[kind] += 1
+                if isinstance(body, bytes):
+                    body = body[:200].decode('utf-8', 'replace')
+                first_error.setdefault(kind, body[:200])
+        client.conn.close()
+        with lock:
+            for kind in kinds:
+                results[kind].extend(latencies[kind])
+                errors[kind] += failed[kind]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    summary = {}
+    for kind in kinds + ['all']:
+        values = sorted(v for k in kinds for v in results[k]) if kind == 'all' else sorted(results[kind])
+        summary[kind] = {
+            'requests': len(values),
+            'errors': sum(errors.values()) if kind == 'all' else errors[kind],
+            'rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 1) if values else None,
+            'p95_ms': round(percentile(values, 0.95) * 1000, 1) if values else None,
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1) if values else None,
+        }
+        if kind in first_error:
+            summary[kind]['first_error'] = first_error[kind]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load a running POS server with a mix of till requests.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent keep-alive connections")
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Weighted kinds: " + ", ".join(KINDS))
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    token, products = login(args.url, args.username, args.password)
+    summary = run(args.url, token, products, parse_mix(args.mix), args.clients, args.seconds)
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(f"{'kind':<10}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for kind, s in summary.items():
+        print(f"{kind:<10}{s['requests']:>10}{s['errors']:>8}{s['rps']:>9}{s['p50_ms']!s:>9}{s['p95_ms']!s:>9}{s['p99_ms']!s:>9}")
+        if 'first_error' in s:
+            print(f"  first {kind} error: {s['first_error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Background upkeep of the SQLite database file.
+
+A till database runs for months without a restart. Left alone:
+- the planner statistics go stale as products, sales and holds grow;
+- the WAL file keeps the size of its largest burst;
+- pages freed by deleted holds, idempotency keys and archived audit rows
+  are never returned to the filesystem.
+
+Maintenance runs three tasks on a schedule:
+
+- optimize (every optimize_interval): PRAGMA optimize, which re-runs
+  ANALYZE for the tables whose statistics are missing or out of date
+  (plain ANALYZE before SQLite 3.46). analysis_limit bounds how many rows
+  it samples per index.
+- vacuum (every vacuum_interval): PRAGMA incremental_vacuum, returning
+  free pages to the filesystem once more than vacuum_min_free_pages have
+  piled up. This needs auto_vacuum=INCREMENTAL. A database created
+  without it is converted once, with a full VACUUM, but only if the file
+  is smaller than vacuum_convert_max_bytes. A larger file is left for an
+  operator to convert while the shop is closed (--convert below).
+- checkpoint (every checkpoint_interval): PRAGMA wal_checkpoint(TRUNCATE).
+  Copies the WAL back into the database and truncates it to zero bytes.
+  When tasks run together, it runs last.
+
+Due tasks run only in a quiet period: no request in this process, and no
+write to the WAL by any process, for quiet_seconds. A task that has
+waited max_defer seconds runs anyway. Under gunicorn every worker has a
+Maintenance; an advisory lock on <db>.maintenance.lock lets just one of
+them do the work at a time.
+
+Each run records the database and WAL sizes before and after it. info()
+returns the last runs, the current sizes and when each task is next due.
+From the command line (e.g. from cron, or to convert a large file):
+
+    python backend/maintenance.py --db backend/pos.db [--task checkpoint --task vacuum] [--convert]
+"""
+import argparse
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: one waitress process, nothing to coordinate.
+    fcntl = None
+
+# Run order: the checkpoint goes last, so it also truncates what the others wrote.
+TASKS = ('optimize', 'vacuum', 'checkpoint')
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Maintenance:
+    def __init__(self, db_path, checkpoint_interval=300.0, optimize_interval=6 * 3600.0,
+                 vacuum_interval=3600.0, quiet_seconds=30.0, max_defer=24 * 3600.0, check_interval=15.0,
+                 analysis_limit=1000, vacuum_min_free_pages=256, vacuum_convert_max_bytes=256 * 1024 * 1024,
+                 history=50):
+        self.db_path = db_path
+        self.intervals = {'checkpoint': checkpoint_interval, 'optimize': optimize_interval, 'vacuum': vacuum_interval}
+        self.quiet_seconds = quiet_seconds
+        self.max_defer = max_defer
+        self.check_interval = check_interval
+        self.analysis_limit = analysis_limit
+        self.vacuum_min_free_pages = vacuum_min_free_pages
+        self.vacuum_convert_max_bytes = vacuum_convert_max_bytes
+        self._last_activity = 0.0
+        now = time.time()
+        # Nothing is due at start-up: the server has just been busy starting.
+        self._due = {task: now + interval for task, interval in self.intervals.items()}
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.history = collections.deque(maxlen=history)
+        self.stats = {'runs': 0, 'deferred': 0, 'errors': 0, 'locked_elsewhere': 0}
+
+    def note_activity(self):
+        """Called for every request; maintenance waits for quiet_seconds after it."""
+        self._last_activity = time.monotonic()
+
+    # --- sizes ---
+
+    def sizes(self, conn=None):
+        """Database and WAL sizes, plus page counts when a connection is given."""
+        out = {'db_bytes': file_size(self.db_path), 'wal_bytes': file_size(self.db_path + '-wal')}
+        if conn is not None:
+            out['page_size'] = conn.execute("PRAGMA page_size").fetchone()[0]
+            out['page_count'] = conn.execute("PRAGMA page_count").fetchone()[0]
+            out['freelist_pages'] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            out['auto_vacuum'] = AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+        return out
+
+    def is_quiet(self):
+        if time.monotonic() - self._last_activity < self.quiet_seconds:
+            return False
+        wal = self.db_path + '-wal'
+        try:
+            return time.time() - os.path.getmtime(wal) >= self.quiet_seconds
+        except OSError:
+            return True
+
+    # --- tasks ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+
+    def _checkpoint(self, conn):
+        busy, wal_frames, moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        # busy=1: a reader still needed the WAL; the frames were copied but
+        # the file could not be truncated. The next quiet period retries.
+        return {'busy': bool(busy), 'wal_frames': wal_frames, 'checkpointed_frames': moved}
+
+    def _optimize(self, conn):
+        conn.execute(f"PRAGMA analysis_limit = {int(self.analysis_limit)}")
+        if sqlite3.sqlite_version_info >= (3, 46, 0):
+            # 0x10002: consider every table, not just those this connection
+            # has queried (a fresh connection has queried none).
+            conn.execute("PRAGMA optimize = 0x10002")
+        else:
+            # Older optimize only looks at tables this connection queried,
+            # so refresh everything; analysis_limit keeps it cheap.
+            conn.execute("ANALYZE")
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+            return {'analyzed_tables': 0}
+        return {'analyzed_tables': conn.execute("SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]}
+
+    def _vacuum(self, conn):
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            if file_size(self.db_path) > self.vacuum_convert_max_bytes:
+                return {'freed_pages': 0, 'skipped': 'auto_vacuum is not incremental; convert with maintenance.py --convert'}
+            self.convert_to_incremental(conn)
+            return {'freed_pages': free, 'converted': True}
+        if free < self.vacuum_min_free_pages:
+            return {'freed_pages': 0}
+        # The pragma frees one page per step and has no result columns, so
+        # execute() would stop after the first page; executescript() runs
+        # it to completion.
+        conn.executescript("PRAGMA incremental_vacuum;")
+        return {'freed_pages': free - conn.execute("PRAGMA freelist_count").fetchone()[0]}
+
+    @staticmethod
+    def convert_to_incremental(conn):
+        """Switch the file to auto_vacuum=INCREMENTAL (rewrites it with VACUUM)."""
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    # --- scheduling ---
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return [task for task in TASKS if self._due[task] <= now]
+
+    def run(self, tasks=None):
+        """Run tasks now (default: the due ones); returns the run record, or None."""
+        tasks = list(tasks if tasks is not None else self.due())
+        if not tasks:
+            return None
+        with self._run_lock:
+            lock_file = self._lock_file()
+            if lock_file is False:
+                # Another worker is on it; reschedule rather than repeat it.
+                self.stats['locked_elsewhere'] += 1
+                for task in tasks:
+                    self._due[task] = time.time() + self.intervals[task]
+                return None
+            try:
+                return self._run_tasks(tasks)
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def _lock_file(self):
+        """The held cross-process lock, None where there is none, False if taken."""
+        if fcntl is None:
+            return None
+        f = open(self.db_path + '.maintenance.lock', 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        return f
+
+    def _run_tasks(self, tasks):
+        tasks = [task for task in TASKS if task in tasks]
+        record = {'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'tasks': {}}
+        t0 = time.perf_counter()
+        conn = self._connect()
+        try:
+            record['before'] = self.sizes(conn)
+            for task in tasks:
+                t = time.perf_counter()
+                try:
+                    result = getattr(self, '_' + task)(conn)
+                except sqlite3.Error as e:
+                    result = {'error': str(e)}
+                    self.stats['errors'] += 1
+                result['ms'] = round((time.perf_counter() - t) * 1000, 1)
+                record['tasks'][task] = result
+                self._due[task] = time.time() + self.intervals[task]
+            record['after'] = self.sizes(conn)
+        finally:
+            conn.close()
+        record['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+        self.stats['runs'] += 1
+        self.history.append(record)
+        return record
+
+    def tick(self):
+        """One scheduler step: run what is due if quiet (or deferred too long)."""
+        due = self.due()
+        if not due:
+            return None
+        overdue = [task for task in due if time.time() - self._due[task] >= self.max_defer]
+        if not self.is_quiet() and not overdue:
+            self.stats['deferred'] += 1
+            return None
+        return self.run(due)
+
+    def info(self):
+        now = time.time()
+        return dict(self.stats, running=self._thread is not None, quiet=self.is_quiet(), sizes=self.sizes(),
+                    next_due={task: round(max(0.0, self._due[task] - now)) for task in TASKS},
+                    intervals=dict(self.intervals), history=list(self.history)[-10:])
+
+    # --- background thread ---
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Warning: database maintenance failed: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run SQLite maintenance (checkpoint, optimize, incremental vacuum) now.")
+    parser.add_argument('--db', help="SQLite file (default: DB_PATH or backend/pos.db)")
+    parser.add_argument('--task', action='append', choices=TASKS, help="Task to run (repeatable; default: all)")
+    parser.add_argument('--convert', action='store_true',
+                        help="Let the vacuum task convert the file to auto_vacuum=INCREMENTAL whatever its size")
+    args = parser.parse_args(argv)
+
+    db = args.db or os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos.db')
+    maint = Maintenance(db, vacuum_convert_max_bytes=float('inf') if args.convert else 256 * 1024 * 1024)
+    record = maint.run(args.task or TASKS)
+    if record is None:
+        raise SystemExit("Another process is running maintenance on this database")
+    for task, result in record['tasks'].items():
+        print(f"{task}: {result}")
+    before, after = record['before'], record['after']
+    print(f"database {before['db_bytes']:,} -> {after['db_bytes']:,} bytes, "
+          f"WAL {before['wal_bytes']:,} -> {after['wal_bytes']:,} bytes, "
+          f"free pages {before['freelist_pages']:,} -> {after['freelist_pages']:,}")
+
+
+if __name__ == '__main__':
+    main()
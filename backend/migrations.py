@@ -0,0 +1,504 @@
+"""Versioned schema migrations driven by PRAGMA user_version.
+
+init_db() calls migrate() on every boot. When the database is already at
+latest_version() that is a single PRAGMA read; otherwise each pending
+migration runs once, in order, inside its own write transaction, and bumps
+user_version as part of the same commit. Migrations must only touch the
+rows they need: nothing here should rewrite a whole table on a later boot.
+
+To change the schema, append a new function decorated with
+@migration(<next version>, "<description>"). Never edit a released one.
+"""
+import sqlite3
+import buckets
+from werkzeug.security import generate_password_hash
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"migration {version} registered out of order")
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """Bring conn's database up to latest_version(); returns migrations applied."""
+    if current_version(conn) >= latest_version():
+        return 0
+    applied = 0
+    for version, description, fn in MIGRATIONS:
+        # Re-check under the write lock so concurrent workers booting
+        # against the same file apply each migration exactly once.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            fn(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+        print(f"Applied migration {version}: {description}")
+    return applied
+
+
+@migration(1, "baseline schema, seed data and default users")
+def _baseline(conn):
+    # Idempotent: also upgrades databases created before versioning by
+    # older builds (including the Node server.js schema).
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    # Create Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+    ''')
+
+    # Create Products table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            parent_id INTEGER,
+            price REAL NOT NULL,
+            stock INTEGER NOT NULL,
+            category TEXT,
+            barcode TEXT,
+            low_stock_threshold INTEGER,
+            image_url TEXT,
+            min_price REAL
+        )
+    ''')
+    cols = [row['name'] for row in cursor.execute("PRAGMA table_info(products)").fetchall()]
+    if 'parent_id' not in cols:
+        cursor.execute("ALTER TABLE products ADD COLUMN parent_id INTEGER")
+    if 'barcode' not in cols:
+        cursor.execute("ALTER TABLE products ADD COLUMN barcode TEXT")
+    if 'low_stock_threshold' not in cols:
+        cursor.execute("ALTER TABLE products ADD COLUMN low_stock_threshold INTEGER")
+    if 'image_url' not in cols:
+        cursor.execute("ALTER TABLE products ADD COLUMN image_url TEXT")
+    if 'min_price' not in cols:
+        cursor.execute("ALTER TABLE products ADD COLUMN min_price REAL")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode) WHERE barcode IS NOT NULL")
+    seed_barcodes = {
+        'Samsung 43\" Smart TV': '890100000001',
+        'Blender 500W': '890100000002',
+        'Double Bedsheet Set': '890100000003',
+        'Non-stick Cookware Set': '890100000004',
+        'Bluetooth Speaker': '890100000005',
+        'Electric Kettle': '890100000006',
+        'King Size Duvet': '890100000007',
+        'Iron Box': '890100000008'
+    }
+    for name, code in seed_barcodes.items():
+        cursor.execute("UPDATE products SET barcode = ? WHERE name = ? AND (barcode IS NULL OR barcode = '')", (code, name))
+    
+    # Create Sales table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            total REAL NOT NULL,
+            subtotal REAL,
+            vat REAL,
+            cashier TEXT,
+            payment_method TEXT,
+            payment_reference TEXT,
+            date TEXT DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'completed'
+        )
+    ''')
+    sales_cols = [row['name'] for row in cursor.execute("PRAGMA table_info(sales)").fetchall()]
+    if 'subtotal' not in sales_cols:
+        cursor.execute("ALTER TABLE sales ADD COLUMN subtotal REAL")
+    if 'vat' not in sales_cols:
+        cursor.execute("ALTER TABLE sales ADD COLUMN vat REAL")
+    if 'cashier' not in sales_cols:
+        cursor.execute("ALTER TABLE sales ADD COLUMN cashier TEXT")
+    if 'payment_method' not in sales_cols:
+        cursor.execute("ALTER TABLE sales ADD COLUMN payment_method TEXT")
+    if 'payment_reference' not in sales_cols:
+        cursor.execute("ALTER TABLE sales ADD COLUMN payment_reference TEXT")
+    if 'status' not in sales_cols:
+        cursor.execute("ALTER TABLE sales ADD COLUMN status TEXT DEFAULT 'completed'")
+
+    # Create Sale Items table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sale_items (
+            sale_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            FOREIGN KEY(sale_id) REFERENCES sales(id),
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_id INTEGER,
+            action TEXT,
+            reason TEXT,
+            actor TEXT,
+            date TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Seed products if empty
+    cursor.execute("SELECT count(*) as count FROM products")
+    if cursor.fetchone()['count'] == 0:
+        products = [
+            ('Samsung 43" Smart TV', 35000, 10, 'Electronics', '890100000001'),
+            ('Blender 500W', 4500, 20, 'Kitchenware', '890100000002'),
+            ('Double Bedsheet Set', 2500, 30, 'Beddings', '890100000003'),
+            ('Non-stick Cookware Set', 8000, 15, 'Kitchenware', '890100000004'),
+            ('Bluetooth Speaker', 3000, 25, 'Electronics', '890100000005'),
+            ('Electric Kettle', 1500, 40, 'Kitchenware', '890100000006'),
+            ('King Size Duvet', 5000, 12, 'Beddings', '890100000007'),
+            ('Iron Box', 1200, 50, 'Electronics', '890100000008')
+        ]
+        cursor.executemany("INSERT INTO products (name, price, stock, category, barcode) VALUES (?, ?, ?, ?, ?)", products)
+        print("Seeded initial products")
+    cursor.execute("UPDATE products SET low_stock_threshold = 5 WHERE low_stock_threshold IS NULL")
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS banks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+    ''')
+    bcount = cursor.execute("SELECT COUNT(*) as c FROM banks").fetchone()['c']
+    if bcount == 0:
+        cursor.executemany("INSERT INTO banks (name) VALUES (?)", [
+            ('KCB Bank',),
+            ('Co-op Bank',),
+            ('Equity Bank',)
+        ])
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+    ''')
+    ccount = cursor.execute("SELECT COUNT(*) as c FROM categories").fetchone()['c']
+    if ccount == 0:
+        cursor.executemany("INSERT INTO categories (name) VALUES (?)", [
+            ('Home Appliances',),
+            ('Electronics',),
+            ('Beddings',),
+            ('Household Items',)
+        ])
+    
+    # Seed default users: superadmin, admin, cashier
+    # Super Admin
+    existing_super = cursor.execute("SELECT 1 FROM users WHERE username = ?", ('superadmin',)).fetchone()
+    if not existing_super:
+        super_pw = generate_password_hash('super123')
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                       ('superadmin', super_pw, 'super_admin'))
+    # Admin
+    existing_admin = cursor.execute("SELECT role FROM users WHERE username = ?", ('admin',)).fetchone()
+    if not existing_admin:
+        admin_pw = generate_password_hash('admin123')
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                       ('admin', admin_pw, 'admin'))
+    else:
+        if existing_admin['role'] == 'super_admin':
+            cursor.execute("UPDATE users SET role = 'admin' WHERE username = 'admin'")
+    # Cashier
+    existing_cashier = cursor.execute("SELECT 1 FROM users WHERE username = ?", ('cashier',)).fetchone()
+    if not existing_cashier:
+        cashier_pw = generate_password_hash('cashier123')
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                       ('cashier', cashier_pw, 'cashier'))
+    print("Default users ensured (superadmin/super123, admin/admin123, cashier/cashier123)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS holds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT DEFAULT CURRENT_TIMESTAMP,
+            cashier TEXT,
+            note TEXT,
+            items TEXT NOT NULL,
+            payment_method TEXT,
+            payment_reference TEXT,
+            subtotal REAL,
+            vat REAL,
+            total REAL
+        )
+    ''')
+
+
+@migration(2, "journal_entries table for the sale journal")
+def _journal_entries(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS journal_entries (
+            entry_id TEXT PRIMARY KEY,
+            sale_id INTEGER,
+            kind TEXT NOT NULL,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_entries_sale ON journal_entries(sale_id, kind)")
+
+
+@migration(3, "index sale_items by sale_id")
+def _sale_items_sale_index(conn):
+    # Sale lookups, refunds and incremental analytics reads all go by sale_id.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)")
+
+
+@migration(4, "sales_buckets hourly aggregate table")
+def _sales_buckets(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_buckets (
+            day TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            cashier TEXT NOT NULL DEFAULT '',
+            payment_method TEXT NOT NULL DEFAULT '',
+            sales_count INTEGER NOT NULL DEFAULT 0,
+            sales_total REAL NOT NULL DEFAULT 0,
+            refund_count INTEGER NOT NULL DEFAULT 0,
+            refund_total REAL NOT NULL DEFAULT 0,
+            void_count INTEGER NOT NULL DEFAULT 0,
+            void_total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, hour, cashier, payment_method)
+        ) WITHOUT ROWID
+    ''')
+    # One-off fill from existing history; afterwards rows are maintained
+    # with each sale, refund and void.
+    conn.execute(buckets.REBUILD_SQL.format(where=""))
+
+
+@migration(5, "table_revisions counters bumped by triggers on products")
+def _table_revisions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_revisions (
+            name TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO table_revisions (name, revision) VALUES ('products', 1)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS products_revision_{event.lower()} AFTER {event} ON products
+            BEGIN
+                UPDATE table_revisions SET revision = revision + 1 WHERE name = 'products';
+            END
+        ''')
+
+
+@migration(6, "sale_sync_keys for offline till sales")
+def _sale_sync_keys(conn):
+    # One row per sale synced from a till's offline queue, keyed by the
+    # idempotency key the till generated, so a re-sent batch is not re-applied.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sale_sync_keys (
+            client_key TEXT PRIMARY KEY,
+            sale_id INTEGER NOT NULL,
+            cashier TEXT,
+            synced_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(7, "idempotency_keys for replayable POSTs")
+def _idempotency_keys(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            request_hash TEXT NOT NULL,
+            status_code INTEGER,
+            response TEXT,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)")
+
+
+@migration(8, "holds: normalized hold_items, (cashier, date) index, reservations and expiry")
+def _hold_items(conn):
+    import json
+    # Rebuild holds without the JSON items blob; its rows move to hold_items.
+    conn.execute('''
+        CREATE TABLE holds_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT DEFAULT CURRENT_TIMESTAMP,
+            cashier TEXT,
+            note TEXT,
+            payment_method TEXT,
+            payment_reference TEXT,
+            subtotal REAL,
+            vat REAL,
+            total REAL,
+            reserved INTEGER NOT NULL DEFAULT 0,
+            expires_at INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS hold_items (
+            hold_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            product_id INTEGER,
+            name TEXT,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            PRIMARY KEY (hold_id, position)
+        ) WITHOUT ROWID
+    ''')
+    # Existing holds never expire (expires_at NULL): they were parked with no
+    # lifetime, and POS_HOLD_TTL_HOURS is not known here.
+    conn.execute('''
+        INSERT INTO holds_new (id, date, cashier, note, payment_method, payment_reference, subtotal, vat, total, expires_at)
+        SELECT id, date, cashier, note, payment_method, payment_reference, subtotal, vat, total, NULL
+        FROM holds
+    ''')
+    for hold_id, blob in conn.execute("SELECT id, items FROM holds").fetchall():
+        try:
+            items = json.loads(blob or '[]')
+        except ValueError:
+            items = []
+        if not isinstance(items, list):
+            items = []
+        conn.executemany(
+            "INSERT INTO hold_items (hold_id, position, product_id, name, quantity, price) VALUES (?, ?, ?, ?, ?, ?)",
+            [(hold_id, i, it.get('productId'), it.get('name'), int(it.get('quantity') or 0), float(it.get('price') or 0))
+             for i, it in enumerate(items) if isinstance(it, dict)])
+    conn.execute("DROP TABLE holds")
+    conn.execute("ALTER TABLE holds_new RENAME TO holds")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_holds_cashier_date ON holds(cashier, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_holds_expires ON holds(expires_at)")
+
+
+@migration(9, "audit_log product_id/details columns, indexes and archive index")
+def _audit_indexes(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(audit_log)")}
+    if 'product_id' not in columns:
+        conn.execute("ALTER TABLE audit_log ADD COLUMN product_id INTEGER")
+    if 'details' not in columns:
+        conn.execute("ALTER TABLE audit_log ADD COLUMN details TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_sale ON audit_log(sale_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_actor_date ON audit_log(actor, date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_date ON audit_log(date)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS audit_archives (
+            name TEXT PRIMARY KEY,
+            month TEXT NOT NULL,
+            first_id INTEGER,
+            last_id INTEGER,
+            rows INTEGER NOT NULL,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(10, "table_revisions triggers on sales and users")
+def _more_table_revisions(conn):
+    # 'sales' moves on every sale, refund and void. 'sales_history' only
+    # moves when a sale dated before today (UTC) is inserted or deleted, e.g.
+    # by offline sync or journal replay, which is what invalidates closed
+    # report ranges.
+    for name in ('sales', 'sales_history', 'users'):
+        conn.execute("INSERT OR IGNORE INTO table_revisions (name, revision) VALUES (?, 1)", (name,))
+    for table in ('sales', 'users'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_revision_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_revisions SET revision = revision + 1 WHERE name = '{table}';
+                END
+            ''')
+    for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sales_history_revision_{event.lower()} AFTER {event} ON sales
+            WHEN substr({row}.date, 1, 10) < date('now')
+            BEGIN
+                UPDATE table_revisions SET revision = revision + 1 WHERE name = 'sales_history';
+            END
+        ''')
+
+
+@migration(11, "products(parent_id) index for variant trees")
+def _products_parent_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_parent ON products(parent_id)")
+
+
+@migration(12, "z_reports day-close snapshots and sales(date) index")
+def _z_reports(conn):
+    # Reports read open days by date range; closed days come from z_report_lines.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(date)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS z_reports (
+            day TEXT PRIMARY KEY,
+            closed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            closed_by TEXT,
+            high_water_id INTEGER NOT NULL,
+            previous_high_water_id INTEGER NOT NULL,
+            sales_count INTEGER NOT NULL,
+            subtotal_sum REAL,
+            vat_sum REAL,
+            total_sum REAL,
+            refund_count INTEGER NOT NULL,
+            void_count INTEGER NOT NULL
+        )
+    ''')
+    # close_day is the close that recorded the line; day is its sales' day.
+    # They differ for sales that reached a day after it was closed.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS z_report_lines (
+            close_day TEXT NOT NULL,
+            day TEXT NOT NULL,
+            cashier TEXT,
+            payment_method TEXT,
+            sales_count INTEGER NOT NULL,
+            subtotal_sum REAL,
+            vat_sum REAL,
+            total_sum REAL,
+            refund_count INTEGER NOT NULL,
+            void_count INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_z_report_lines_day ON z_report_lines(day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_z_report_lines_close_day ON z_report_lines(close_day)")
+    for table in ('z_reports', 'z_report_lines'):
+        for event in ('UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_immutable_{event.lower()} BEFORE {event} ON {table}
+                BEGIN
+                    SELECT RAISE(ABORT, 'closed days are immutable');
+                END
+            ''')
+
+
+@migration(13, "sales_history revision on refunds and voids of past days")
+def _sales_history_reversals(conn):
+    # A refund or void of a sale dated before today changes that day's
+    # buckets and report figures, so closed report ranges must be dropped.
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS sales_history_revision_update AFTER UPDATE OF status ON sales
+        WHEN OLD.status IS NOT NEW.status AND substr(NEW.date, 1, 10) < date('now')
+        BEGIN
+            UPDATE table_revisions SET revision = revision + 1 WHERE name = 'sales_history';
+        END
+    ''')
@@ -0,0 +1,333 @@
+"""Sampling profiler for finding out why an endpoint is slow in production.
+
+An admin switches it on for a while (configure()). From then on, rate of
+the requests are chosen at random. For each chosen request, the handler
+thread is registered under the request's endpoint name. A background
+thread wakes every interval seconds and reads the current stack of every
+registered thread with sys._current_frames(). Each stack is stored
+collapsed, root first, as "endpoint;func (file:line);...", and counted.
+Requests that were not chosen pay nothing more. Profiling stops by itself
+once duration seconds have passed.
+
+cProfile would trace every call of the chosen requests, which is several
+times slower for them and cannot be turned on for a thread that is already
+running. A sampler costs the same whatever the handler does, and it shows
+the time spent waiting on SQLite or the network as well as CPU time.
+
+When profiling is off, begin_request() tests one attribute and returns.
+With state_dir set, it also compares a clock reading about once per
+second; this is how every gunicorn worker follows the setting:
+- configure() writes <state_dir>/control.json, and the other workers pick
+  it up within sync_interval.
+- Each worker writes its counts to <state_dir>/samples-<pid>.json every
+  few seconds.
+- counts() merges all of the files for the current session, so any worker
+  can answer for the whole server.
+
+Output, for flamegraph.pl, speedscope, inferno and similar tools:
+- collapsed(): one "stack count" line per distinct stack.
+- speedscope(): a speedscope file with one sampled profile per endpoint,
+  weighted in milliseconds.
+"""
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Deeper stacks keep their innermost frames (where the time goes).
+MAX_DEPTH = 128
+TRUNCATED = '[other stacks]'
+
+_labels = {}
+
+
+def frame_label(code):
+    """"func (file:line)" for a code object; files outside backend/ keep their last two path parts."""
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(_HERE + os.sep):
+            path = path[len(_HERE) + 1:]
+        else:
+            path = '/'.join(path.replace('\\', '/').split('/')[-2:])
+        # ';' separates frames in the collapsed format.
+        label = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(';', ':')
+        _labels[code] = label
+    return label
+
+
+def collapse(frame):
+    """Root-first ';'-joined labels of frame and its callers."""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class Profiler:
+    def __init__(self, state_dir=None, rate=0.1, interval=0.01, duration=600.0, max_stacks=5000,
+                 sync_interval=1.0, flush_interval=2.0, worker_id=None):
+        self.state_dir = state_dir
+        self.worker_id = worker_id or str(os.getpid())
+        self.rate = rate
+        self.interval = interval
+        self.duration = duration
+        self.max_stacks = max_stacks
+        self.sync_interval = sync_interval
+        self.flush_interval = flush_interval
+        self.enabled = False
+        self.until = 0.0
+        self.session = None
+        self._active = {}
+        self._counts = {}
+        self._requests = collections.Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dirty = False
+        self._next_sync = 0.0
+        self._control_mtime = None
+        self.stats = {'samples': 0, 'sampler_ms': 0.0, 'dropped_stacks': 0}
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    # --- per request ---
+
+    def begin_request(self, endpoint):
+        """Called before every request; registers this thread if the request is sampled."""
+        if self.state_dir is not None:
+            now = time.monotonic()
+            if now >= self._next_sync:
+                self._next_sync = now + self.sync_interval
+                self.sync()
+        if not self.enabled or random.random() >= self.rate:
+            return False
+        self._active[threading.get_ident()] = endpoint or 'unknown'
+        self._requests[endpoint or 'unknown'] += 1
+        return True
+
+    def end_request(self):
+        if self._active:
+            self._active.pop(threading.get_ident(), None)
+
+    # --- switching on and off ---
+
+    def configure(self, enabled, rate=None, interval=None, duration=None):
+        """Start a new session (counts reset) or stop the current one; shared through state_dir."""
+        settings = {'enabled': bool(enabled), 'rate': self.rate if rate is None else float(rate),
+                    'interval': self.interval if interval is None else float(interval),
+                    'session': uuid.uuid4().hex if enabled else self.session,
+                    'until': time.time() + (self.duration if duration is None else float(duration)) if enabled else 0.0}
+        if self.state_dir is not None:
+            path = os.path.join(self.state_dir, 'control.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(settings, f)
+            os.replace(path + '.tmp', path)
+            self._control_mtime = os.stat(path).st_mtime_ns
+        self._apply(settings)
+        return self.info()
+
+    def sync(self):
+        """Follow control.json if another worker has changed it."""
+        path = os.path.join(self.state_dir, 'control.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if mtime == self._control_mtime:
+                return
+            with open(path) as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._control_mtime = mtime
+        self._apply(settings)
+
+    def _apply(self, settings):
+        with self._lock:
+            if settings['session'] != self.session:
+                self._counts = {}
+                self._requests = collections.Counter()
+                self.stats = {'samples': 0, 'sampler_ms': 0.0, 'dropped_stacks': 0}
+                self._dirty = False
+            self.session = settings['session']
+            self.rate = settings['rate']
+            self.interval = settings['interval']
+            self.until = settings['until']
+            self.enabled = settings['enabled'] and time.time() < self.until
+        if self.enabled:
+            self._start()
+        else:
+            self._active.clear()
+            self._flush()
+
+    def after_fork(self):
+        """Drop the parent's sampler thread; the worker re-reads control.json on its first request."""
+        self.worker_id = str(os.getpid())
+        self._thread = None
+        self._stop = threading.Event()
+        self._active = {}
+        self._control_mtime = None
+        self._next_sync = 0.0
+        self.enabled = False
+
+    # --- sampling ---
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.enabled = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._flush()
+
+    def _run(self):
+        flushed = time.monotonic()
+        while self.enabled and not self._stop.wait(self.interval):
+            if time.time() >= self.until:
+                self.enabled = False
+                self._active.clear()
+                break
+            if self._active:
+                self.sample()
+            if self.state_dir is not None and time.monotonic() - flushed >= self.flush_interval:
+                self._flush()
+                flushed = time.monotonic()
+        self._flush()
+
+    def sample(self):
+        """Take one sample of every registered thread."""
+        t0 = time.perf_counter()
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, endpoint in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stacks = self._counts.setdefault(endpoint, {})
+                stack = endpoint + ';' + collapse(frame)
+                if stack not in stacks and len(stacks) >= self.max_stacks:
+                    stack = endpoint + ';' + TRUNCATED
+                    self.stats['dropped_stacks'] += 1
+                stacks[stack] = stacks.get(stack, 0) + 1
+                self.stats['samples'] += 1
+                self._dirty = True
+        del frames
+        self.stats['sampler_ms'] += (time.perf_counter() - t0) * 1000
+
+    # --- results ---
+
+    def _samples_path(self):
+        return os.path.join(self.state_dir, f'samples-{self.worker_id}.json')
+
+    def _flush(self):
+        if self.state_dir is None or not self._dirty:
+            return
+        with self._flush_lock:
+            with self._lock:
+                body = json.dumps({'session': self.session, 'interval': self.interval, 'requests': dict(self._requests),
+                                   'stacks': self._counts, 'stats': self.stats})
+                self._dirty = False
+            path = self._samples_path()
+            with open(path + '.tmp', 'w') as f:
+                f.write(body)
+            os.replace(path + '.tmp', path)
+
+    def _snapshots(self):
+        """This process's counts plus, with state_dir, the other workers' for the same session."""
+        with self._lock:
+            own = {'requests': dict(self._requests),
+                   'stacks': {e: dict(s) for e, s in self._counts.items()}, 'stats': dict(self.stats)}
+        snapshots = [own]
+        if self.state_dir is not None:
+            mine = os.path.basename(self._samples_path())
+            for name in os.listdir(self.state_dir):
+                if not (name.startswith('samples-') and name.endswith('.json')) or name == mine:
+                    continue
+                try:
+                    with open(os.path.join(self.state_dir, name)) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if data.get('session') == self.session:
+                    snapshots.append(data)
+        return snapshots
+
+    def counts(self, endpoint=None):
+        """{endpoint: {"requests": n, "stacks": {collapsed stack: samples}}} over all workers."""
+        out = {}
+        for snap in self._snapshots():
+            for ep, n in snap['requests'].items():
+                out.setdefault(ep, {'requests': 0, 'stacks': collections.Counter()})['requests'] += n
+            for ep, stacks in snap['stacks'].items():
+                out.setdefault(ep, {'requests': 0, 'stacks': collections.Counter()})['stacks'].update(stacks)
+        if endpoint is not None:
+            out = {ep: v for ep, v in out.items() if ep == endpoint}
+        return out
+
+    def collapsed(self, endpoint=None):
+        """Folded stacks, "endpoint;frame;...;frame count" per line, heaviest first."""
+        lines = []
+        for data in self.counts(endpoint).values():
+            lines.extend(data['stacks'].items())
+        lines.sort(key=lambda item: (-item[1], item[0]))
+        return ''.join(f"{stack} {n}\n" for stack, n in lines)
+
+    def speedscope(self, endpoint=None):
+        """A speedscope file (https://www.speedscope.app/file-format-schema.json), one profile per endpoint."""
+        frames, index = [], {}
+        profiles = []
+        interval_ms = self.interval * 1000
+        for ep, data in sorted(self.counts(endpoint).items()):
+            samples, weights = [], []
+            for stack, n in data['stacks'].most_common():
+                ids = []
+                for label in stack.split(';')[1:]:
+                    if label not in index:
+                        index[label] = len(frames)
+                        name, _, where = label.rpartition(' (')
+                        file, _, line = where.rstrip(')').rpartition(':')
+                        frame = {'name': name or label}
+                        if file:
+                            frame['file'] = file
+                        if line.isdigit():
+                            frame['line'] = int(line)
+                        frames.append(frame)
+                    ids.append(index[label])
+                samples.append(ids)
+                weights.append(round(n * interval_ms, 3))
+            profiles.append({'type': 'sampled', 'name': f"{ep} ({data['requests']} requests)", 'unit': 'milliseconds',
+                             'startValue': 0, 'endValue': round(sum(weights), 3), 'samples': samples, 'weights': weights})
+        return {'$schema': 'https://www.speedscope.app/file-format-schema.json', 'name': 'pos-system',
+                'exporter': 'pos-system profiler', 'activeProfileIndex': 0, 'shared': {'frames': frames},
+                'profiles': profiles}
+
+    def info(self):
+        stats = collections.Counter()
+        for snap in self._snapshots():
+            stats.update(snap.get('stats', {}))
+        endpoints = [{'endpoint': ep, 'requests': data['requests'], 'samples': sum(data['stacks'].values()),
+                      'sampled_ms': round(sum(data['stacks'].values()) * self.interval * 1000, 1)}
+                     for ep, data in self.counts().items()]
+        endpoints.sort(key=lambda e: -e['samples'])
+        return {'enabled': self.enabled, 'session': self.session, 'rate': self.rate,
+                'interval_ms': round(self.interval * 1000, 3),
+                'remaining_seconds': round(max(0.0, self.until - time.time())) if self.enabled else 0,
+                'shared': self.state_dir is not None, 'samples': stats['samples'],
+                'sampler_ms': round(stats['sampler_ms'], 1), 'dropped_stacks': stats['dropped_stacks'],
+                'endpoints': endpoints}
@@ -0,0 +1,137 @@
+"""Read-only connection pool for report and export queries.
+
+Month-end reports and CSV exports scan sales and sale_items for seconds at
+a time. Run on the checkout connections, those scans hold read locks that
+make create_sale wait. Report and export queries go through a ReadPool
+instead. It has two modes:
+
+- "ro": pooled connections opened with a `mode=ro` URI on the live file.
+  The database is switched to WAL so these readers never block writers.
+  Results are always current.
+- "snapshot": pooled connections on a copy of the database made with the
+  sqlite3 backup API. The copy is refreshed once it is older than
+  refresh_seconds, so reports can lag checkouts by up to that long. The
+  live file is only locked for the copy itself, never for a report.
+
+Connections are handed out per request and returned to the pool. After a
+snapshot refresh, connections on the old copy are closed as they come back.
+"""
+import contextlib
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+MODES = ('ro', 'snapshot')
+
+
+class ReadPool:
+    def __init__(self, db_path, mode='ro', size=4, refresh_seconds=60.0, snapshot_path=None, prepare=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown read pool mode: {mode}")
+        self.db_path = db_path
+        self.mode = mode
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self.snapshot_path = snapshot_path or db_path + '.snapshot'
+        self._prepare = prepare
+        self._idle = queue.LifoQueue()
+        self._generation = 0
+        self._snapshot_at = None
+        self._refresh_lock = threading.Lock()
+        self._wal_checked = False
+        self.stats = {'opened': 0, 'reused': 0, 'snapshots': 0, 'last_snapshot_ms': None}
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn, generation = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn, generation)
+
+    def _acquire(self):
+        if self._prepare is not None:
+            self._prepare()
+        if self.mode == 'snapshot':
+            self._refresh_if_stale()
+        elif not self._wal_checked:
+            self.enable_wal()
+        while True:
+            try:
+                conn, generation = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self._generation:
+                self.stats['reused'] += 1
+                return conn, generation
+            conn.close()
+        generation = self._generation
+        path = self.snapshot_path if self.mode == 'snapshot' else self.db_path
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self.stats['opened'] += 1
+        return conn, generation
+
+    def _release(self, conn, generation):
+        if generation != self._generation or self._idle.qsize() >= self.size:
+            conn.close()
+            return
+        self._idle.put((conn, generation))
+
+    def enable_wal(self):
+        """Switch the live file to WAL (persistent, so once per database is enough)."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        self._wal_checked = True
+
+    def _refresh_if_stale(self):
+        if self._snapshot_at is not None and time.monotonic() - self._snapshot_at < self.refresh_seconds:
+            return
+        # One thread copies; the others keep reading the previous snapshot.
+        # There is no previous snapshot on first use, so then everyone waits.
+        if not self._refresh_lock.acquire(blocking=self._snapshot_at is None):
+            return
+        try:
+            if self._snapshot_at is None or time.monotonic() - self._snapshot_at >= self.refresh_seconds:
+                self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self):
+        """Copy the live database to the snapshot file (atomically replaced)."""
+        t = time.perf_counter()
+        # A temp file of our own: gunicorn workers may refresh at the same time.
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.snapshot_path) + '.', suffix='.tmp',
+                                   dir=os.path.dirname(os.path.abspath(self.snapshot_path)))
+        os.close(fd)
+        try:
+            src = sqlite3.connect(self.db_path)
+            dst = sqlite3.connect(tmp)
+            try:
+                # Single step: the live file is read-locked only for the page copy.
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+            os.replace(tmp, self.snapshot_path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        self._generation += 1
+        self._snapshot_at = time.monotonic()
+        self.stats['snapshots'] += 1
+        self.stats['last_snapshot_ms'] = round((time.perf_counter() - t) * 1000, 1)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
@@ -0,0 +1,155 @@
+"""Two-tier cache for report query results.
+
+Report endpoints are keyed by name plus their normalised (period, start,
+end) parameters. Results fall into two kinds:
+
+- Closed: an explicit range that ended before today (UTC, the timezone
+  sale dates are stored in). New sales are always dated today, so these
+  results only change when older history does (see clear() below). They
+  stay in the LRU and, when disk_dir is set, are also written to disk, so
+  they survive restarts and are shared by workers on the same host.
+- Live: anything touching today, or with no range at all. These are tagged
+  with the current generation. invalidate_live() bumps the generation after
+  every sale, refund or void. live_ttl also bounds how long another process's
+  writes can go unseen.
+
+clear() drops both tiers. It is used when old history changes underneath
+us: journal replay or offline sync inserting back-dated sales, or a refund
+or void of a sale from an earlier day.
+clear(disk=False) only drops this process's memory; coherence.py uses it
+when another worker has changed history and already cleared the disk tier.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def make_key(name, **params):
+    norm = {k: str(v).strip().lower() for k, v in params.items() if v not in (None, '')}
+    return name + ':' + json.dumps(norm, sort_keys=True, separators=(',', ':'))
+
+
+def is_closed(start, end, today=None):
+    """True when [start, end] is an explicit date range entirely before today."""
+    if not start or not end:
+        return False
+    try:
+        end_day = datetime.date.fromisoformat(str(end).strip()[:10])
+        datetime.date.fromisoformat(str(start).strip()[:10])
+    except ValueError:
+        return False
+    today = today or datetime.datetime.utcnow().date()
+    return end_day < today
+
+
+class ReportCache:
+    def __init__(self, maxsize=256, disk_dir=None, live_ttl=30.0):
+        self.maxsize = maxsize
+        self.disk_dir = disk_dir
+        self.live_ttl = live_ttl
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get_or_compute(self, key, compute, closed=False):
+        value = self.get(key)
+        if value is not None:
+            return value
+        generation = self._generation
+        value = compute()
+        self.put(key, value, closed=closed, generation=generation)
+        return value
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, closed, generation, stored_at = entry
+                if closed or (generation == self._generation and time.monotonic() - stored_at < self.live_ttl):
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return value
+                del self._entries[key]
+        value = self._disk_get(key)
+        if value is not None:
+            with self._lock:
+                self.stats['disk_hits'] += 1
+                self._store(key, (value, True, None, time.monotonic()))
+            return value
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value, closed=False, generation=None):
+        with self._lock:
+            if generation is None:
+                generation = self._generation
+            if not closed and generation != self._generation:
+                # A write landed while this result was being computed.
+                return
+            self._store(key, (value, closed, generation, time.monotonic()))
+        if closed:
+            self._disk_put(key, value)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate_live(self):
+        with self._lock:
+            self._generation += 1
+            self.stats['invalidations'] += 1
+
+    def clear(self, disk=True):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.stats['invalidations'] += 1
+        if disk and self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), maxsize=self.maxsize,
+                        disk=bool(self.disk_dir), generation=self._generation)
+
+    # --- disk tier (closed results only) ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return stored['value'] if stored.get('key') == key else None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'value': value}, f, separators=(',', ':'))
+            os.replace(tmp, path)
+        except (OSError, TypeError) as e:
+            print(f"Warning: report cache disk write failed: {e}")
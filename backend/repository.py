@@ -0,0 +1,1692 @@
+"""Data-access layer for products, sales, holds, users and reports.
+
+Route handlers in app.py call a repository instead of issuing SQL
+directly, so the storage engine can be chosen per deployment:
+
+- SQLiteRepository keeps the original single-file SQL and is the default.
+- PostgresRepository is selected when DATABASE_URL is a postgres:// URL.
+  It uses a thread-safe connection pool, row locks on stock checks and
+  server-side (named) cursors for report and export scans.
+
+Report and export methods use read_connection(), which can point at a
+separate read pool (readpool.ReadPool for SQLite, a replica DSN for
+PostgreSQL) so long scans do not compete with checkouts.
+
+Both implementations share the SQL below. Statements are written with
+SQLite's `?` placeholders and translated for psycopg2. Dialect differences
+(date bucketing, "now", row locking, returning new ids) go through the
+small hook methods that PostgresRepository overrides.
+
+Repository methods return plain dicts. Unique-constraint violations are
+raised as repository.IntegrityError whichever engine is underneath.
+"""
+import contextlib
+import datetime
+import json
+import buckets
+import sqlite3
+import threading
+import time
+import uuid
+
+STREAM_BATCH_SIZE = 2000
+
+# Column order of export_batches() rows, per table.
+EXPORT_COLUMNS = {
+    'sales': ('id', 'date', 'cashier', 'payment_method', 'payment_reference', 'subtotal', 'vat', 'total', 'status'),
+    'sale_items': ('sale_id', 'product_id', 'quantity', 'price', 'sale_date'),
+    'products': ('id', 'parent_id', 'name', 'category', 'price', 'stock', 'barcode', 'low_stock_threshold', 'min_price'),
+}
+
+# Columns a product list can be narrowed to (?fields= on the list endpoints).
+PRODUCT_FIELDS = ('id', 'name', 'parent_id', 'price', 'stock', 'category', 'barcode',
+                  'low_stock_threshold', 'image_url', 'min_price')
+
+# Variant chains deeper than this are cut off (and a parent_id cycle ends).
+MAX_VARIANT_DEPTH = 8
+
+# Reports merge closed days from z_report_lines with live sales rows for
+# the open days in between; past this many open stretches they just scan sales.
+MAX_OPEN_RANGES = 32
+
+# Column order of rows passed to insert_audit_entries().
+AUDIT_COLUMNS = ('sale_id', 'product_id', 'action', 'reason', 'actor', 'details', 'date')
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class SQLiteRepository:
+    engine = 'sqlite'
+    for_update = ''
+
+    def __init__(self, connect, read_pool=None):
+        self._connect = connect
+        self.read_pool = read_pool
+        self._pinned = threading.local()
+
+    # --- connections and dialect hooks ---
+
+    def after_fork(self):
+        """Nothing to reopen: connections are opened per request and the read pool opens lazily."""
+
+    @contextlib.contextmanager
+    def connection(self):
+        pinned = getattr(self._pinned, 'conn', None)
+        conn = pinned or self._connect()
+        try:
+            yield conn
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        finally:
+            if pinned is None:
+                conn.close()
+            elif conn.in_transaction:
+                # What closing would have done to an unfinished transaction.
+                conn.rollback()
+
+    @contextlib.contextmanager
+    def pinned_connection(self):
+        """Serve every connection() on this thread from one connection until exit.
+
+        /api/batch uses it so its sub-requests share a single connection.
+        """
+        if getattr(self._pinned, 'conn', None) is not None:
+            yield self._pinned.conn
+            return
+        with self.connection() as conn:
+            self._pinned.conn = conn
+            try:
+                yield conn
+            finally:
+                self._pinned.conn = None
+
+    @contextlib.contextmanager
+    def read_connection(self):
+        """Connection for long read-only scans (reports, exports)."""
+        if self.read_pool is None:
+            with self.connection() as conn:
+                yield conn
+            return
+        with self.read_pool.connection() as conn:
+            yield conn
+
+    def execute(self, conn, sql, params=()):
+        return conn.execute(sql, params)
+
+    def begin(self, conn):
+        # IMMEDIATE takes the write lock up front. A deferred transaction that
+        # reads and then writes gets SQLITE_BUSY straight away, without
+        # waiting, if another connection committed in between (always
+        # possible in WAL mode with several workers).
+        conn.execute("BEGIN IMMEDIATE")
+
+    def insert(self, conn, sql, params=()):
+        """Run an INSERT and return the new row id."""
+        return conn.execute(sql, params).lastrowid
+
+    def stream(self, conn, sql, params=()):
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            for r in rows:
+                yield dict(r)
+
+    def stream_batches(self, conn, sql, params=(), batch_size=STREAM_BATCH_SIZE):
+        """Yield lists of plain row tuples, batch_size rows at a time."""
+        cur = conn.cursor()
+        cur.row_factory = None
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def one(self, conn, sql, params=()):
+        row = self.execute(conn, sql, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def all(self, conn, sql, params=()):
+        return [dict(r) for r in self.execute(conn, sql, params).fetchall()]
+
+    def period_label(self, period, col):
+        if period == 'daily':
+            return f"DATE({col})"
+        if period == 'weekly':
+            return f"strftime('%Y-W%W', {col})"
+        if period == 'monthly':
+            return f"strftime('%Y-%m', {col})"
+        return f"strftime('%Y', {col})"
+
+    def day(self, col):
+        return f"DATE({col})"
+
+    def day_number(self, col):
+        """Days since 1970-01-01 of a stored date, as an integer."""
+        return f"CAST(julianday(substr({col}, 1, 10)) - 2440587.5 AS INTEGER)"
+
+    def current_period_filter(self, period, col):
+        """WHERE fragment selecting the current local day/week/month."""
+        if period == 'daily':
+            return f"DATE({col}) = DATE('now','localtime')"
+        if period == 'weekly':
+            return f"DATE({col}) >= DATE('now','-6 days','localtime')"
+        return f"strftime('%Y-%m', {col}) = strftime('%Y-%m','now','localtime')"
+
+    def utc_today(self):
+        return "DATE('now')"
+
+    def like(self):
+        # SQLite's LIKE is already case-insensitive for ASCII.
+        return "LIKE"
+
+    def has_legacy_items_column(self, conn):
+        cols = [row['name'] for row in conn.execute("PRAGMA table_info(sales)").fetchall()]
+        return 'items' in cols
+
+    # --- users ---
+
+    def get_user_by_id(self, user_id):
+        with self.connection() as conn:
+            return self.one(conn, 'SELECT * FROM users WHERE id = ?', (user_id,))
+
+    def get_user_by_username(self, username):
+        with self.connection() as conn:
+            return self.one(conn, 'SELECT * FROM users WHERE username = ?', (username,))
+
+    def list_users(self, role=None):
+        with self.connection() as conn:
+            if role:
+                return self.all(conn, "SELECT id, username, role FROM users WHERE role = ?", (role,))
+            return self.all(conn, "SELECT id, username, role FROM users")
+
+    def create_user(self, username, password_hash, role):
+        with self.connection() as conn:
+            new_id = self.insert(conn, "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                                 (username, password_hash, role))
+            conn.commit()
+            return new_id
+
+    def set_password_hash(self, user_id, password_hash):
+        with self.connection() as conn:
+            self.execute(conn, "UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+            conn.commit()
+
+    # --- banks and categories ---
+
+    def list_banks(self):
+        with self.connection() as conn:
+            return self.all(conn, "SELECT id, name FROM banks ORDER BY name")
+
+    def add_bank(self, name):
+        with self.connection() as conn:
+            self.execute(conn, "INSERT INTO banks (name) VALUES (?)", (name,))
+            conn.commit()
+
+    def list_categories(self):
+        with self.connection() as conn:
+            return self.all(conn, "SELECT id, name FROM categories ORDER BY name")
+
+    def add_category(self, name):
+        with self.connection() as conn:
+            self.execute(conn, "INSERT INTO categories (name) VALUES (?)", (name,))
+            conn.commit()
+
+    # --- products ---
+
+    def list_products(self, columns=None):
+        """Every product; only the given PRODUCT_FIELDS columns if columns is set."""
+        if columns is None:
+            select = '*'
+        else:
+            unknown = set(columns) - set(PRODUCT_FIELDS)
+            if unknown:
+                raise ValueError(f"unknown product columns: {', '.join(sorted(unknown))}")
+            select = ', '.join(columns)
+        with self.connection() as conn:
+            return self.all(conn, f'SELECT {select} FROM products')
+
+    def get_product(self, product_id):
+        with self.connection() as conn:
+            return self.one(conn, "SELECT * FROM products WHERE id = ?", (product_id,))
+
+    def get_product_by_barcode(self, barcode):
+        with self.connection() as conn:
+            return self.one(conn, 'SELECT * FROM products WHERE barcode = ?', (barcode,))
+
+    def product_stock_batches(self, batch_size=STREAM_BATCH_SIZE):
+        """(id, stock) batches for every product, ordered by id."""
+        with self.read_connection() as conn:
+            yield from self.stream_batches(conn, "SELECT id, stock FROM products ORDER BY id", (), batch_size)
+
+    def get_products_by_ids(self, ids):
+        """{id: product} for the given ids."""
+        found = {}
+        ids = list(ids)
+        with self.connection() as conn:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                sql = f"SELECT * FROM products WHERE id IN ({', '.join('?' * len(chunk))})"
+                for row in self.all(conn, sql, tuple(chunk)):
+                    found[row['id']] = row
+        return found
+
+    def low_stock_products(self):
+        with self.connection() as conn:
+            return self.all(conn, "SELECT * FROM products WHERE low_stock_threshold IS NOT NULL AND stock <= low_stock_threshold")
+
+    def create_product(self, name, price, stock, category, barcode, low_stock_threshold, image_url, min_price):
+        with self.connection() as conn:
+            new_id = self.insert(
+                conn,
+                "INSERT INTO products (name, price, stock, category, barcode, low_stock_threshold, image_url, min_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, price, stock, category, barcode, low_stock_threshold, image_url, min_price)
+            )
+            conn.commit()
+            return new_id
+
+    def create_variants(self, parent_id, variants):
+        """Insert child products of parent_id; returns new ids, or None if no parent."""
+        with self.connection() as conn:
+            parent = self.one(conn, "SELECT * FROM products WHERE id = ?", (parent_id,))
+            if not parent:
+                return None
+            created_ids = []
+            for v in variants:
+                color = (v.get('color') or '').strip()
+                size = (v.get('size') or '').strip()
+                name_suffix = " ".join([s for s in [size, color] if s]).strip()
+                child_name = parent['name'] + (f" ({name_suffix})" if name_suffix else "")
+                price = v.get('price', parent['price'])
+                stock = v.get('stock', 0)
+                barcode = (v.get('barcode') or '').strip() or None
+                min_price = v.get('min_price', parent['min_price'])
+                created_ids.append(self.insert(
+                    conn,
+                    "INSERT INTO products (name, parent_id, price, stock, category, barcode, low_stock_threshold, image_url, min_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (child_name, parent['id'], float(price), int(stock), parent['category'], barcode, parent['low_stock_threshold'], parent['image_url'], float(min_price) if min_price is not None else None)
+                ))
+            conn.commit()
+            return created_ids
+
+    def product_groups(self, root_id=None, columns=None):
+        """Products in variant-tree order, from one recursive query.
+
+        Each row also has root_id (its top-level product), depth (0 for the
+        root), and the tree's variant_stock and variant_count (its rows
+        below depth 0). Rows come root by root, parents before children.
+        With root_id, only that product's tree, rooted there; otherwise
+        every product whose parent_id is NULL or missing starts a tree.
+        """
+        if columns is None:
+            columns = PRODUCT_FIELDS
+        elif set(columns) - set(PRODUCT_FIELDS):
+            raise ValueError(f"unknown product columns: {', '.join(sorted(set(columns) - set(PRODUCT_FIELDS)))}")
+        if root_id is None:
+            roots = "SELECT id, id, 0 FROM products WHERE parent_id IS NULL OR parent_id NOT IN (SELECT id FROM products)"
+            params = (MAX_VARIANT_DEPTH,)
+        else:
+            roots = "SELECT id, id, 0 FROM products WHERE id = ?"
+            params = (root_id, MAX_VARIANT_DEPTH)
+        select = ', '.join(f'p.{c}' for c in columns)
+        sql = f"""
+            WITH RECURSIVE tree(id, root_id, depth) AS (
+                {roots}
+                UNION ALL
+                SELECT p.id, t.root_id, t.depth + 1
+                FROM products p JOIN tree t ON p.parent_id = t.id
+                WHERE t.depth < ?
+            )
+            SELECT {select}, t.root_id AS root_id, t.depth AS depth,
+                   SUM(CASE WHEN t.depth > 0 THEN p.stock ELSE 0 END) OVER (PARTITION BY t.root_id) AS variant_stock,
+                   COUNT(*) OVER (PARTITION BY t.root_id) - 1 AS variant_count
+            FROM tree t JOIN products p ON p.id = t.id
+            ORDER BY t.root_id, t.depth, p.id
+        """
+        with self.connection() as conn:
+            return self.all(conn, sql, params)
+
+    def update_product_field(self, product_id, field, value):
+        """Set one product field; returns its previous value (None if no such product)."""
+        if field not in ('stock', 'low_stock_threshold', 'min_price', 'image_url'):
+            raise ValueError(f"field not updatable: {field}")
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                row = self.one(conn, f"SELECT {field} AS old FROM products WHERE id = ?" + self.for_update, (product_id,))
+                self.execute(conn, f"UPDATE products SET {field} = ? WHERE id = ?", (value, product_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return row['old'] if row else None
+
+    def table_revision(self, name):
+        """Revision counter for a table, bumped by triggers on every write (0 if untracked)."""
+        with self.connection() as conn:
+            row = self.one(conn, "SELECT revision FROM table_revisions WHERE name = ?", (name,))
+        return row['revision'] if row else 0
+
+    def table_revisions(self):
+        """{name: revision} for every tracked table."""
+        with self.connection() as conn:
+            return {row['name']: row['revision'] for row in self.all(conn, "SELECT name, revision FROM table_revisions")}
+
+    def catalog_rows(self):
+        """(id, name, category, price, min_price, stock, barcode, image_url, low_stock_threshold) ordered by id.
+
+        Read on the primary rather than the read pool, whose snapshot could
+        be older than the revision it gets cached under.
+        """
+        with self.connection() as conn:
+            for rows in self.stream_batches(conn, """
+                SELECT id, name, category, price, min_price, stock, barcode, image_url, low_stock_threshold
+                FROM products ORDER BY id
+            """):
+                yield from rows
+
+    def iter_products_export(self):
+        with self.read_connection() as conn:
+            yield from self.stream(conn, "SELECT id, name, category, price, stock, barcode, low_stock_threshold, min_price FROM products ORDER BY name")
+
+    # --- idempotency keys ---
+
+    def claim_idempotency_key(self, key, request_hash, lock_seconds, now=None):
+        """Reserve key for a new request; returns None if claimed, else the stored row.
+
+        The claim holds for lock_seconds, so a request that dies before
+        complete_idempotency_key() stops blocking retries once it lapses.
+        An expired row is replaced as if it were absent.
+        """
+        now = int(now if now is not None else time.time())
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                self.execute(conn, "DELETE FROM idempotency_keys WHERE key = ? AND expires_at <= ?", (key, now))
+                cur = self.execute(conn, """
+                    INSERT INTO idempotency_keys (key, request_hash, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO NOTHING
+                """, (key, request_hash, now + lock_seconds))
+                row = None if cur.rowcount == 1 else self.one(
+                    conn, "SELECT request_hash, status_code, response, expires_at FROM idempotency_keys WHERE key = ?", (key,))
+                conn.commit()
+                return row
+            except Exception:
+                conn.rollback()
+                raise
+
+    def complete_idempotency_key(self, key, status_code, response, ttl_seconds, conn=None, now=None):
+        """Store the response for a claimed key (first write wins).
+
+        Pass conn to write inside the caller's transaction.
+        """
+        now = int(now if now is not None else time.time())
+        params = (status_code, response, now + ttl_seconds, key)
+        sql = "UPDATE idempotency_keys SET status_code = ?, response = ?, expires_at = ? WHERE key = ? AND status_code IS NULL"
+        if conn is not None:
+            self.execute(conn, sql, params)
+            return
+        with self.connection() as own:
+            self.execute(own, sql, params)
+            own.commit()
+
+    def release_idempotency_key(self, key):
+        """Drop an unfinished claim so the request can be retried."""
+        with self.connection() as conn:
+            self.execute(conn, "DELETE FROM idempotency_keys WHERE key = ? AND status_code IS NULL", (key,))
+            conn.commit()
+
+    def purge_idempotency_keys(self, now=None):
+        """Delete expired keys; returns how many were removed."""
+        now = int(now if now is not None else time.time())
+        with self.connection() as conn:
+            cur = self.execute(conn, "DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+            conn.commit()
+            return cur.rowcount
+
+    # --- sales ---
+
+    def create_sale(self, items, payment_method, payment_reference, cashier, before_commit=None, client_key=None):
+        """Record a sale and decrement stock atomically; returns the sale id.
+
+        before_commit(conn, sale_id, totals) runs inside the transaction.
+        client_key, when given, is recorded like a synced offline sale so
+        sync_sales() treats a queued copy of this sale as a duplicate.
+        """
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                sale_id, totals = self._insert_sale(conn, items, payment_method, payment_reference, cashier)
+                if client_key:
+                    self.execute(conn, """
+                        INSERT INTO sale_sync_keys (client_key, sale_id, cashier) VALUES (?, ?, ?)
+                        ON CONFLICT (client_key) DO NOTHING
+                    """, (client_key, sale_id, cashier))
+                if before_commit is not None:
+                    before_commit(conn, sale_id, totals)
+                conn.commit()
+                return sale_id
+            except Exception:
+                conn.rollback()
+                raise
+
+    def sync_sales(self, sales, cashier, before_commit=None):
+        """Apply sales queued offline by a till in one transaction.
+
+        Each sale is a dict with client_key, items, payment_method,
+        payment_reference and an optional date ('YYYY-MM-DD HH:MM:SS' UTC).
+        Sales are validated like create_sale, each under its own savepoint,
+        so one rejected sale does not undo the others. A client_key that
+        was already synced is reported as a duplicate and not re-applied.
+        before_commit(conn, sale_id, totals, sale) runs for each applied
+        sale inside its savepoint. Returns one {client_key, status, saleId?,
+        total?, error?} per sale, where status is 'applied', 'duplicate' or
+        'rejected'.
+        """
+        results = []
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                for sale in sales:
+                    key = sale['client_key']
+                    existing = self._synced_sale_id(conn, key)
+                    if existing is not None:
+                        results.append({"client_key": key, "status": "duplicate", "saleId": existing})
+                        continue
+                    self.execute(conn, "SAVEPOINT sync_sale")
+                    try:
+                        sale_id, totals = self._insert_sale(conn, sale['items'], sale['payment_method'],
+                                                            sale.get('payment_reference'), cashier, sale.get('date'))
+                        self.execute(conn, "INSERT INTO sale_sync_keys (client_key, sale_id, cashier) VALUES (?, ?, ?)",
+                                     (key, sale_id, cashier))
+                        if before_commit is not None:
+                            before_commit(conn, sale_id, totals, sale)
+                        self.execute(conn, "RELEASE SAVEPOINT sync_sale")
+                        results.append({"client_key": key, "status": "applied", "saleId": sale_id,
+                                        "total": totals['total']})
+                    except Exception as e:
+                        self.execute(conn, "ROLLBACK TO SAVEPOINT sync_sale")
+                        self.execute(conn, "RELEASE SAVEPOINT sync_sale")
+                        # Another request may have synced the same key meanwhile.
+                        existing = self._synced_sale_id(conn, key)
+                        if existing is not None:
+                            results.append({"client_key": key, "status": "duplicate", "saleId": existing})
+                        else:
+                            results.append({"client_key": key, "status": "rejected", "error": str(e)})
+                conn.commit()
+                return results
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _synced_sale_id(self, conn, client_key):
+        row = self.one(conn, "SELECT sale_id FROM sale_sync_keys WHERE client_key = ?", (client_key,))
+        return row['sale_id'] if row else None
+
+    def _insert_sale(self, conn, items, payment_method, payment_reference, cashier, date=None):
+        """Insert a sale with its items inside the caller's transaction; returns (sale_id, totals).
+
+        Raises ValueError for an unknown product, a price below min_price
+        or insufficient stock. date defaults to now.
+        """
+        subtotal = 0
+        for item in items:
+            subtotal += float(item['price']) * int(item['quantity'])
+        vat = round(subtotal * 0.16)
+        total = subtotal + vat
+
+        columns = ['total', 'subtotal', 'vat', 'cashier', 'payment_method', 'payment_reference']
+        values = [total, subtotal, vat, cashier, payment_method, payment_reference]
+        if date is not None:
+            columns.append('date')
+            values.append(date)
+        if self.has_legacy_items_column(conn):
+            columns.append('items')
+            values.append(json.dumps(items))
+        sale_id = self.insert(
+            conn,
+            f"INSERT INTO sales ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            tuple(values)
+        )
+
+        for item in items:
+            product_id = item['productId']
+            quantity = item['quantity']
+            price = item['price']
+
+            cur = self.one(conn, "SELECT stock, min_price FROM products WHERE id = ?" + self.for_update, (product_id,))
+            if not cur:
+                raise ValueError("Product not found")
+            if cur['min_price'] is not None and float(price) < float(cur['min_price']):
+                raise ValueError("Price below minimum allowed")
+            if cur['stock'] < quantity:
+                raise ValueError("Insufficient stock")
+
+            self.execute(conn, "UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
+            self.execute(conn, "INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                         (sale_id, product_id, quantity, price))
+
+        self.execute(conn, buckets.ADD_SALE_SQL, (sale_id,))
+        return sale_id, {"total": total, "subtotal": subtotal, "vat": vat}
+
+    def get_sale(self, sale_id):
+        """Return (sale, items) or (None, None)."""
+        with self.connection() as conn:
+            sale = self.one(conn, "SELECT id, date, cashier, payment_method, payment_reference, subtotal, vat, total, status FROM sales WHERE id = ?", (sale_id,))
+            if not sale:
+                return None, None
+            items = self.all(conn, """
+                SELECT si.product_id, si.quantity, si.price, COALESCE(p.name, '') as name
+                FROM sale_items si
+                LEFT JOIN products p ON si.product_id = p.id
+                WHERE si.sale_id = ?
+            """, (sale_id,))
+            return sale, items
+
+    def reverse_sale(self, sale_id, action, reason, actor, before_commit=None):
+        """Refund or void a completed sale: restock, set status, write audit_log. Returns the sale's date."""
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                sale = self.one(conn, "SELECT * FROM sales WHERE id = ?" + self.for_update, (sale_id,))
+                if not sale:
+                    raise ValueError("Sale not found")
+                if sale['status'] != 'completed':
+                    raise ValueError("Sale not refundable" if action == 'refund' else "Sale not voidable")
+                if action == 'void':
+                    sale_date = self.one(conn, f"SELECT {self.day('date')} as d FROM sales WHERE id = ?", (sale_id,))['d']
+                    today = self.one(conn, f"SELECT {self.utc_today()} as d")['d']
+                    if sale_date != today:
+                        raise ValueError("Void only allowed same day")
+                items = self.all(conn, "SELECT product_id, quantity FROM sale_items WHERE sale_id = ?", (sale_id,))
+                for it in items:
+                    self.execute(conn, "UPDATE products SET stock = stock + ? WHERE id = ?", (it['quantity'], it['product_id']))
+                status = 'refunded' if action == 'refund' else 'voided'
+                self.execute(conn, f"UPDATE sales SET status = '{status}' WHERE id = ?", (sale_id,))
+                self.execute(conn, "INSERT INTO audit_log (sale_id, action, reason, actor) VALUES (?, ?, ?, ?)",
+                             (sale_id, action, reason, actor))
+                self.execute(conn, buckets.ADD_REVERSAL_SQL[action], (sale_id,))
+                if before_commit is not None:
+                    before_commit(conn, sale_id)
+                conn.commit()
+                return sale['date']
+            except Exception:
+                conn.rollback()
+                raise
+
+    def recent_sales(self, start=None, end=None, q='', limit=50):
+        with self.connection() as conn:
+            base = """
+                SELECT id, date, cashier, payment_method, payment_reference, subtotal, vat, total, status
+                FROM sales
+            """
+            params = []
+            where = []
+            if start and end:
+                where.append(f"{self.day('date')} BETWEEN ? AND ?")
+                params.extend([start, end])
+            if q:
+                like = self.like()
+                where.append(f"(CAST(id AS TEXT) {like} ? OR cashier {like} ? OR payment_reference {like} ?)")
+                pattern = f"%{q}%"
+                params.extend([pattern, pattern, pattern])
+            if where:
+                base += " WHERE " + " AND ".join(where)
+            base += " ORDER BY date DESC LIMIT ?"
+            params.append(limit)
+            return self.all(conn, base, tuple(params))
+
+    def iter_sales_export(self, start=None, end=None):
+        with self.read_connection() as conn:
+            base = """
+                SELECT id, date, cashier, payment_method, payment_reference, subtotal, vat, total, status
+                FROM sales
+            """
+            params = ()
+            if start and end:
+                base += f" WHERE {self.day('date')} BETWEEN ? AND ?"
+                params = (start, end)
+            base += " ORDER BY date DESC"
+            yield from self.stream(conn, base, params)
+
+    def export_batches(self, table, start=None, end=None, batch_size=STREAM_BATCH_SIZE):
+        """Yield row-tuple batches of sales, sale_items or products for bulk export.
+
+        Columns are EXPORT_COLUMNS[table]; dated tables come oldest first.
+        """
+        params = ()
+        if table == 'products':
+            sql = f"SELECT {', '.join(EXPORT_COLUMNS['products'])} FROM products ORDER BY id"
+        elif table == 'sales':
+            sql = f"SELECT {', '.join(EXPORT_COLUMNS['sales'])} FROM sales"
+            if start and end:
+                sql += f" WHERE {self.day('date')} BETWEEN ? AND ?"
+                params = (start, end)
+            sql += " ORDER BY date, id"
+        elif table == 'sale_items':
+            sql = """
+                SELECT si.sale_id, si.product_id, si.quantity, si.price, s.date AS sale_date
+                FROM sale_items si
+                JOIN sales s ON s.id = si.sale_id
+            """
+            if start and end:
+                sql += f" WHERE {self.day('s.date')} BETWEEN ? AND ?"
+                params = (start, end)
+            sql += " ORDER BY s.date, si.sale_id"
+        else:
+            raise ValueError(f"unknown export table: {table}")
+        with self.read_connection() as conn:
+            yield from self.stream_batches(conn, sql, params, batch_size)
+
+    def sales_high_water(self):
+        """(max sales.id, max audit_log.id), 0 when empty."""
+        with self.read_connection() as conn:
+            return (self.one(conn, "SELECT COALESCE(MAX(id), 0) AS m FROM sales")['m'],
+                    self.one(conn, "SELECT COALESCE(MAX(id), 0) AS m FROM audit_log")['m'])
+
+    def first_sale_id_since(self, day):
+        """Lowest id of a sale dated on or after day (None if there is none)."""
+        with self.read_connection() as conn:
+            return self.one(conn, f"SELECT MIN(id) AS m FROM sales WHERE {self.day('date')} >= ?", (day,))['m']
+
+    def item_sale_batches(self, after_sale_id, upto_sale_id, since=None, batch_size=STREAM_BATCH_SIZE):
+        """(product_id, day_number, quantity) batches for sales with after < id <= upto."""
+        sql = f"""
+            SELECT si.product_id, {self.day_number('s.date')}, si.quantity
+            FROM sales s
+            JOIN sale_items si ON si.sale_id = s.id
+            WHERE s.id > ? AND s.id <= ?
+        """
+        params = [after_sale_id, upto_sale_id]
+        if since:
+            sql += f" AND {self.day('s.date')} >= ?"
+            params.append(since)
+        with self.read_connection() as conn:
+            yield from self.stream_batches(conn, sql, tuple(params), batch_size)
+
+    def reversed_item_batches(self, after_audit_id, upto_audit_id, since=None, batch_size=STREAM_BATCH_SIZE):
+        """(product_id, day_number, quantity) batches for refunds/voids with after < audit id <= upto."""
+        sql = f"""
+            SELECT si.product_id, {self.day_number('s.date')}, si.quantity
+            FROM audit_log a
+            JOIN sales s ON s.id = a.sale_id
+            JOIN sale_items si ON si.sale_id = s.id
+            WHERE a.id > ? AND a.id <= ? AND a.action IN ('refund', 'void')
+        """
+        params = [after_audit_id, upto_audit_id]
+        if since:
+            sql += f" AND {self.day('s.date')} >= ?"
+            params.append(since)
+        with self.read_connection() as conn:
+            yield from self.stream_batches(conn, sql, tuple(params), batch_size)
+
+    def bucket_rows(self, start_day, end_day, cashier=None, payment_method=None, group=None):
+        """Summed sales_buckets per (UTC day, hour[, group column]) for start_day..end_day."""
+        if group not in (None, 'cashier', 'payment_method'):
+            raise ValueError(f"cannot group buckets by {group}")
+        keys = "day, hour" + (f", {group}" if group else "")
+        sql = f"""
+            SELECT {keys}, SUM(sales_count) AS sales_count, SUM(sales_total) AS sales_total,
+                   SUM(refund_count) AS refund_count, SUM(refund_total) AS refund_total,
+                   SUM(void_count) AS void_count, SUM(void_total) AS void_total
+            FROM sales_buckets
+            WHERE day BETWEEN ? AND ?
+        """
+        params = [start_day, end_day]
+        if cashier:
+            sql += " AND cashier = ?"
+            params.append(cashier)
+        if payment_method:
+            sql += " AND payment_method = ?"
+            params.append(payment_method)
+        sql += f" GROUP BY {keys}"
+        with self.read_connection() as conn:
+            return list(self.stream(conn, sql, tuple(params)))
+
+    def rebuild_buckets(self, start_day=None, end_day=None):
+        """Recompute sales_buckets from sales (all days, or start..end); returns bucket rows."""
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                if start_day and end_day:
+                    self.execute(conn, "DELETE FROM sales_buckets WHERE day BETWEEN ? AND ?", (start_day, end_day))
+                    self.execute(conn, buckets.REBUILD_SQL.format(where="AND substr(date, 1, 10) BETWEEN ? AND ?"),
+                                 (start_day, end_day))
+                    params = (start_day, end_day)
+                    count_sql = "SELECT COUNT(*) AS c FROM sales_buckets WHERE day BETWEEN ? AND ?"
+                else:
+                    self.execute(conn, "DELETE FROM sales_buckets")
+                    self.execute(conn, buckets.REBUILD_SQL.format(where=""))
+                    params = ()
+                    count_sql = "SELECT COUNT(*) AS c FROM sales_buckets"
+                count = self.one(conn, count_sql, params)['c']
+                conn.commit()
+                return count
+            except Exception:
+                conn.rollback()
+                raise
+
+    # --- audit log ---
+
+    def insert_audit_entries(self, rows):
+        """Insert audit rows (tuples in AUDIT_COLUMNS order) in one transaction."""
+        sql = f"INSERT INTO audit_log ({', '.join(AUDIT_COLUMNS)}) VALUES ({', '.join('?' * len(AUDIT_COLUMNS))})"
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                self._executemany(conn, sql, rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _executemany(self, conn, sql, rows):
+        conn.executemany(sql, rows)
+
+    def query_audit(self, sale_id=None, actor=None, action=None, start=None, end=None, before_id=None, limit=100):
+        """Audit rows, newest first. Filters map onto the (sale_id), (actor, date) and (date) indexes."""
+        where, params = [], []
+        if sale_id is not None:
+            where.append("sale_id = ?")
+            params.append(sale_id)
+        if actor:
+            where.append("actor = ?")
+            params.append(actor)
+        if action:
+            where.append("action = ?")
+            params.append(action)
+        if start:
+            where.append("date >= ?")
+            params.append(start)
+        if end:
+            where.append("date < ?")
+            params.append(end)
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(before_id)
+        sql = "SELECT id, date, action, sale_id, product_id, actor, reason, details FROM audit_log"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # Ordering by date keeps the date indexes usable; id breaks ties.
+        sql += " ORDER BY date DESC, id DESC LIMIT ?"
+        params.append(int(limit))
+        with self.read_connection() as conn:
+            return self.all(conn, sql, tuple(params))
+
+    def oldest_audit_date(self):
+        with self.connection() as conn:
+            row = self.one(conn, "SELECT MIN(date) AS d FROM audit_log")
+        return row['d'] if row else None
+
+    def audit_rows(self, start, end, batch_size=STREAM_BATCH_SIZE):
+        """(id, date, action, sale_id, product_id, actor, reason, details) batches with start <= date < end, by id.
+
+        Read on the primary, since archive_audit_range() checks its delete count against these rows.
+        """
+        with self.connection() as conn:
+            yield from self.stream_batches(conn, """
+                SELECT id, date, action, sale_id, product_id, actor, reason, details
+                FROM audit_log WHERE date >= ? AND date < ? ORDER BY id
+            """, (start, end), batch_size)
+
+    def archive_audit_range(self, start, end, name, month, first_id, last_id, rows):
+        """Delete archived rows (start <= date < end, id <= last_id) and record the archive file."""
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                cur = self.execute(conn, "DELETE FROM audit_log WHERE date >= ? AND date < ? AND id <= ?", (start, end, last_id))
+                if cur.rowcount != rows:
+                    raise RuntimeError(f"audit archive {name}: expected to delete {rows} rows, found {cur.rowcount}")
+                self.execute(conn, "INSERT INTO audit_archives (name, month, first_id, last_id, rows) VALUES (?, ?, ?, ?, ?)",
+                             (name, month, first_id, last_id, rows))
+                conn.commit()
+                return cur.rowcount
+            except Exception:
+                conn.rollback()
+                raise
+
+    def list_audit_archives(self):
+        with self.connection() as conn:
+            return self.all(conn, "SELECT name, month, first_id, last_id, rows, archived_at FROM audit_archives ORDER BY month, name")
+
+    # --- holds ---
+
+    def list_holds(self, cashier=None, now=None):
+        """Unexpired holds, newest first (uses the (cashier, date) index)."""
+        now = int(now if now is not None else time.time())
+        columns = "id, date, cashier, note, subtotal, vat, total, reserved, expires_at"
+        live = "(expires_at IS NULL OR expires_at > ?)"
+        with self.connection() as conn:
+            if cashier is not None:
+                return self.all(conn, f"SELECT {columns} FROM holds WHERE cashier = ? AND {live} ORDER BY date DESC", (cashier, now))
+            return self.all(conn, f"SELECT {columns} FROM holds WHERE {live} ORDER BY date DESC", (now,))
+
+    def create_hold(self, cashier, note, items, payment_method, payment_reference, subtotal, vat, total,
+                    ttl_seconds=None, reserve=False, now=None):
+        """Store a held cart; returns the hold id.
+
+        With reserve, the held quantities are soft-reserved: the hold is
+        refused unless stock minus other live reservations covers every
+        line. Reservations do not touch products.stock and lapse with the
+        hold, when it is deleted or expires.
+        """
+        now = int(now if now is not None else time.time())
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        lines = [(it.get('productId'), it.get('name'), int(it.get('quantity') or 0), float(it.get('price') or 0))
+                 for it in items]
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                if reserve:
+                    wanted = {}
+                    for product_id, _, quantity, _ in lines:
+                        wanted[product_id] = wanted.get(product_id, 0) + quantity
+                    held = self._reserved(conn, wanted, now)
+                    for product_id, quantity in wanted.items():
+                        row = self.one(conn, "SELECT name, stock FROM products WHERE id = ?" + self.for_update, (product_id,))
+                        if not row:
+                            raise ValueError("Product not found")
+                        if row['stock'] - held.get(product_id, 0) < quantity:
+                            raise ValueError(f"Insufficient stock to reserve {row['name']}")
+                new_id = self.insert(conn, """
+                    INSERT INTO holds (cashier, note, payment_method, payment_reference, subtotal, vat, total, reserved, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (cashier, note, payment_method, payment_reference, subtotal, vat, total, 1 if reserve else 0, expires_at))
+                for position, line in enumerate(lines):
+                    self.execute(conn, "INSERT INTO hold_items (hold_id, position, product_id, name, quantity, price) VALUES (?, ?, ?, ?, ?, ?)",
+                                 (new_id, position) + line)
+                conn.commit()
+                return new_id
+            except Exception:
+                conn.rollback()
+                raise
+
+    def get_hold(self, hold_id, now=None):
+        """The hold with its items as [{productId, name, quantity, price}], or None if missing/expired."""
+        now = int(now if now is not None else time.time())
+        with self.connection() as conn:
+            hold = self.one(conn, "SELECT * FROM holds WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)", (hold_id, now))
+            if not hold:
+                return None
+            hold['items'] = [{"productId": r['product_id'], "name": r['name'], "quantity": r['quantity'], "price": r['price']}
+                             for r in self.all(conn, "SELECT product_id, name, quantity, price FROM hold_items WHERE hold_id = ? ORDER BY position", (hold_id,))]
+            return hold
+
+    def delete_hold(self, hold_id):
+        with self.connection() as conn:
+            self.execute(conn, "DELETE FROM hold_items WHERE hold_id = ?", (hold_id,))
+            self.execute(conn, "DELETE FROM holds WHERE id = ?", (hold_id,))
+            conn.commit()
+
+    def purge_expired_holds(self, now=None):
+        """Delete expired holds and their items; returns how many holds were removed."""
+        now = int(now if now is not None else time.time())
+        with self.connection() as conn:
+            self.execute(conn, "DELETE FROM hold_items WHERE hold_id IN (SELECT id FROM holds WHERE expires_at <= ?)", (now,))
+            cur = self.execute(conn, "DELETE FROM holds WHERE expires_at <= ?", (now,))
+            conn.commit()
+            return cur.rowcount
+
+    def reserved_stock(self, now=None):
+        """{product_id: quantity} soft-reserved by live holds."""
+        now = int(now if now is not None else time.time())
+        with self.connection() as conn:
+            return self._reserved(conn, None, now)
+
+    def _reserved(self, conn, product_ids, now):
+        sql = """
+            SELECT hi.product_id AS product_id, SUM(hi.quantity) AS quantity
+            FROM holds h JOIN hold_items hi ON hi.hold_id = h.id
+            WHERE h.reserved = 1 AND (h.expires_at IS NULL OR h.expires_at > ?)
+        """
+        params = [now]
+        if product_ids is not None:
+            ids = list(product_ids)
+            if not ids:
+                return {}
+            sql += f" AND hi.product_id IN ({', '.join('?' * len(ids))})"
+            params += ids
+        sql += " GROUP BY hi.product_id"
+        return {r['product_id']: int(r['quantity']) for r in self.all(conn, sql, tuple(params))}
+
+    # --- day close (Z reports) ---
+
+    def lock_sales_for_close(self, conn):
+        """Hold off sale inserts until the close commits (BEGIN IMMEDIATE already does on SQLite)."""
+
+    def close_day(self, day, actor=None):
+        """Freeze a past UTC day into z_reports / z_report_lines; returns the header.
+
+        The day's sales (id <= the current MAX(sales.id), the high-water
+        mark) are summed per cashier and payment method, with the number of
+        them refunded or voided so far according to audit_log. Sales that
+        reached already-closed days since the previous close (offline sync,
+        journal replay) are summed too, as lines with close_day = day and
+        their own day, so every sale up to the high-water mark is in exactly
+        one line. Raises ValueError for today or a future day and
+        IntegrityError for a day that is already closed.
+        """
+        day = datetime.date.fromisoformat(str(day)[:10]).isoformat()
+        next_day = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+        counts = """
+            COUNT(id) AS sales_count, SUM(subtotal) AS subtotal_sum, SUM(vat) AS vat_sum, SUM(total) AS total_sum,
+            COALESCE(SUM(refunds), 0) AS refund_count, COALESCE(SUM(voids), 0) AS void_count
+        """
+        reversals = """
+            (SELECT COUNT(*) FROM audit_log a WHERE a.sale_id = s.id AND a.action = 'refund') AS refunds,
+            (SELECT COUNT(*) FROM audit_log a WHERE a.sale_id = s.id AND a.action = 'void') AS voids
+        """
+        with self.connection() as conn:
+            try:
+                self.begin(conn)
+                self.lock_sales_for_close(conn)
+                if self.one(conn, f"SELECT {self.utc_today()} AS d")['d'] <= day:
+                    raise ValueError(f"{day} is still open; only past days can be closed")
+                if self.one(conn, "SELECT 1 AS x FROM z_reports WHERE day = ?", (day,)):
+                    raise IntegrityError(f"{day} is already closed")
+                high = self.one(conn, "SELECT COALESCE(MAX(id), 0) AS m FROM sales")['m']
+                previous = self.one(conn, "SELECT COALESCE(MAX(high_water_id), 0) AS m FROM z_reports")['m']
+                lines = self.all(conn, f"""
+                    SELECT cashier, payment_method, {counts}
+                    FROM (SELECT s.id, s.cashier, s.payment_method, s.subtotal, s.vat, s.total, {reversals}
+                          FROM sales s WHERE s.date >= ? AND s.date < ? AND s.id <= ?) t
+                    GROUP BY cashier, payment_method
+                """, (day, next_day, high))
+                for line in lines:
+                    line['day'] = day
+                late = []
+                if previous:
+                    late = self.all(conn, f"""
+                        SELECT day, cashier, payment_method, {counts}
+                        FROM (SELECT {self.day('s.date')} AS day, s.id, s.cashier, s.payment_method,
+                                     s.subtotal, s.vat, s.total, {reversals}
+                              FROM sales s WHERE s.id > ? AND s.id <= ?) t
+                        WHERE day IN (SELECT day FROM z_reports)
+                        GROUP BY day, cashier, payment_method
+                    """, (previous, high))
+                totals = {key: sum(line[key] or 0 for line in lines)
+                          for key in ('sales_count', 'subtotal_sum', 'vat_sum', 'total_sum', 'refund_count', 'void_count')}
+                self.execute(conn, """
+                    INSERT INTO z_reports (day, closed_by, high_water_id, previous_high_water_id, sales_count,
+                                           subtotal_sum, vat_sum, total_sum, refund_count, void_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (day, actor, high, previous, totals['sales_count'], totals['subtotal_sum'], totals['vat_sum'],
+                      totals['total_sum'], totals['refund_count'], totals['void_count']))
+                self._executemany(conn, """
+                    INSERT INTO z_report_lines (close_day, day, cashier, payment_method, sales_count, subtotal_sum,
+                                                vat_sum, total_sum, refund_count, void_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [(day, l['day'], l['cashier'], l['payment_method'], l['sales_count'], l['subtotal_sum'],
+                       l['vat_sum'], l['total_sum'], l['refund_count'], l['void_count']) for l in lines + late])
+                header = self.one(conn, "SELECT * FROM z_reports WHERE day = ?", (day,))
+                conn.commit()
+                header['late_lines'] = len(late)
+                return header
+            except Exception:
+                conn.rollback()
+                raise
+
+    def open_days(self, through):
+        """Days from the first sale through `through` that are not closed yet, oldest first."""
+        with self.read_connection() as conn:
+            first = self.one(conn, f"SELECT {self.day('MIN(date)')} AS d FROM sales")['d']
+            if not first:
+                return []
+            closed = {r['day'] for r in self.all(conn, "SELECT day FROM z_reports WHERE day >= ?", (first,))}
+        day, last = datetime.date.fromisoformat(first[:10]), datetime.date.fromisoformat(str(through)[:10])
+        out = []
+        while day <= last:
+            if day.isoformat() not in closed:
+                out.append(day.isoformat())
+            day += datetime.timedelta(days=1)
+        return out
+
+    def list_z_reports(self, start=None, end=None):
+        """Closed-day headers (newest first), each with its lines."""
+        where, params = "", ()
+        if start and end:
+            where, params = " WHERE day BETWEEN ? AND ?", (start, end)
+        with self.read_connection() as conn:
+            headers = self.all(conn, f"SELECT * FROM z_reports{where} ORDER BY day DESC", params)
+            where = where.replace('day', 'close_day')
+            lines = self.all(conn, f"""
+                SELECT close_day, day, cashier, payment_method, sales_count, subtotal_sum, vat_sum, total_sum,
+                       refund_count, void_count
+                FROM z_report_lines{where} ORDER BY close_day, day, cashier, payment_method
+            """, params)
+        by_day = {h['day']: h for h in headers}
+        for h in headers:
+            h['lines'] = []
+        for line in lines:
+            if line['close_day'] in by_day:
+                by_day[line['close_day']]['lines'].append(line)
+        return headers
+
+    def _report_source(self, conn, start=None, end=None):
+        """(sql, params) of sales per (day, cashier, payment_method) over start..end, or None.
+
+        Closed days come from z_report_lines; only the open days' sales, plus
+        any sale above the newest high-water mark, are read from sales, each
+        open stretch as a range on the date index. None when nothing is
+        closed yet (or the range is not plain dates): use the live query.
+        """
+        if start and end:
+            try:
+                start = datetime.date.fromisoformat(str(start)).isoformat()
+                end_next = (datetime.date.fromisoformat(str(end)) + datetime.timedelta(days=1)).isoformat()
+            except ValueError:
+                return None
+        else:
+            start = end = end_next = None
+        high = self.one(conn, "SELECT MAX(high_water_id) AS m FROM z_reports")['m']
+        if high is None:
+            return None
+        lines_where, lines_params = "", []
+        if start:
+            lines_where, lines_params = " WHERE day BETWEEN ? AND ?", [start, end]
+        closed = [r['day'] for r in self.all(conn, f"SELECT day FROM z_reports{lines_where} ORDER BY day", tuple(lines_params))]
+
+        # Open stretches [lo, hi) between closed days; None is unbounded.
+        ranges, lo = [], start
+        for day in closed:
+            if lo is None or lo < day:
+                ranges.append((lo, day))
+            lo = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+        if end_next is None or lo < end_next:
+            ranges.append((lo, end_next))
+        if len(ranges) > MAX_OPEN_RANGES:
+            return None
+        terms, live_params = [], []
+        for lo, hi in ranges:
+            bounds = []
+            if lo is not None:
+                bounds.append("date >= ?")
+                live_params.append(lo)
+            if hi is not None:
+                bounds.append("date < ?")
+                live_params.append(hi)
+            terms.append("(" + " AND ".join(bounds or ["1 = 1"]) + ")")
+        # Each term is a range on its own index (OR-by-union), so closed
+        # days' rows are never visited.
+        if start:
+            terms.append("(id > ? AND date >= ? AND date < ?)")
+            live_params += [high, start, end_next]
+        else:
+            terms.append("id > ?")
+            live_params.append(high)
+        live_where = " OR ".join(terms)
+        sql = f"""
+            SELECT day, cashier, payment_method, sales_count, subtotal_sum, vat_sum, total_sum
+            FROM z_report_lines{lines_where}
+            UNION ALL
+            SELECT {self.day('date')} AS day, cashier, payment_method, COUNT(id) AS sales_count,
+                   SUM(subtotal) AS subtotal_sum, SUM(vat) AS vat_sum, SUM(total) AS total_sum
+            FROM sales
+            WHERE {live_where}
+            GROUP BY {self.day('date')}, cashier, payment_method
+        """
+        return sql, tuple(lines_params + live_params)
+
+    # --- reports ---
+
+    def daily_sales_summary(self):
+        with self.read_connection() as conn:
+            source = self._report_source(conn)
+            if source is not None:
+                return list(self.stream(conn, f"""
+                    SELECT day AS sale_date,
+                           CAST(SUM(sales_count) AS INTEGER) AS total_sales,
+                           SUM(subtotal_sum) AS subtotal_sum,
+                           SUM(vat_sum) AS vat_sum,
+                           SUM(total_sum) AS total_revenue
+                    FROM ({source[0]}) t
+                    GROUP BY day
+                    ORDER BY sale_date DESC
+                """, source[1]))
+            return list(self.stream(conn, f"""
+                SELECT {self.day('date')} as sale_date,
+                       COUNT(id) as total_sales,
+                       SUM(subtotal) as subtotal_sum,
+                       SUM(vat) as vat_sum,
+                       SUM(total) as total_revenue
+                FROM sales
+                GROUP BY {self.day('date')}
+                ORDER BY sale_date DESC
+            """))
+
+    def report_daily(self, start=None, end=None):
+        with self.read_connection() as conn:
+            source = self._report_source(conn, start, end)
+            if source is not None:
+                return list(self.stream(conn, f"""
+                    SELECT day AS sale_date,
+                           CAST(SUM(sales_count) AS INTEGER) AS total_sales,
+                           SUM(subtotal_sum) AS subtotal_sum,
+                           SUM(vat_sum) AS vat_sum,
+                           SUM(total_sum) AS total_sum
+                    FROM ({source[0]}) t
+                    GROUP BY day
+                    ORDER BY sale_date DESC
+                """, source[1]))
+            base = f"""
+                SELECT {self.day('date')} as sale_date,
+                       COUNT(id) as total_sales,
+                       SUM(subtotal) as subtotal_sum,
+                       SUM(vat) as vat_sum,
+                       SUM(total) as total_sum
+                FROM sales
+            """
+            params = ()
+            if start and end:
+                base += f" WHERE {self.day('date')} BETWEEN ? AND ?"
+                params = (start, end)
+            base += f" GROUP BY {self.day('date')} ORDER BY sale_date DESC"
+            return list(self.stream(conn, base, params))
+
+    def report_by_cashier(self, start=None, end=None):
+        with self.read_connection() as conn:
+            source = self._report_source(conn, start, end)
+            if source is not None:
+                return list(self.stream(conn, f"""
+                    SELECT cashier,
+                           CAST(SUM(sales_count) AS INTEGER) AS total_sales,
+                           SUM(subtotal_sum) AS subtotal_sum,
+                           SUM(vat_sum) AS vat_sum,
+                           SUM(total_sum) AS total_sum
+                    FROM ({source[0]}) t
+                    GROUP BY cashier
+                    ORDER BY cashier
+                """, source[1]))
+            base = """
+                SELECT cashier,
+                       COUNT(id) as total_sales,
+                       SUM(subtotal) as subtotal_sum,
+                       SUM(vat) as vat_sum,
+                       SUM(total) as total_sum
+                FROM sales
+            """
+            params = ()
+            if start and end:
+                base += f" WHERE {self.day('date')} BETWEEN ? AND ?"
+                params = (start, end)
+            base += " GROUP BY cashier ORDER BY cashier"
+            return list(self.stream(conn, base, params))
+
+    def report_items(self, period, start=None, end=None):
+        with self.read_connection() as conn:
+            label = self.period_label(period, 's.date')
+            base = f"""
+                SELECT {label} AS period_label,
+                       COALESCE(p.name, 'Unknown') AS item_name,
+                       SUM(si.quantity) AS units_sold,
+                       SUM(si.quantity * si.price) AS revenue
+                FROM sale_items si
+                JOIN sales s ON si.sale_id = s.id
+                LEFT JOIN products p ON si.product_id = p.id
+            """
+            params = []
+            where = []
+            if start and end:
+                where.append(f"{self.day('s.date')} BETWEEN ? AND ?")
+                params.extend([start, end])
+            else:
+                where.append(self.current_period_filter(period, 's.date'))
+            if where:
+                base += " WHERE " + " AND ".join(where)
+            base += " GROUP BY period_label, item_name ORDER BY period_label DESC, units_sold DESC"
+            return list(self.stream(conn, base, tuple(params)))
+
+    def report_payment_methods(self, period, start=None, end=None):
+        with self.read_connection() as conn:
+            source = self._report_source(conn, start, end)
+            if source is not None:
+                return list(self.stream(conn, f"""
+                    SELECT {self.period_label(period, 'day')} AS period_label,
+                           payment_method,
+                           CAST(SUM(sales_count) AS INTEGER) AS total_sales,
+                           SUM(subtotal_sum) AS subtotal_sum,
+                           SUM(vat_sum) AS vat_sum,
+                           SUM(total_sum) AS total_sum
+                    FROM ({source[0]}) t
+                    GROUP BY period_label, payment_method
+                    ORDER BY period_label DESC, payment_method
+                """, source[1]))
+            label = self.period_label(period, 'date')
+            base = f"""
+                SELECT {label} as period_label,
+                       payment_method,
+                       COUNT(id) as total_sales,
+                       SUM(subtotal) as subtotal_sum,
+                       SUM(vat) as vat_sum,
+                       SUM(total) as total_sum
+                FROM sales
+            """
+            params = ()
+            if start and end:
+                base += f" WHERE {self.day('date')} BETWEEN ? AND ?"
+                params = (start, end)
+            base += " GROUP BY period_label, payment_method ORDER BY period_label DESC, payment_method"
+            return list(self.stream(conn, base, params))
+
+
+class PostgresRepository(SQLiteRepository):
+    engine = 'postgres'
+    for_update = ' FOR UPDATE'
+
+    def __init__(self, dsn, minconn=1, maxconn=10, read_dsn=None):
+        try:
+            import psycopg2
+            import psycopg2.extras
+            import psycopg2.pool
+        except ImportError as e:
+            raise RuntimeError("DATABASE_URL points at PostgreSQL but psycopg2 is not installed") from e
+        self._pg = psycopg2
+        self._dict_cursor = psycopg2.extras.RealDictCursor
+        self._pinned = threading.local()
+        self._pool_args = (minconn, maxconn, dsn, read_dsn)
+        self._open_pools()
+
+    def _open_pools(self):
+        minconn, maxconn, dsn, read_dsn = self._pool_args
+        self.pool = self._pg.pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        # Optional streaming replica for reports and exports.
+        self.read_pool = self._pg.pool.ThreadedConnectionPool(minconn, maxconn, read_dsn) if read_dsn else None
+
+    def after_fork(self):
+        """Open this worker's own pools.
+
+        The inherited connections share sockets with the parent. They are
+        dropped without closing, because closing would end the parent's
+        sessions too.
+        """
+        self._open_pools()
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self._pooled(self.pool, getattr(self._pinned, 'conn', None)) as conn:
+            yield conn
+
+    @contextlib.contextmanager
+    def read_connection(self):
+        with self._pooled(self.read_pool or self.pool) as conn:
+            yield conn
+
+    @contextlib.contextmanager
+    def _pooled(self, pool, pinned=None):
+        conn = pinned or pool.getconn()
+        try:
+            yield conn
+        except self._pg.IntegrityError as e:
+            conn.rollback()
+            raise IntegrityError(str(e)) from e
+        finally:
+            # End any read transaction left open before returning to the pool.
+            if not conn.closed:
+                conn.rollback()
+            if pinned is None:
+                pool.putconn(conn)
+
+    def close(self):
+        self.pool.closeall()
+        if self.read_pool is not None:
+            self.read_pool.closeall()
+
+    @staticmethod
+    def _sql(sql):
+        return sql.replace('%', '%%').replace('?', '%s')
+
+    def execute(self, conn, sql, params=()):
+        cur = conn.cursor(cursor_factory=self._dict_cursor)
+        cur.execute(self._sql(sql), params)
+        return cur
+
+    def begin(self, conn):
+        # psycopg2 opens a transaction implicitly on the first statement.
+        pass
+
+    def lock_sales_for_close(self, conn):
+        # Self-conflicting and blocks inserts: the high-water mark covers
+        # every committed sale, and two closes never interleave.
+        self.execute(conn, "LOCK TABLE sales IN SHARE ROW EXCLUSIVE MODE")
+
+    def _executemany(self, conn, sql, rows):
+        from psycopg2.extras import execute_batch
+        execute_batch(conn.cursor(), self._sql(sql), rows, page_size=500)
+
+    def insert(self, conn, sql, params=()):
+        return self.execute(conn, sql.rstrip().rstrip(';') + " RETURNING id", params).fetchone()['id']
+
+    def stream(self, conn, sql, params=()):
+        # Named cursor: rows are fetched from the server in batches instead
+        # of materialising the whole result client-side.
+        cur = conn.cursor(name=f"pos_{uuid.uuid4().hex}", cursor_factory=self._dict_cursor)
+        cur.itersize = STREAM_BATCH_SIZE
+        try:
+            cur.execute(self._sql(sql), params)
+            for r in cur:
+                yield dict(r)
+        finally:
+            cur.close()
+
+    def stream_batches(self, conn, sql, params=(), batch_size=STREAM_BATCH_SIZE):
+        cur = conn.cursor(name=f"pos_{uuid.uuid4().hex}")
+        try:
+            cur.execute(self._sql(sql), params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+    def period_label(self, period, col):
+        if period == 'daily':
+            return f"substr({col}, 1, 10)"
+        if period == 'weekly':
+            # Same as SQLite's %W: Monday-based week of year, 00-53.
+            ts = f"({col})::timestamp"
+            return (f"to_char({ts}, 'YYYY') || '-W' || "
+                    f"lpad(((extract(doy from {ts})::int + 7 - extract(isodow from {ts})::int) / 7)::text, 2, '0')")
+        if period == 'monthly':
+            return f"substr({col}, 1, 7)"
+        return f"substr({col}, 1, 4)"
+
+    def day(self, col):
+        return f"substr({col}, 1, 10)"
+
+    def day_number(self, col):
+        return f"(substr({col}, 1, 10)::date - DATE '1970-01-01')"
+
+    def current_period_filter(self, period, col):
+        if period == 'daily':
+            return f"substr({col}, 1, 10) = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')"
+        if period == 'weekly':
+            return f"substr({col}, 1, 10) >= to_char(LOCALTIMESTAMP - interval '6 days', 'YYYY-MM-DD')"
+        return f"substr({col}, 1, 7) = to_char(LOCALTIMESTAMP, 'YYYY-MM')"
+
+    def utc_today(self):
+        return "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD')"
+
+    def like(self):
+        return "ILIKE"
+
+    def has_legacy_items_column(self, conn):
+        return False
+
+    def ensure_schema(self):
+        """Create tables and seed data (idempotent)."""
+        with self.connection() as conn:
+            for stmt in PG_SCHEMA:
+                self.execute(conn, stmt)
+            if self.one(conn, "SELECT count(*) as count FROM products")['count'] == 0:
+                for row in SEED_PRODUCTS:
+                    self.execute(conn, "INSERT INTO products (name, price, stock, category, barcode, low_stock_threshold) VALUES (?, ?, ?, ?, ?, 5)", row)
+            if self.one(conn, "SELECT COUNT(*) as c FROM banks")['c'] == 0:
+                for name in SEED_BANKS:
+                    self.execute(conn, "INSERT INTO banks (name) VALUES (?)", (name,))
+            if self.one(conn, "SELECT COUNT(*) as c FROM categories")['c'] == 0:
+                for name in SEED_CATEGORIES:
+                    self.execute(conn, "INSERT INTO categories (name) VALUES (?)", (name,))
+            conn.commit()
+            missing = [u for u in DEFAULT_USERS
+                       if not self.one(conn, "SELECT 1 as x FROM users WHERE username = ?", (u[0],))]
+        if missing:
+            from werkzeug.security import generate_password_hash
+            with self.connection() as conn:
+                for username, password, role in missing:
+                    self.execute(conn, "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?) ON CONFLICT (username) DO NOTHING",
+                                 (username, generate_password_hash(password), role))
+                conn.commit()
+
+
+# Dates are kept as 'YYYY-MM-DD HH:MM:SS' UTC text, like SQLite's
+# CURRENT_TIMESTAMP, so stored values and report labels match across engines.
+PG_NOW_TEXT = "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+PG_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS products (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        parent_id INTEGER,
+        price DOUBLE PRECISION NOT NULL,
+        stock INTEGER NOT NULL,
+        category TEXT,
+        barcode TEXT,
+        low_stock_threshold INTEGER,
+        image_url TEXT,
+        min_price DOUBLE PRECISION
+    )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode) WHERE barcode IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_products_parent ON products(parent_id)",
+    """CREATE TABLE IF NOT EXISTS table_revisions (
+        name TEXT PRIMARY KEY,
+        revision BIGINT NOT NULL DEFAULT 0
+    )""",
+    "INSERT INTO table_revisions (name, revision) VALUES ('products', 1) ON CONFLICT (name) DO NOTHING",
+    """CREATE OR REPLACE FUNCTION bump_table_revision() RETURNS trigger AS $$
+    BEGIN
+        UPDATE table_revisions SET revision = revision + 1 WHERE name = COALESCE(TG_ARGV[0], TG_TABLE_NAME);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    """DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'products_revision') THEN
+            CREATE TRIGGER products_revision AFTER INSERT OR UPDATE OR DELETE ON products
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_table_revision();
+        END IF;
+    END $$""",
+    f"""CREATE TABLE IF NOT EXISTS sales (
+        id SERIAL PRIMARY KEY,
+        total DOUBLE PRECISION NOT NULL,
+        subtotal DOUBLE PRECISION,
+        vat DOUBLE PRECISION,
+        cashier TEXT,
+        payment_method TEXT,
+        payment_reference TEXT,
+        date TEXT DEFAULT {PG_NOW_TEXT},
+        status TEXT DEFAULT 'completed'
+    )""",
+    """CREATE TABLE IF NOT EXISTS sale_items (
+        sale_id INTEGER REFERENCES sales(id),
+        product_id INTEGER REFERENCES products(id),
+        quantity INTEGER NOT NULL,
+        price DOUBLE PRECISION NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)",
+    """CREATE TABLE IF NOT EXISTS sales_buckets (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        cashier TEXT NOT NULL DEFAULT '',
+        payment_method TEXT NOT NULL DEFAULT '',
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        sales_total DOUBLE PRECISION NOT NULL DEFAULT 0,
+        refund_count INTEGER NOT NULL DEFAULT 0,
+        refund_total DOUBLE PRECISION NOT NULL DEFAULT 0,
+        void_count INTEGER NOT NULL DEFAULT 0,
+        void_total DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, cashier, payment_method)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS sale_sync_keys (
+        client_key TEXT PRIMARY KEY,
+        sale_id INTEGER NOT NULL,
+        cashier TEXT,
+        synced_at TEXT DEFAULT {PG_NOW_TEXT}
+    )""",
+    """CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        status_code INTEGER,
+        response TEXT,
+        expires_at BIGINT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)",
+    f"""CREATE TABLE IF NOT EXISTS audit_log (
+        id SERIAL PRIMARY KEY,
+        sale_id INTEGER,
+        action TEXT,
+        reason TEXT,
+        actor TEXT,
+        date TEXT DEFAULT {PG_NOW_TEXT}
+    )""",
+    "ALTER TABLE audit_log ADD COLUMN IF NOT EXISTS product_id INTEGER",
+    "ALTER TABLE audit_log ADD COLUMN IF NOT EXISTS details TEXT",
+    "CREATE INDEX IF NOT EXISTS idx_audit_sale ON audit_log(sale_id)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_actor_date ON audit_log(actor, date)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_date ON audit_log(date)",
+    f"""CREATE TABLE IF NOT EXISTS audit_archives (
+        name TEXT PRIMARY KEY,
+        month TEXT NOT NULL,
+        first_id INTEGER,
+        last_id INTEGER,
+        rows INTEGER NOT NULL,
+        archived_at TEXT DEFAULT {PG_NOW_TEXT}
+    )""",
+    """CREATE TABLE IF NOT EXISTS banks (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS holds (
+        id SERIAL PRIMARY KEY,
+        date TEXT DEFAULT {PG_NOW_TEXT},
+        cashier TEXT,
+        note TEXT,
+        payment_method TEXT,
+        payment_reference TEXT,
+        subtotal DOUBLE PRECISION,
+        vat DOUBLE PRECISION,
+        total DOUBLE PRECISION,
+        reserved INTEGER NOT NULL DEFAULT 0,
+        expires_at BIGINT
+    )""",
+    """CREATE TABLE IF NOT EXISTS hold_items (
+        hold_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        product_id INTEGER,
+        name TEXT,
+        quantity INTEGER NOT NULL,
+        price DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (hold_id, position)
+    )""",
+    # Upgrade holds created with the JSON items blob: move the lines into
+    # hold_items, then drop the column. Their expires_at stays NULL (never).
+    "ALTER TABLE holds ADD COLUMN IF NOT EXISTS reserved INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE holds ADD COLUMN IF NOT EXISTS expires_at BIGINT",
+    """DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'holds' AND column_name = 'items') THEN
+            INSERT INTO hold_items (hold_id, position, product_id, name, quantity, price)
+            SELECT h.id, (e.ord - 1)::int, (e.item->>'productId')::int, e.item->>'name',
+                   COALESCE((e.item->>'quantity')::numeric, 0)::int, COALESCE((e.item->>'price')::float8, 0)
+            FROM holds h, jsonb_array_elements(CASE WHEN jsonb_typeof(h.items::jsonb) = 'array' THEN h.items::jsonb
+                                                    ELSE '[]'::jsonb END) WITH ORDINALITY AS e(item, ord)
+            ON CONFLICT DO NOTHING;
+            ALTER TABLE holds DROP COLUMN items;
+        END IF;
+    END $$""",
+    "CREATE INDEX IF NOT EXISTS idx_holds_cashier_date ON holds(cashier, date)",
+    "CREATE INDEX IF NOT EXISTS idx_holds_expires ON holds(expires_at)",
+    # Revision counters for cross-process cache coherence (see coherence.py).
+    """INSERT INTO table_revisions (name, revision)
+       VALUES ('sales', 1), ('sales_history', 1), ('users', 1) ON CONFLICT (name) DO NOTHING""",
+    """DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'sales_revision') THEN
+            CREATE TRIGGER sales_revision AFTER INSERT OR UPDATE OR DELETE ON sales
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_table_revision();
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'users_revision') THEN
+            CREATE TRIGGER users_revision AFTER INSERT OR UPDATE OR DELETE ON users
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_table_revision();
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'sales_history_revision_insert') THEN
+            CREATE TRIGGER sales_history_revision_insert AFTER INSERT ON sales FOR EACH ROW
+                WHEN (substr(NEW.date, 1, 10) < to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD'))
+                EXECUTE FUNCTION bump_table_revision('sales_history');
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'sales_history_revision_delete') THEN
+            CREATE TRIGGER sales_history_revision_delete AFTER DELETE ON sales FOR EACH ROW
+                WHEN (substr(OLD.date, 1, 10) < to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD'))
+                EXECUTE FUNCTION bump_table_revision('sales_history');
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'sales_history_revision_update') THEN
+            CREATE TRIGGER sales_history_revision_update AFTER UPDATE OF status ON sales FOR EACH ROW
+                WHEN (OLD.status IS DISTINCT FROM NEW.status
+                      AND substr(NEW.date, 1, 10) < to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD'))
+                EXECUTE FUNCTION bump_table_revision('sales_history');
+        END IF;
+    END $$""",
+    "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(date)",
+    f"""CREATE TABLE IF NOT EXISTS z_reports (
+        day TEXT PRIMARY KEY,
+        closed_at TEXT DEFAULT {PG_NOW_TEXT},
+        closed_by TEXT,
+        high_water_id INTEGER NOT NULL,
+        previous_high_water_id INTEGER NOT NULL,
+        sales_count INTEGER NOT NULL,
+        subtotal_sum DOUBLE PRECISION,
+        vat_sum DOUBLE PRECISION,
+        total_sum DOUBLE PRECISION,
+        refund_count INTEGER NOT NULL,
+        void_count INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS z_report_lines (
+        close_day TEXT NOT NULL,
+        day TEXT NOT NULL,
+        cashier TEXT,
+        payment_method TEXT,
+        sales_count INTEGER NOT NULL,
+        subtotal_sum DOUBLE PRECISION,
+        vat_sum DOUBLE PRECISION,
+        total_sum DOUBLE PRECISION,
+        refund_count INTEGER NOT NULL,
+        void_count INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_z_report_lines_day ON z_report_lines(day)",
+    "CREATE INDEX IF NOT EXISTS idx_z_report_lines_close_day ON z_report_lines(close_day)",
+    """CREATE OR REPLACE FUNCTION reject_closed_day_change() RETURNS trigger AS $$
+    BEGIN
+        RAISE EXCEPTION 'closed days are immutable';
+    END
+    $$ LANGUAGE plpgsql""",
+    """DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'z_reports_immutable') THEN
+            CREATE TRIGGER z_reports_immutable BEFORE UPDATE OR DELETE ON z_reports
+                FOR EACH ROW EXECUTE FUNCTION reject_closed_day_change();
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'z_report_lines_immutable') THEN
+            CREATE TRIGGER z_report_lines_immutable BEFORE UPDATE OR DELETE ON z_report_lines
+                FOR EACH ROW EXECUTE FUNCTION reject_closed_day_change();
+        END IF;
+    END $$""",
+]
+
+SEED_PRODUCTS = [
+    ('Samsung 43" Smart TV', 35000, 10, 'Electronics', '890100000001'),
+    ('Blender 500W', 4500, 20, 'Kitchenware', '890100000002'),
+    ('Double Bedsheet Set', 2500, 30, 'Beddings', '890100000003'),
+    ('Non-stick Cookware Set', 8000, 15, 'Kitchenware', '890100000004'),
+    ('Bluetooth Speaker', 3000, 25, 'Electronics', '890100000005'),
+    ('Electric Kettle', 1500, 40, 'Kitchenware', '890100000006'),
+    ('King Size Duvet', 5000, 12, 'Beddings', '890100000007'),
+    ('Iron Box', 1200, 50, 'Electronics', '890100000008'),
+]
+SEED_BANKS = ['KCB Bank', 'Co-op Bank', 'Equity Bank']
+SEED_CATEGORIES = ['Home Appliances', 'Electronics', 'Beddings', 'Household Items']
+DEFAULT_USERS = [
+    ('superadmin', 'super123', 'super_admin'),
+    ('admin', 'admin123', 'admin'),
+    ('cashier', 'cashier123', 'cashier'),
+]
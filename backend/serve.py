@@ -0,0 +1,49 @@
+"""Production entry point: gunicorn on Linux/macOS, waitress on Windows.
+
+    python backend/serve.py
+
+On Linux and macOS this runs gunicorn with gunicorn.conf.py. Windows has
+no fork, so gunicorn does not run there. Instead waitress serves the app
+from one process with POS_THREADS threads (default 8); migrations then
+run once at import. If neither server is installed it falls back to
+Flask's development server with a warning.
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    os.chdir(BASE_DIR)
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    host = os.environ.get('POS_BIND_HOST', '0.0.0.0')
+    port = int(os.environ.get('POS_PORT', '5000'))
+
+    if os.name != 'nt':
+        try:
+            from gunicorn.app.wsgiapp import run
+        except ImportError:
+            pass
+        else:
+            sys.argv = ['gunicorn', '--config', os.path.join(BASE_DIR, 'gunicorn.conf.py'), 'app:app']
+            return run()
+
+    try:
+        import waitress
+    except ImportError:
+        waitress = None
+    from app import app
+    if waitress is None:
+        print("Warning: neither gunicorn nor waitress is installed; using Flask's development server")
+        app.run(host=host, port=port)
+        return
+    waitress.serve(app, host=host, port=port,
+                   threads=int(os.environ.get('POS_THREADS', '8')),
+                   channel_timeout=int(os.environ.get('POS_KEEPALIVE_SECONDS', '15')),
+                   connection_limit=int(os.environ.get('POS_CONNECTION_LIMIT', '200')))
+
+
+if __name__ == '__main__':
+    main()
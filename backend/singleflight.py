@@ -0,0 +1,85 @@
+"""Single-flight coalescing of identical concurrent computations.
+
+When the store opens, every till asks for the product list at once, and
+the report dashboards refresh together. Without coalescing, each of
+those N identical requests runs the same full query and serialisation.
+SingleFlight.do(key, fn) lets the first caller for a key (the leader)
+run fn. Callers arriving with the same key while it is running (the
+followers) wait and get the leader's result. Nothing is kept afterwards.
+The next caller after the flight lands starts a fresh one, so this is
+not a cache and never serves anything older than the requests it
+joined.
+
+A leader's exception is raised in its followers too. A follower that
+waits longer than timeout stops waiting and runs fn itself, so a hung
+leader cannot block everyone behind it.
+
+Counters are kept in total and per name (the endpoint, in app.py):
+leaders (computations run), coalesced (callers served by someone else's
+computation) and the largest number of waiters seen on a single flight.
+"""
+import threading
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, timeout=30.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.stats = {'leaders': 0, 'coalesced': 0, 'errors': 0, 'timeouts': 0, 'max_waiters': 0}
+        self._by_name = {}
+
+    def do(self, key, fn, name=None):
+        """(fn() or the in-flight result for key, True if it was shared)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.stats['max_waiters'] = max(self.stats['max_waiters'], flight.waiters)
+            self._count(name, 'leaders' if leader else 'coalesced')
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                return fn(), False
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+        try:
+            flight.value = fn()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+        finally:
+            # Unregister before waking the followers, so a request arriving
+            # after the result is ready starts a new flight.
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value, False
+
+    def _count(self, name, field):
+        self.stats[field] += 1
+        if name is not None:
+            counters = self._by_name.setdefault(name, {'leaders': 0, 'coalesced': 0})
+            counters[field] += 1
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._flights),
+                        endpoints={name: dict(c) for name, c in sorted(self._by_name.items())})
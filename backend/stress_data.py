@@ -0,0 +1,318 @@
+"""Synthetic data generator for large-history stress databases.
+
+Builds a pos.db-compatible database (same schema as init_db) filled with
+years of realistic trading history so reports, exports and checkout can be
+exercised at scale:
+
+    python backend/stress_data.py --db /tmp/stress.db --days 730 --sales-per-day 2000
+
+Distributions:
+- products follow a Zipf-like popularity curve; a share of them are parents
+  with size/colour variants linked through parent_id
+- sales follow an hourly curve with lunch and evening peaks, a weekday
+  factor and a December uplift
+- basket sizes are skewed towards one or two lines
+- a configurable share of sales is refunded or voided, with matching
+  audit_log rows
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# Relative weight of each trading hour (store opens 08:00, closes 21:00).
+HOURLY_WEIGHTS = {
+    8: 3, 9: 5, 10: 7, 11: 9, 12: 14, 13: 13, 14: 8,
+    15: 7, 16: 9, 17: 13, 18: 15, 19: 11, 20: 6,
+}
+# Monday=0 ... Sunday=6
+WEEKDAY_FACTORS = [0.85, 0.8, 0.85, 0.9, 1.1, 1.35, 1.15]
+# Basket size (number of distinct lines) and its weight.
+BASKET_WEIGHTS = [(1, 46), (2, 24), (3, 13), (4, 7), (5, 4), (6, 3), (8, 2), (12, 1)]
+QUANTITY_WEIGHTS = [(1, 80), (2, 13), (3, 4), (5, 2), (10, 1)]
+PAYMENT_WEIGHTS = [
+    ('cash', 45), ('mpesa', 40), ('card', 8), ('bank', 5), ('cheque', 1), ('credit', 1),
+]
+CATEGORIES = ['Home Appliances', 'Electronics', 'Beddings', 'Household Items', 'Kitchenware']
+NOUNS = {
+    'Home Appliances': ['Blender', 'Microwave', 'Fridge', 'Cooker', 'Water Dispenser', 'Toaster'],
+    'Electronics': ['Smart TV', 'Speaker', 'Radio', 'Iron Box', 'Extension Cable', 'Woofer'],
+    'Beddings': ['Duvet', 'Bedsheet Set', 'Pillow', 'Blanket', 'Mattress Protector', 'Towel'],
+    'Household Items': ['Bucket', 'Mop', 'Basin', 'Laundry Basket', 'Storage Box', 'Broom'],
+    'Kitchenware': ['Cookware Set', 'Kettle', 'Flask', 'Cutlery Set', 'Dinner Set', 'Frying Pan'],
+}
+BRANDS = ['Ramtons', 'Hotpoint', 'Samsung', 'Sayona', 'Von', 'Nunix', 'Mika', 'Roch', 'Armco', 'Bruhm']
+SIZES = ['S', 'M', 'L', 'XL', '4x6', '5x6', '6x6']
+COLOURS = ['White', 'Black', 'Grey', 'Blue', 'Red', 'Cream']
+REFUND_REASONS = ['Customer returned', 'Faulty item', 'Wrong size', 'Duplicate charge']
+VOID_REASONS = ['Mistake', 'Wrong item scanned', 'Customer cancelled']
+
+# Pragmas for bulk loading. The database is not crash-safe while these are
+# active; load_pragmas_off() restores normal settings once loading is done.
+LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA locking_mode = EXCLUSIVE",
+]
+
+
+def _cum(weighted):
+    values = [v for v, _ in weighted]
+    cum = list(itertools.accumulate(w for _, w in weighted))
+    return values, cum
+
+
+def _pick(rng, values, cum):
+    return values[bisect.bisect_right(cum, rng.random() * cum[-1])]
+
+
+def load_pragmas_on(conn):
+    for p in LOAD_PRAGMAS:
+        conn.execute(p)
+
+
+def load_pragmas_off(conn):
+    conn.execute("PRAGMA locking_mode = NORMAL")
+    conn.execute("PRAGMA synchronous = FULL")
+    conn.execute("PRAGMA journal_mode = DELETE")
+
+
+def ensure_schema(conn):
+    """Create the application schema on conn using the app's own bootstrap."""
+    from app import init_db
+    init_db(conn)
+
+
+def generate_products(conn, rng, count, variant_ratio):
+    """Insert count sellable products; returns [(id, price)] of sellable SKUs.
+
+    A parent with variants is not itself sold, its children are.
+    """
+    cur = conn.cursor()
+    start_code = 890200000000 + (cur.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0] * 100)
+    code = itertools.count(start_code)
+    sellable = []
+    made = 0
+    while made < count:
+        category = rng.choice(CATEGORIES)
+        name = f"{rng.choice(BRANDS)} {rng.choice(NOUNS[category])} {rng.randint(100, 9999)}"
+        price = round(rng.lognormvariate(7.6, 0.9), -1) or 50.0
+        min_price = round(price * 0.85, 2) if rng.random() < 0.4 else None
+        if rng.random() < variant_ratio:
+            cur.execute(
+                "INSERT INTO products (name, price, stock, category, barcode, low_stock_threshold, min_price) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, price, 0, category, str(next(code)), 5, min_price)
+            )
+            parent_id = cur.lastrowid
+            sizes = rng.sample(SIZES, rng.randint(2, 4))
+            colours = rng.sample(COLOURS, rng.randint(1, 3))
+            for size, colour in itertools.product(sizes, colours):
+                if made >= count:
+                    break
+                v_price = round(price * rng.uniform(0.9, 1.3), -1) or price
+                cur.execute(
+                    "INSERT INTO products (name, parent_id, price, stock, category, barcode, low_stock_threshold, min_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (f"{name} ({size} {colour})", parent_id, v_price, rng.randint(0, 200), category,
+                     str(next(code)), 5, min_price)
+                )
+                sellable.append((cur.lastrowid, v_price))
+                made += 1
+        else:
+            cur.execute(
+                "INSERT INTO products (name, price, stock, category, barcode, low_stock_threshold, min_price) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, price, rng.randint(0, 500), category, str(next(code)), 5, min_price)
+            )
+            sellable.append((cur.lastrowid, price))
+            made += 1
+    return sellable
+
+
+def ensure_cashiers(conn, count):
+    """Create count cashier accounts (password 'cashier123'), hashing once."""
+    from werkzeug.security import generate_password_hash
+    pw = generate_password_hash('cashier123')
+    names = [f"cashier{i:02d}" for i in range(1, count + 1)]
+    conn.executemany("INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?, ?, 'cashier')",
+                     [(n, pw) for n in names])
+    return names
+
+
+def _sale_times(rng, day, sales_per_day, hour_values, hour_cum):
+    factor = WEEKDAY_FACTORS[day.weekday()] * (1.4 if day.month == 12 else 1.0)
+    n = max(0, int(rng.gauss(sales_per_day * factor, sales_per_day * factor * 0.08)))
+    times = []
+    for _ in range(n):
+        hour = _pick(rng, hour_values, hour_cum)
+        times.append(datetime.datetime(day.year, day.month, day.day, hour,
+                                       rng.randrange(60), rng.randrange(60)))
+    times.sort()
+    return times
+
+
+def generate_history(conn, rng, sellable, cashiers, days, sales_per_day,
+                     refund_rate, void_rate, holds, batch_size, end_date=None, log=print):
+    """Insert days of sales ending at end_date (default today) plus holds."""
+    cur = conn.cursor()
+    has_items_col = 'items' in [r[1] for r in cur.execute("PRAGMA table_info(sales)").fetchall()]
+    next_sale_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0] + 1
+
+    # Zipf-like popularity: weight 1/rank over a shuffled SKU list.
+    skus = list(sellable)
+    rng.shuffle(skus)
+    sku_cum = list(itertools.accumulate(1.0 / (i + 1) ** 0.9 for i in range(len(skus))))
+    hour_values, hour_cum = _cum(sorted(HOURLY_WEIGHTS.items()))
+    basket_values, basket_cum = _cum(BASKET_WEIGHTS)
+    qty_values, qty_cum = _cum(QUANTITY_WEIGHTS)
+    pay_values, pay_cum = _cum(PAYMENT_WEIGHTS)
+
+    if has_items_col:
+        sale_sql = ("INSERT INTO sales (id, total, subtotal, vat, cashier, payment_method, payment_reference, date, status, items) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    else:
+        sale_sql = ("INSERT INTO sales (id, total, subtotal, vat, cashier, payment_method, payment_reference, date, status) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    item_sql = "INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)"
+    audit_sql = "INSERT INTO audit_log (sale_id, action, reason, actor, date) VALUES (?, ?, ?, ?, ?)"
+
+    end_date = end_date or datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=days - 1)
+    sales_rows, item_rows, audit_rows = [], [], []
+    totals = {'sales': 0, 'sale_items': 0, 'audit_log': 0, 'holds': 0}
+    started = time.perf_counter()
+
+    def flush():
+        cur.executemany(sale_sql, sales_rows)
+        cur.executemany(item_sql, item_rows)
+        cur.executemany(audit_sql, audit_rows)
+        totals['sales'] += len(sales_rows)
+        totals['sale_items'] += len(item_rows)
+        totals['audit_log'] += len(audit_rows)
+        sales_rows.clear()
+        item_rows.clear()
+        audit_rows.clear()
+
+    for offset in range(days):
+        day = start_date + datetime.timedelta(days=offset)
+        on_shift = rng.sample(cashiers, min(len(cashiers), rng.randint(3, 6)))
+        for ts in _sale_times(rng, day, sales_per_day, hour_values, hour_cum):
+            sale_id = next_sale_id
+            next_sale_id += 1
+            lines = {}
+            for _ in range(_pick(rng, basket_values, basket_cum)):
+                pid, price = skus[bisect.bisect_right(sku_cum, rng.random() * sku_cum[-1])]
+                q, _ = lines.get(pid, (0, price))
+                lines[pid] = (q + _pick(rng, qty_values, qty_cum), price)
+            subtotal = sum(q * p for q, p in lines.values())
+            vat = round(subtotal * 0.16)
+            method = _pick(rng, pay_values, pay_cum)
+            reference = None if method == 'cash' else f"{method[:2].upper()}{rng.randrange(10**8):08d}"
+            status = 'completed'
+            roll = rng.random()
+            date_str = ts.strftime('%Y-%m-%d %H:%M:%S')
+            cashier = rng.choice(on_shift)
+            if roll < void_rate:
+                status = 'voided'
+                audit_date = ts + datetime.timedelta(minutes=rng.randint(1, 30))
+                audit_rows.append((sale_id, 'void', rng.choice(VOID_REASONS), 'admin',
+                                   audit_date.strftime('%Y-%m-%d %H:%M:%S')))
+            elif roll < void_rate + refund_rate:
+                status = 'refunded'
+                audit_date = ts + datetime.timedelta(days=rng.randint(0, 14), minutes=rng.randint(5, 600))
+                audit_rows.append((sale_id, 'refund', rng.choice(REFUND_REASONS), 'admin',
+                                   audit_date.strftime('%Y-%m-%d %H:%M:%S')))
+            row = (sale_id, subtotal + vat, subtotal, vat, cashier, method, reference, date_str, status)
+            if has_items_col:
+                row += (json.dumps([{'productId': pid, 'quantity': q, 'price': p} for pid, (q, p) in lines.items()]),)
+            sales_rows.append(row)
+            for pid, (q, p) in lines.items():
+                item_rows.append((sale_id, pid, q, p))
+            if len(item_rows) >= batch_size:
+                flush()
+        if (offset + 1) % 30 == 0 or offset + 1 == days:
+            flush()
+            conn.commit()
+            log(f"  {day.isoformat()}: {totals['sales']:,} sales, {totals['sale_items']:,} lines "
+                f"({time.perf_counter() - started:.1f}s)")
+    flush()
+
+    hold_rows, hold_item_rows = [], []
+    now = datetime.datetime.combine(end_date, datetime.time(12, 0))
+    epoch = datetime.datetime(1970, 1, 1)
+    next_hold = cur.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM holds").fetchone()[0]
+    for hold_id in range(next_hold, next_hold + holds):
+        items = []
+        for _ in range(_pick(rng, basket_values, basket_cum)):
+            pid, price = skus[bisect.bisect_right(sku_cum, rng.random() * sku_cum[-1])]
+            items.append((pid, f"SKU {pid}", _pick(rng, qty_values, qty_cum), price))
+        subtotal = sum(price * qty for _, _, qty, price in items)
+        vat = round(subtotal * 0.16)
+        date = now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        # Live for 31 days so the whole spread is still listed.
+        expires_at = int((date - epoch).total_seconds()) + 31 * 86400
+        hold_rows.append((hold_id, date.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(cashiers), '',
+                          _pick(rng, pay_values, pay_cum), None, subtotal, vat, subtotal + vat, expires_at))
+        hold_item_rows.extend((hold_id, i) + item for i, item in enumerate(items))
+    cur.executemany("""
+        INSERT INTO holds (id, date, cashier, note, payment_method, payment_reference, subtotal, vat, total, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, hold_rows)
+    cur.executemany("""
+        INSERT INTO hold_items (hold_id, position, product_id, name, quantity, price) VALUES (?, ?, ?, ?, ?, ?)
+    """, hold_item_rows)
+    totals['holds'] = len(hold_rows)
+    conn.commit()
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large synthetic POS database.")
+    parser.add_argument('--db', required=True, help="Target SQLite file (created if missing)")
+    parser.add_argument('--days', type=int, default=730, help="Days of history ending today")
+    parser.add_argument('--sales-per-day', type=int, default=2000, help="Average sales per day")
+    parser.add_argument('--products', type=int, default=5000, help="Sellable SKUs to create")
+    parser.add_argument('--variant-ratio', type=float, default=0.3, help="Share of products created with variants")
+    parser.add_argument('--cashiers', type=int, default=12)
+    parser.add_argument('--refund-rate', type=float, default=0.02)
+    parser.add_argument('--void-rate', type=float, default=0.005)
+    parser.add_argument('--holds', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=50000, help="Rows per executemany batch")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    # Point the app at the target before importing it so its import-time
+    # bootstrap never touches the real pos.db.
+    os.environ['DB_PATH'] = os.path.abspath(args.db)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    started = time.perf_counter()
+    try:
+        ensure_schema(conn)
+        load_pragmas_on(conn)
+        sellable = generate_products(conn, rng, args.products, args.variant_ratio)
+        cashiers = ensure_cashiers(conn, args.cashiers)
+        conn.commit()
+        print(f"Created {len(sellable):,} sellable products, {len(cashiers)} cashiers")
+        totals = generate_history(conn, rng, sellable, cashiers, args.days, args.sales_per_day,
+                                  args.refund_rate, args.void_rate, args.holds, args.batch_size)
+        load_pragmas_off(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Done in {time.perf_counter() - started:.1f}s: " +
+          ", ".join(f"{k}={v:,}" for k, v in totals.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import analytics
+import migrations
+import repository
+
+@unittest.skipUnless(analytics.get_numpy(), 'numpy not installed')
+class ReorderAnalyticsTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.execute("UPDATE products SET stock = 100")
+        conn.commit()
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+        self.product = self.repo.get_product_by_barcode('890100000002')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def sell(self, quantity, days_ago=0):
+        sale_id = self.repo.create_sale([{'productId': self.product['id'], 'quantity': quantity,
+                                          'price': self.product['price']}], 'cash', None, 'cashier')
+        if days_ago:
+            conn = self.connect()
+            conn.execute("UPDATE sales SET date = datetime('now', ?) WHERE id = ?", (f'-{days_ago} days', sale_id))
+            conn.commit()
+            conn.close()
+        return sale_id
+
+    def row(self, engine, **kwargs):
+        return next(r for r in engine.reorder(include_all=True, limit=100, **kwargs) if r['id'] == self.product['id'])
+
+    def test_velocity_cover_and_reorder(self):
+        self.sell(14, days_ago=3)
+        self.sell(28, days_ago=20)
+        engine = analytics.ReorderAnalytics(self.repo)
+        row = self.row(engine)
+        self.assertEqual(row['velocity_7'], 2.0)
+        self.assertEqual(row['velocity_28'], 1.5)
+        self.assertAlmostEqual(row['velocity_90'], 42 / 90, places=3)
+        self.assertEqual(row['stock'], 58)
+        self.assertAlmostEqual(row['days_of_cover'], 58 / row['velocity'], places=0)
+        # 58 units cover 21 days of demand, but not 44
+        self.assertEqual(row['reorder_qty'], 0)
+        self.assertGreater(self.row(engine, lead_time_days=14, cover_days=30)['reorder_qty'], 0)
+
+    def test_incremental_refresh_matches_full_load(self):
+        engine = analytics.ReorderAnalytics(self.repo)
+        self.sell(5, days_ago=2)
+        self.assertEqual(engine.refresh(), 'full')
+        self.assertIsNone(engine.refresh())
+        self.sell(7)
+        refunded = self.sell(3, days_ago=1)
+        self.repo.reverse_sale(refunded, 'refund', 'Returned', 'admin')
+        self.assertEqual(engine.refresh(), 'incremental')
+        self.assertEqual(self.row(engine), self.row(analytics.ReorderAnalytics(self.repo)))
+        self.assertEqual(self.row(engine)['velocity_7'], round(12 / 7, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import audit
+import migrations
+import repository
+
+class AuditLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'pos.db')
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def test_buffered_entries_written_in_one_batch(self):
+        log = audit.AuditLog(self.repo, flush_interval=60)
+        for stock in range(3):
+            log.record('stock_change', actor='admin', product_id=1, details={'old': stock, 'new': stock + 1})
+        self.assertEqual(self.repo.query_audit(actor='admin'), [])
+        self.assertEqual(log.flush(), 3)
+        rows = self.repo.query_audit(actor='admin')
+        self.assertEqual([r['details'] for r in rows][0], '{"old":2,"new":3}')
+        self.assertEqual(log.stats['batches'], 1)
+
+    def test_indexes_serve_audit_lookups(self):
+        conn = self.connect()
+        for sql, index in [("SELECT * FROM audit_log WHERE sale_id = 1", 'idx_audit_sale'),
+                           ("SELECT * FROM audit_log WHERE actor = 'a' AND date >= '2024' ORDER BY date DESC", 'idx_audit_actor_date'),
+                           ("SELECT * FROM audit_log WHERE date >= '2024' ORDER BY date DESC", 'idx_audit_date')]:
+            plan = ' '.join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            self.assertIn(index, plan, sql)
+        conn.close()
+
+    def test_monthly_archival(self):
+        old = [(None, 1, 'stock_change', None, 'admin', None, '2024-01-%02d 10:00:00' % d) for d in range(1, 29)]
+        old += [(7, None, 'refund', 'Returned', 'admin', None, '2024-02-03 09:00:00')]
+        recent = [(None, 1, 'stock_change', None, 'admin', None, '2024-08-01 10:00:00')]
+        self.repo.insert_audit_entries(old + recent)
+        log = audit.AuditLog(self.repo, flush_interval=0, archive_dir=os.path.join(self.dir, 'archive'), retain_months=6)
+        today = datetime.date(2024, 9, 15)
+        self.assertEqual(log.due_months(today), ['2024-01-01', '2024-02-01'])
+        done = log.archive_due(today)
+        self.assertEqual([n for _, n in done], [28, 1])
+        self.assertEqual(len(audit.read_archive(done[0][0])), 28)
+        self.assertEqual(audit.read_archive(done[1][0])[0]['reason'], 'Returned')
+        self.assertEqual([r['date'] for r in self.repo.query_audit()], ['2024-08-01 10:00:00'])
+        self.assertEqual([a['month'] for a in self.repo.list_audit_archives()], ['2024-01', '2024-02'])
+        self.assertEqual(log.archive_due(today), [])
+
+if __name__ == '__main__':
+    unittest.main()
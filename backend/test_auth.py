@@ -1,5 +1,7 @@
 import unittest
 import json
+import uuid
+import datetime
 from app import app, init_db, get_db_connection
 
 class AuthTestCase(unittest.TestCase):
@@ -179,6 +181,38 @@ class AuthTestCase(unittest.TestCase):
         rv = self.app.post(f'/api/sales/{sale2_id}/void', headers={'Authorization': f'Bearer {admin_token}'}, json={'reason': 'Late void'})
         self.assertEqual(rv.status_code, 400)
 
+    def test_refund_of_past_sale_updates_cached_heatmap(self):
+        rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f'Bearer {json.loads(rv.data)["token"]}'}
+        products = json.loads(self.app.get('/products', headers=headers).data)['data']
+        pid, price = products[0]['id'], products[0]['price']
+        day = (datetime.datetime.utcnow().date() - datetime.timedelta(days=2)).isoformat()
+        rv = self.app.post('/api/sales/sync', headers=headers, json={'sales': [
+            {'client_key': uuid.uuid4().hex, 'items': [{'productId': pid, 'quantity': 1, 'price': price}],
+             'payment_method': 'cash', 'date': f'{day}T10:00:00Z'}]})
+        sale_id = json.loads(rv.data)['results'][0]['saleId']
+        url = f'/api/reports/heatmap?start={day}&end={day}&tz_offset=0'
+
+        def ten_oclock():
+            grid = json.loads(self.app.get(url, headers=headers).data)['data']['all']
+            cell = grid[datetime.date.fromisoformat(day).weekday()][10]
+            return cell['refunds'], cell['net']
+
+        refunds, net = ten_oclock()
+        self.assertEqual(ten_oclock(), (refunds, net))  # now served from the closed cache
+        conn = get_db_connection()
+        revision = conn.execute("SELECT revision FROM table_revisions WHERE name = 'sales_history'").fetchone()['revision']
+        total = conn.execute("SELECT total FROM sales WHERE id = ?", (sale_id,)).fetchone()['total']
+        conn.close()
+        rv = self.app.post(f'/api/sales/{sale_id}/refund', headers=headers, json={'reason': 'Returned late'})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(ten_oclock(), (refunds + 1, round(net - total, 2)))
+        conn = get_db_connection()
+        # Other workers drop their closed entries through this revision.
+        self.assertGreater(conn.execute("SELECT revision FROM table_revisions WHERE name = 'sales_history'")
+                           .fetchone()['revision'], revision)
+        conn.close()
+
     def test_exports_permissions_and_csv(self):
         rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
         self.assertEqual(rv.status_code, 200)
@@ -196,6 +230,257 @@ class AuthTestCase(unittest.TestCase):
         rv = self.app.get('/api/export/sales.csv?start=2000-01-01&end=2100-01-01', headers={'Authorization': f'Bearer {admin_token}'})
         self.assertEqual(rv.status_code, 200)
         self.assertTrue(rv.data.startswith(b'id,date,cashier'))
+    def test_offline_sales_sync(self):
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        cashier_token = json.loads(rv.data)['token']
+        headers = {'Authorization': f'Bearer {cashier_token}'}
+        products = json.loads(self.app.get('/products', headers=headers).data)['data']
+        pid, price = products[0]['id'], products[0]['price']
+        key = uuid.uuid4().hex
+        sales = [
+            {'client_key': key + '-1', 'items': [{'productId': pid, 'quantity': 1, 'price': price}], 'payment_method': 'cash',
+             'date': '2099-01-01T00:00:00Z'},
+            {'client_key': key + '-2', 'items': [{'productId': pid, 'quantity': 1, 'price': price}], 'payment_method': 'bitcoin'},
+            {'items': [{'productId': pid, 'quantity': 1, 'price': price}], 'payment_method': 'cash'},
+        ]
+        rv = self.app.post('/api/sales/sync', headers=headers, json={'sales': sales})
+        self.assertEqual(rv.status_code, 200, msg=rv.data)
+        data = json.loads(rv.data)
+        self.assertEqual([r['status'] for r in data['results']], ['applied', 'rejected', 'rejected'])
+        self.assertEqual(data['results'][1]['error'], 'Invalid payment method')
+        self.assertEqual((data['applied'], data['rejected']), (1, 2))
+        rv = self.app.post('/api/sales/sync', headers=headers, json={'sales': sales[:1]})
+        self.assertEqual(json.loads(rv.data)['results'][0]['status'], 'duplicate')
+        rv = self.app.post('/api/sales/sync', headers=headers, json={'sales': []})
+        self.assertEqual(rv.status_code, 400)
+
+    def test_idempotent_sale_replay(self):
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        cashier_token = json.loads(rv.data)['token']
+        key = uuid.uuid4().hex
+        headers = {'Authorization': f'Bearer {cashier_token}', 'Idempotency-Key': key}
+        products = json.loads(self.app.get('/products', headers=headers).data)['data']
+        pid, price = products[0]['id'], products[0]['price']
+        body = {'items': [{'productId': pid, 'quantity': 1, 'price': price}], 'payment_method': 'cash'}
+        first = self.app.post('/api/sales', headers=headers, json=body)
+        self.assertEqual(first.status_code, 200, msg=first.data)
+        sale_id = json.loads(first.data)['saleId']
+        again = self.app.post('/api/sales', headers=headers, json=body)
+        self.assertEqual(json.loads(again.data)['saleId'], sale_id)
+        self.assertEqual(again.headers.get('Idempotent-Replayed'), 'true')
+        changed = self.app.post('/api/sales', headers=headers, json=dict(body, payment_method='card'))
+        self.assertEqual(changed.status_code, 422)
+        # The offline queue shares the key, so a queued copy is a duplicate
+        rv = self.app.post('/api/sales/sync', headers=headers, json={'sales': [dict(body, client_key=key)]})
+        self.assertEqual(json.loads(rv.data)['results'][0], {'client_key': key, 'status': 'duplicate', 'saleId': sale_id})
+        conn = get_db_connection()
+        count = conn.execute("SELECT COUNT(*) AS c FROM sale_sync_keys WHERE sale_id = ?", (sale_id,)).fetchone()['c']
+        conn.close()
+        self.assertEqual(count, 1)
+
+    def test_concurrent_product_lists_are_coalesced(self):
+        import threading, time
+        import app as app_module
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        list_products = app_module.REPO.list_products
+        calls = []
+
+        def slow_list_products(*args):
+            calls.append(1)
+            time.sleep(0.3)
+            return list_products(*args)
+        app_module.REPO.list_products = slow_list_products
+        app_module.PRODUCT_LISTS.clear()
+        responses = []
+        try:
+            threads = [threading.Thread(target=lambda: responses.append(app.test_client().get('/api/pos/products', headers=headers)))
+                       for _ in range(5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            app_module.REPO.list_products = list_products
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertEqual(len({r.data for r in responses}), 1)
+        self.assertEqual(sum(1 for r in responses if r.headers.get('X-Coalesced') == '1'), 4)
+
+    def test_product_lists_project_requested_fields(self):
+        import app as app_module
+        rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        rv = self.app.get('/api/pos/products?fields=stock,id,low_stock', headers=headers)
+        self.assertEqual(rv.status_code, 200, msg=rv.data)
+        rows = json.loads(rv.data)['data']
+        self.assertTrue(rows)
+        self.assertEqual({tuple(sorted(r)) for r in rows}, {('id', 'low_stock', 'stock')})
+        rv = self.app.get('/api/products?fields=name,reserved', headers=headers)
+        self.assertEqual({tuple(sorted(r)) for r in json.loads(rv.data)['data']}, {('name', 'reserved')})
+        for bad in ('password', 'reserved'):
+            rv = self.app.get(f'/api/pos/products?fields=id,{bad}', headers=headers)
+            self.assertEqual(rv.status_code, 400)
+            self.assertIn(bad, json.loads(rv.data)['error'])
+
+        # Served from the cache until the products table changes.
+        list_products = app_module.REPO.list_products
+        calls = []
+        app_module.REPO.list_products = lambda *args: calls.append(args) or list_products(*args)
+        try:
+            again = self.app.get('/api/pos/products?fields=id,stock,low_stock', headers=headers)
+            self.assertEqual(json.loads(again.data)['data'], rows)
+            self.assertEqual(calls, [])
+            pid = rows[0]['id']
+            rv = self.app.put(f'/api/products/{pid}/stock', headers=headers, json={'stock': rows[0]['stock'] + 5})
+            self.assertEqual(rv.status_code, 200, msg=rv.data)
+            rv = self.app.get('/api/pos/products?fields=id,stock', headers=headers)
+        finally:
+            app_module.REPO.list_products = list_products
+        self.assertEqual(calls, [(['id', 'stock'],)])
+        stock = {r['id']: r['stock'] for r in json.loads(rv.data)['data']}
+        self.assertEqual(stock[pid], rows[0]['stock'] + 5)
+
+    def test_product_tree_and_grouped_catalog(self):
+        rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        parent = json.loads(self.app.get('/api/products', headers=headers).data)['data'][0]
+        before = json.loads(self.app.get(f"/api/products/{parent['id']}/tree", headers=headers).data)['data']
+        rv = self.app.post(f"/api/products/{parent['id']}/variants", headers=headers,
+                           json={'variants': [{'size': 'S', 'stock': 2}, {'size': 'L', 'stock': 7}]})
+        variant_ids = json.loads(rv.data)['ids']
+
+        rv = self.app.get(f"/api/products/{parent['id']}/tree?fields=id,name,stock", headers=headers)
+        self.assertEqual(rv.status_code, 200, msg=rv.data)
+        tree = json.loads(rv.data)['data']
+        self.assertEqual((tree['id'], tree['stock'], tree['variant_stock'], tree['variant_count']),
+                         (parent['id'], parent['stock'], before['variant_stock'] + 9, before['variant_count'] + 2))
+        self.assertEqual([v['id'] for v in tree['variants']][-2:], variant_ids)
+        self.assertEqual(set(tree['variants'][0]), {'id', 'name', 'stock', 'variants'})
+        self.assertEqual(self.app.get('/api/products/999999/tree', headers=headers).status_code, 404)
+
+        rv = self.app.get('/api/pos/products?grouped=1', headers=headers)
+        groups = {g['id']: g for g in json.loads(rv.data)['data']}
+        self.assertEqual(groups[parent['id']]['variant_stock'], tree['variant_stock'])
+        self.assertTrue(all(v not in groups for v in variant_ids))
+
+    def test_maintenance_status_and_manual_run(self):
+        rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        rv = self.app.get('/api/diagnostics/maintenance', headers=headers)
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('wal_bytes', json.loads(rv.data)['data']['sizes'])
+        rv = self.app.post('/api/diagnostics/maintenance/run', headers=headers, json={'tasks': ['checkpoint']})
+        self.assertEqual(rv.status_code, 200, msg=rv.data)
+        self.assertEqual(list(json.loads(rv.data)['data']['tasks']), ['checkpoint'])
+        rv = self.app.post('/api/diagnostics/maintenance/run', headers=headers, json={'tasks': ['drop']})
+        self.assertEqual(rv.status_code, 400)
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        cashier = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        self.assertEqual(self.app.get('/api/diagnostics/maintenance', headers=cashier).status_code, 403)
+
+    def test_profiler_toggle_and_output(self):
+        rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        rv = self.app.post('/api/diagnostics/profiler', headers=headers, json={'enabled': True, 'rate': 2})
+        self.assertEqual(rv.status_code, 400)
+        rv = self.app.post('/api/diagnostics/profiler', headers=headers,
+                           json={'enabled': True, 'rate': 1, 'interval_ms': 1, 'duration_seconds': 60})
+        self.assertEqual(rv.status_code, 200, msg=rv.data)
+        try:
+            self.assertTrue(json.loads(rv.data)['data']['enabled'])
+            for _ in range(20):
+                self.app.get('/api/reports/daily', headers=headers)
+        finally:
+            rv = self.app.post('/api/diagnostics/profiler', headers=headers, json={'enabled': False})
+        self.assertFalse(json.loads(rv.data)['data']['enabled'])
+        rv = self.app.get('/api/diagnostics/profiler', headers=headers)
+        self.assertIn('report_daily', [e['endpoint'] for e in json.loads(rv.data)['data']['endpoints']])
+        rv = self.app.get('/api/diagnostics/profiler/profile?endpoint=report_daily', headers=headers)
+        self.assertTrue(all(line.startswith('report_daily;') for line in rv.data.decode().splitlines()))
+        rv = self.app.get('/api/diagnostics/profiler/profile?format=speedscope', headers=headers)
+        self.assertEqual(json.loads(rv.data)['$schema'], 'https://www.speedscope.app/file-format-schema.json')
+        self.assertEqual(self.app.get('/api/diagnostics/profiler/profile?format=svg', headers=headers).status_code, 400)
+
+        # A batch is profiled as one request; its sub-requests do not re-register the thread.
+        import app as app_module
+        self.app.post('/api/diagnostics/profiler', headers=headers, json={'enabled': True, 'rate': 1, 'duration_seconds': 60})
+        try:
+            seen = []
+            original = app_module.REPO.list_categories
+
+            def watched():
+                seen.append(dict(app_module.PROFILER._active))
+                return original()
+            app_module.REPO.list_categories = watched
+            try:
+                rv = self.app.post('/api/batch', headers=headers, json={'requests': ['/api/reports/daily', '/api/categories']})
+            finally:
+                app_module.REPO.list_categories = original
+            self.assertEqual([r['status'] for r in json.loads(rv.data)['responses']], [200, 200])
+        finally:
+            self.app.post('/api/diagnostics/profiler', headers=headers, json={'enabled': False})
+        self.assertEqual(list(seen[0].values()), ['batch_requests'])
+        endpoints = [e['endpoint'] for e in app_module.PROFILER.info()['endpoints']]
+        self.assertIn('batch_requests', endpoints)
+        self.assertNotIn('report_daily', endpoints)
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        cashier = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        self.assertEqual(self.app.post('/api/diagnostics/profiler', headers=cashier, json={'enabled': True}).status_code, 403)
+
+    def test_z_report_close(self):
+        rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        today = datetime.datetime.utcnow().date()
+        yesterday = (today - datetime.timedelta(days=1)).isoformat()
+        rv = self.app.post('/api/reports/z/close', headers=headers, json={})
+        self.assertEqual(rv.status_code, 201, msg=rv.data)
+        self.app.post('/api/reports/z/close', headers=headers, json={'day': yesterday})
+        rv = self.app.post('/api/reports/z/close', headers=headers, json={'day': yesterday})
+        self.assertEqual(rv.status_code, 409)
+        rv = self.app.post('/api/reports/z/close', headers=headers, json={'day': today.isoformat()})
+        self.assertEqual(rv.status_code, 400)
+        rv = self.app.get(f'/api/reports/z?start={yesterday}&end={yesterday}', headers=headers)
+        self.assertEqual([z['day'] for z in json.loads(rv.data)['data']], [yesterday])
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        cashier = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        self.assertEqual(self.app.post('/api/reports/z/close', headers=cashier, json={}).status_code, 403)
+
+    def test_batch_runs_gets_with_one_auth_check(self):
+        import app as app_module
+        rv = self.app.post('/login', json={'username': 'cashier', 'password': 'cashier123'})
+        headers = {'Authorization': f"Bearer {json.loads(rv.data)['token']}"}
+        self.app.get('/api/categories', headers=headers)  # warm the user and revision caches
+        connect = app_module.REPO._connect
+        opened = []
+
+        def counting_connect():
+            opened.append(1)
+            return connect()
+        app_module.REPO._connect = counting_connect
+        try:
+            rv = self.app.post('/api/batch', headers=headers, json={'requests': [
+                {'id': 'cats', 'path': '/api/categories'},
+                '/api/holds?mine=1',
+                {'path': '/api/reports/daily'},
+                {'path': '/api/sales', 'method': 'POST'},
+                {'path': '/api/batch'},
+                {'path': '/api/no-such-endpoint'},
+            ]})
+        finally:
+            app_module.REPO._connect = connect
+        self.assertEqual(rv.status_code, 200, msg=rv.data)
+        responses = json.loads(rv.data)['responses']
+        self.assertEqual([r['status'] for r in responses], [200, 200, 403, 400, 400, 404])
+        self.assertEqual(responses[0]['id'], 'cats')
+        self.assertEqual(responses[0]['body'], json.loads(self.app.get('/api/categories', headers=headers).data))
+        # Every handler that read the database shared the batch's connection.
+        self.assertEqual(len(opened), 1)
+
+        self.assertEqual(self.app.post('/api/batch', json={'requests': ['/api/categories']}).status_code, 401)
+        too_many = ['/api/categories'] * (app_module.BATCH_MAX_REQUESTS + 1)
+        self.assertEqual(self.app.post('/api/batch', headers=headers, json={'requests': too_many}).status_code, 400)
+
     def test_cashier_cannot_refund_and_reason_required(self):
         rv = self.app.post('/login', json={'username': 'admin', 'password': 'admin123'})
         self.assertEqual(rv.status_code, 200)
@@ -0,0 +1,128 @@
+import unittest
+import gzip
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import backup
+
+class BackupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.dir.name, 'pos.db')
+        conn = sqlite3.connect(self.db)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, stock INTEGER)")
+        conn.executemany("INSERT INTO products (name, stock) VALUES (?, ?)", [(f'p{i}' * 20, 100) for i in range(20000)])
+        conn.execute("CREATE TABLE sales (id INTEGER PRIMARY KEY, total REAL)")
+        conn.commit()
+        conn.close()
+        self.service = backup.BackupService(self.db, os.path.join(self.dir.name, 'backups'), keep=2,
+                                            pages_per_step=16, step_pause=0.001)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_snapshot_is_consistent_while_sales_commit(self):
+        stop = threading.Event()
+        committed = []
+
+        def checkout():
+            conn = sqlite3.connect(self.db)
+            while not stop.is_set():
+                with conn:
+                    conn.execute("INSERT INTO sales (total) VALUES (1)")
+                    conn.execute("UPDATE products SET stock = stock - 1 WHERE id = 1")
+                committed.append(1)
+            conn.close()
+        writer = threading.Thread(target=checkout)
+        writer.start()
+        try:
+            job = self.service.backup()
+        finally:
+            stop.set()
+            writer.join()
+        self.assertEqual(job['state'], 'done')
+        self.assertGreater(job['steps'], 10)
+        self.assertEqual(job['pages_done'], job['pages_total'])
+        self.assertLess(job['bytes'], job['raw_bytes'])
+        self.assertTrue(committed)
+        self.assertEqual(self.service.status()['state'], 'done')
+
+        verified = self.service.verify(job['name'])
+        self.assertTrue(verified['ok'])
+        # Both tables come from the same instant: every sale moved stock by one.
+        with gzip.open(self.service.path_of(job['name'])) as f:
+            raw = f.read()
+        path = os.path.join(self.dir.name, 'check.db')
+        with open(path, 'wb') as f:
+            f.write(raw)
+        conn = sqlite3.connect(path)
+        sales = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        self.assertEqual(conn.execute("SELECT stock FROM products WHERE id = 1").fetchone()[0], 100 - sales)
+        conn.close()
+
+    def test_rotation_verify_and_restore(self):
+        names = []
+        for _ in range(3):
+            names.append(self.service.backup()['name'])
+            time.sleep(1.01)  # one snapshot per second
+        self.assertEqual([s['name'] for s in self.service.list()], names[:0:-1])
+
+        conn = sqlite3.connect(self.db)
+        conn.execute("DELETE FROM products")
+        conn.commit()
+        conn.close()
+        self.service.restore(names[-1], self.db)
+        conn = sqlite3.connect(self.db)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM products").fetchone()[0], 20000)
+        conn.close()
+        self.assertTrue(os.path.exists(self.db + '.before-restore'))
+
+        # A damaged snapshot fails verification and is never restored.
+        path = self.service.path_of(names[-1])
+        with gzip.open(path) as f:
+            data = bytearray(f.read())
+        data[4096 * 3:4096 * 5] = b'\xff' * 8192
+        with gzip.open(path, 'wb') as f:
+            f.write(bytes(data))
+        self.assertFalse(self.service.verify(names[-1])['ok'])
+        with self.assertRaises(backup.BackupError):
+            self.service.restore(names[-1], self.db)
+        with self.assertRaises(backup.BackupError):
+            self.service.verify('../pos.db')
+
+    def test_restore_keeps_commits_left_in_the_wal(self):
+        name = self.service.backup()['name']
+        # A server that died without checkpointing leaves its last sales in pos.db-wal only.
+        subprocess.run([sys.executable, '-c', (
+            "import os, sqlite3\n"
+            f"conn = sqlite3.connect({self.db!r})\n"
+            "conn.execute('PRAGMA wal_autocheckpoint=0')\n"
+            "conn.executemany('INSERT INTO sales (total) VALUES (?)', [(i,) for i in range(50)])\n"
+            "conn.commit()\n"
+            "os._exit(0)\n")], check=True)
+        self.assertGreater(os.path.getsize(self.db + '-wal'), 0)
+
+        self.service.restore(name, self.db)
+        conn = sqlite3.connect(self.db)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0], 0)
+        conn.close()
+        saved = sqlite3.connect(f'file:{self.db}.before-restore?mode=ro', uri=True)
+        self.assertEqual(saved.execute("SELECT COUNT(*) FROM sales").fetchone()[0], 50)
+        saved.close()
+
+    def test_background_backup_reports_progress(self):
+        self.assertTrue(self.service.start())
+        self.assertFalse(self.service.start())
+        deadline = time.time() + 10
+        while self.service.running() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.service.status()['state'], 'done')
+        self.assertEqual(len(self.service.info()['snapshots']), 1)
+
+if __name__ == '__main__':
+    unittest.main()
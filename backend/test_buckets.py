@@ -0,0 +1,75 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import buckets
+import migrations
+import repository
+
+class SalesBucketsTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.execute("UPDATE products SET stock = 100")
+        conn.commit()
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+        self.product = self.repo.get_product_by_barcode('890100000002')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def sell(self, when, method='cash'):
+        sale_id = self.repo.create_sale([{'productId': self.product['id'], 'quantity': 1,
+                                          'price': self.product['price']}], method, None, 'cashier')
+        # Move the sale and its bucket to a fixed UTC time
+        conn = self.connect()
+        conn.execute("UPDATE sales SET date = ? WHERE id = ?", (when, sale_id))
+        conn.commit()
+        conn.close()
+        self.repo.rebuild_buckets()
+        return sale_id
+
+    def bucket_snapshot(self):
+        conn = self.connect()
+        rows = [tuple(r) for r in conn.execute("SELECT * FROM sales_buckets ORDER BY day, hour, cashier, payment_method")]
+        conn.close()
+        return rows
+
+    def test_incremental_updates_match_rebuild(self):
+        self.sell('2024-01-01 09:15:00')
+        self.sell('2024-01-01 09:45:00', 'mpesa')
+        refunded = self.sell('2024-01-02 17:05:00')
+        self.repo.reverse_sale(refunded, 'refund', 'Returned', 'admin')
+        self.repo.create_sale([{'productId': self.product['id'], 'quantity': 2, 'price': self.product['price']}],
+                              'card', None, 'cashier')
+        incremental = self.bucket_snapshot()
+        self.repo.rebuild_buckets()
+        self.assertEqual(incremental, self.bucket_snapshot())
+
+    def test_heatmap_and_series_shift_to_local_time(self):
+        self.sell('2024-01-01 09:15:00')  # Monday 09:00 UTC = 12:00 at UTC+3
+        self.sell('2024-01-01 22:30:00')  # Tuesday 01:00 at UTC+3
+        refunded = self.sell('2024-01-01 09:50:00', 'mpesa')
+        self.repo.reverse_sale(refunded, 'refund', 'Returned', 'admin')
+        grid = buckets.heatmap(self.repo, '2024-01-01', '2024-01-02', offset_minutes=180)['all']
+        price = self.product['price'] * 1.16
+        self.assertEqual(grid[0][12]['sales'], 2)
+        self.assertEqual(grid[0][12]['refunds'], 1)
+        self.assertAlmostEqual(grid[0][12]['net'], price, places=1)
+        self.assertEqual(grid[1][1]['sales'], 1)
+        by_method = buckets.heatmap(self.repo, '2024-01-01', '2024-01-02', 180, by='payment_method')
+        self.assertEqual(sorted(by_method), ['cash', 'mpesa'])
+        # Only the Monday local day: the 22:30 UTC sale falls on Tuesday
+        points = buckets.series(self.repo, '2024-01-01', '2024-01-01', offset_minutes=180)
+        self.assertEqual([p['hour'] for p in points], ['2024-01-01 12:00'])
+
+if __name__ == '__main__':
+    unittest.main()
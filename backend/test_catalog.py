@@ -0,0 +1,52 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import catalog
+import migrations
+import repository
+
+class CatalogSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def test_round_trip_matches_products(self):
+        self.repo.create_product('Kettle – 1.7L', 2999.5, 3, 'Kitchenware', None, 5, '/uploads/products/k.png', 2500)
+        revision, decoded = catalog.read_snapshot(catalog.build_snapshot(self.repo.catalog_rows(), 7))
+        self.assertEqual(revision, 7)
+        expected = sorted(self.repo.list_products(), key=lambda p: p['id'])
+        self.assertEqual(len(decoded), len(expected))
+        for got, want in zip(decoded, expected):
+            for field in ('id', 'name', 'category', 'price', 'min_price', 'stock', 'barcode', 'image_url'):
+                self.assertEqual(got[field], want[field], field)
+            thr = want['low_stock_threshold']
+            self.assertEqual(got['low_stock'], thr is not None and want['stock'] <= thr)
+        self.assertTrue(decoded[-1]['low_stock'])
+
+    def test_rebuilt_only_when_products_change(self):
+        cache = catalog.CatalogCache(self.repo)
+        first = cache.get()
+        self.assertIs(cache.get(), first)
+        product = self.repo.get_product_by_barcode('890100000002')
+        self.repo.create_sale([{'productId': product['id'], 'quantity': 1, 'price': product['price']}], 'cash', None, 'cashier')
+        second = cache.get()
+        self.assertGreater(second[0], first[0])
+        stock = {p['id']: p['stock'] for p in catalog.read_snapshot(second[1])[1]}
+        self.assertEqual(stock[product['id']], product['stock'] - 1)
+        self.assertEqual(cache.stats['builds'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
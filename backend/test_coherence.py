@@ -0,0 +1,73 @@
+import unittest
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import coherence
+import migrations
+import repository
+
+class CoherenceTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+        self.coherence = coherence.Coherence(self.repo, db_path=self.path)
+        self.fired = []
+        for table in ('products', 'sales', 'sales_history', 'users'):
+            self.coherence.watch(table, lambda table=table: self.fired.append(table))
+        self.assertEqual(self.coherence.check(), [])
+
+    def tearDown(self):
+        self.coherence.close()
+        os.remove(self.path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def write(self, sql, params=()):
+        conn = self.connect()
+        with conn:
+            conn.execute(sql, params)
+        conn.close()
+
+    def test_unchanged_database_skips_revision_read(self):
+        reads = self.coherence.stats['revision_reads']
+        for _ in range(100):
+            self.assertEqual(self.coherence.check(), [])
+        self.assertEqual(self.coherence.stats['revision_reads'], reads)
+        # A commit that touches no tracked table moves data_version only.
+        self.write("INSERT INTO banks (name) VALUES ('Test Bank')")
+        self.assertEqual(self.coherence.check(), [])
+        self.assertEqual(self.coherence.stats['revision_reads'], reads + 1)
+        self.assertEqual(self.fired, [])
+
+    def test_listeners_fire_for_written_tables(self):
+        before = self.coherence.revision('products')
+        self.repo.create_product('Kettle', 1500, 4, 'Kitchenware', None, 5, None, None)
+        self.assertEqual(self.coherence.check(), ['products'])
+        self.assertEqual(self.coherence.revision('products'), before + 1)
+        self.write("INSERT INTO sales (total, cashier, date) VALUES (10, 'c', datetime('now'))")
+        self.assertEqual(self.coherence.check(), ['sales'])
+        self.write("INSERT INTO sales (total, cashier, date) VALUES (10, 'c', '2020-01-01 10:00:00')")
+        self.assertEqual(sorted(self.coherence.check()), ['sales', 'sales_history'])
+        self.write("UPDATE users SET role = role")
+        self.assertEqual(self.coherence.check(), ['users'])
+        self.assertEqual(sorted(self.fired), ['products', 'sales', 'sales', 'sales_history', 'users'])
+
+    def test_sees_commits_from_another_process(self):
+        code = ("import sqlite3, sys; c = sqlite3.connect(sys.argv[1]); "
+                "c.execute(\"UPDATE products SET stock = stock + 1\"); c.commit()")
+        self.repo.create_product('Kettle', 1500, 4, 'Kitchenware', None, 5, None, None)
+        self.coherence.check()
+        subprocess.run([sys.executable, '-c', code, self.path], check=True)
+        self.assertEqual(self.coherence.check(), ['products'])
+
+if __name__ == '__main__':
+    unittest.main()
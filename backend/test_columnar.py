@@ -0,0 +1,62 @@
+import unittest
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import columnar
+import repository
+import stress_data
+
+@unittest.skipUnless(columnar.get_pyarrow(), 'pyarrow not installed')
+class ColumnarExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'pos.db')
+        conn = self.connect()
+        stress_data.ensure_schema(conn)
+        rng = random.Random(3)
+        sellable = stress_data.generate_products(conn, rng, 50, 0.2)
+        cashiers = stress_data.ensure_cashiers(conn, 2)
+        stress_data.generate_history(conn, rng, sellable, cashiers, days=45, sales_per_day=20,
+                                     refund_rate=0.05, void_rate=0.0, holds=0, batch_size=100,
+                                     end_date=datetime.date(2024, 2, 14), log=lambda *_: None)
+        conn.commit()
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def test_parquet_round_trip_is_typed(self):
+        import pyarrow
+        import pyarrow.parquet as pq
+        out = os.path.join(self.dir, 'sale_items.parquet')
+        rows = columnar.export_table(self.repo, 'sale_items', 'parquet', out, batch_size=97)
+        table = pq.read_table(out)
+        self.assertEqual(table.num_rows, rows)
+        self.assertEqual(rows, self.connect().execute("SELECT COUNT(*) FROM sale_items").fetchone()[0])
+        self.assertTrue(pyarrow.types.is_timestamp(table.schema.field('sale_date').type))
+        self.assertEqual(str(table.schema.field('quantity').type), 'int64')
+
+    def test_partitioned_by_month_with_date_range(self):
+        import pyarrow.ipc as ipc
+        files = columnar.export_partitioned(self.repo, 'sales', 'arrow', self.dir, 'month',
+                                            start='2024-01-15', end='2024-02-14', batch_size=50)
+        self.assertEqual([os.path.basename(os.path.dirname(p)) for p, _ in files], ['month=2024-01', 'month=2024-02'])
+        expected = self.connect().execute(
+            "SELECT COUNT(*) FROM sales WHERE DATE(date) BETWEEN '2024-01-15' AND '2024-02-14'").fetchone()[0]
+        self.assertEqual(sum(n for _, n in files), expected)
+        table = ipc.open_file(files[1][0]).read_all()
+        self.assertEqual(table.num_rows, files[1][1])
+        with self.assertRaises(ValueError):
+            columnar.export_partitioned(self.repo, 'products', 'parquet', self.dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import app as app_module
+import journal
+import migrations
+from app import app
+
+def fresh_db(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    return conn
+
+class SaleJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = journal.LocalDirectoryStore(os.path.join(self.dir, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_replay_is_idempotent_and_applies_refunds(self):
+        j = journal.SaleJournal(self.store)
+        sale_id = j.append({
+            "type": "sale",
+            "sale": {"total": 116, "subtotal": 100, "vat": 16, "cashier": "cashier",
+                     "payment_method": "cash", "payment_reference": None, "date": "2024-01-02 10:00:00"},
+            "items": [{"product_id": 1, "quantity": 2, "price": 50}]
+        })
+        j.append({"type": "refund", "sale_entry_id": sale_id, "reason": "Returned", "actor": "admin",
+                  "date": "2024-01-02 11:00:00"})
+        self.assertEqual(j.pending(), 2)
+        self.assertEqual(j.flush(), 2)
+        self.assertEqual(j.pending(), 0)
+        self.assertEqual(len(self.store.list()), 1)
+
+        conn = fresh_db(os.path.join(self.dir, 'a.db'))
+        stock_before = conn.execute("SELECT stock FROM products WHERE id = 1").fetchone()['stock']
+        reader = journal.SaleJournal(self.store)
+        self.assertEqual(reader.replay(conn), 2)
+        sale = conn.execute("SELECT * FROM sales WHERE date = '2024-01-02 10:00:00'").fetchone()
+        self.assertEqual(sale['status'], 'refunded')
+        self.assertEqual(conn.execute("SELECT stock FROM products WHERE id = 1").fetchone()['stock'], stock_before)
+        # A second reader over the same database applies nothing twice
+        self.assertEqual(journal.SaleJournal(self.store).replay(conn), 0)
+        conn.close()
+
+    def test_checkout_is_journaled(self):
+        db_conn = app_module.get_db_connection()
+        db_conn.execute("UPDATE products SET stock = 50 WHERE id = 1")
+        db_conn.commit()
+        product = dict(db_conn.execute("SELECT id, price FROM products WHERE id = 1").fetchone())
+        db_conn.close()
+        app.config['TESTING'] = True
+        client = app.test_client()
+        token = json.loads(client.post('/login', json={'username': 'cashier', 'password': 'cashier123'}).data)['token']
+        j = journal.SaleJournal(self.store)
+        app_module.JOURNAL = j
+        try:
+            rv = client.post('/api/sales', headers={'Authorization': f'Bearer {token}'}, json={
+                'items': [{'productId': product['id'], 'quantity': 1, 'price': product['price']}],
+                'payment_method': 'cash'
+            })
+            self.assertEqual(rv.status_code, 200, msg=rv.data)
+        finally:
+            app_module.JOURNAL = None
+        self.assertEqual(j.pending(), 1)
+        j.flush()
+        conn = fresh_db(os.path.join(self.dir, 'b.db'))
+        self.assertEqual(journal.SaleJournal(self.store).replay(conn), 1)
+        row = conn.execute("SELECT si.product_id, s.cashier FROM sales s JOIN sale_items si ON si.sale_id = s.id "
+                           "JOIN journal_entries je ON je.sale_id = s.id").fetchone()
+        self.assertEqual(row['product_id'], product['id'])
+        self.assertEqual(row['cashier'], 'cashier')
+        conn.close()
+
+    def test_refund_of_a_sale_from_before_the_journal_is_journaled(self):
+        app.config['TESTING'] = True
+        client = app.test_client()
+        admin = {'Authorization': 'Bearer ' + json.loads(
+            client.post('/login', json={'username': 'admin', 'password': 'admin123'}).data)['token']}
+        db_conn = app_module.get_db_connection()
+        db_conn.execute("UPDATE products SET stock = 50 WHERE id = 1")
+        db_conn.commit()
+        price = db_conn.execute("SELECT price FROM products WHERE id = 1").fetchone()['price']
+        db_conn.close()
+        rv = client.post('/api/sales', headers=admin, json={
+            'items': [{'productId': 1, 'quantity': 1, 'price': price}], 'payment_method': 'cash'})
+        sale_id = json.loads(rv.data)['saleId']
+        # Another instance starting from the same database file.
+        db_conn = app_module.get_db_connection()
+        other = sqlite3.connect(os.path.join(self.dir, 'other.db'))
+        db_conn.backup(other)
+        db_conn.close()
+        other.row_factory = sqlite3.Row
+
+        j = journal.SaleJournal(self.store)
+        app_module.JOURNAL = j
+        try:
+            rv = client.post(f'/api/sales/{sale_id}/refund', headers=admin, json={'reason': 'Returned'})
+            self.assertEqual(rv.status_code, 200, msg=rv.data)
+        finally:
+            app_module.JOURNAL = None
+        self.assertEqual(j.flush(), 1)
+        self.assertEqual(journal.SaleJournal(self.store).replay(other), 1)
+        self.assertEqual(other.execute("SELECT status FROM sales WHERE id = ?", (sale_id,)).fetchone()['status'], 'refunded')
+        self.assertEqual(other.execute("SELECT stock FROM products WHERE id = 1").fetchone()['stock'], 50)
+        other.close()
+
+if __name__ == '__main__':
+    unittest.main()
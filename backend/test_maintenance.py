@@ -0,0 +1,74 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import time
+import maintenance
+
+class MaintenanceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'pos.db')
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA wal_autocheckpoint=0")
+        self.conn.execute("CREATE TABLE holds (id INTEGER PRIMARY KEY, note TEXT)")
+        self.conn.execute("CREATE INDEX idx_holds_note ON holds(note)")
+        self.conn.executemany("INSERT INTO holds (note) VALUES (?)", [('x' * 200,) for _ in range(5000)])
+        self.maint = maintenance.Maintenance(self.path, quiet_seconds=0, vacuum_min_free_pages=10)
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    def test_tasks_shrink_the_files_and_record_sizes(self):
+        record = self.maint.run(['checkpoint', 'optimize', 'vacuum'])
+        self.assertGreater(record['before']['wal_bytes'], 0)
+        self.assertEqual(record['after']['wal_bytes'], 0)
+        self.assertFalse(record['tasks']['checkpoint']['busy'])
+        self.assertEqual(record['tasks']['optimize']['analyzed_tables'], 1)
+        # The first vacuum converts the file to incremental auto_vacuum.
+        self.assertTrue(record['tasks']['vacuum']['converted'])
+        self.assertEqual(record['after']['auto_vacuum'], 'incremental')
+
+        self.conn.execute("DELETE FROM holds")
+        self.maint.run(['checkpoint'])
+        size = os.path.getsize(self.path)
+        record = self.maint.run(['vacuum', 'checkpoint'])
+        self.assertGreater(record['tasks']['vacuum']['freed_pages'], 100)
+        self.assertEqual(record['after']['freelist_pages'], 0)
+        self.assertLess(os.path.getsize(self.path), size / 4)
+        self.assertEqual(len(self.maint.info()['history']), 3)
+
+    def test_large_files_are_not_converted_automatically(self):
+        self.maint.vacuum_convert_max_bytes = 0
+        result = self.maint.run(['vacuum'])['tasks']['vacuum']
+        self.assertIn('skipped', result)
+        self.assertEqual(self.maint.sizes(self.conn)['auto_vacuum'], 'none')
+
+    def test_due_tasks_wait_for_a_quiet_period(self):
+        self.maint.quiet_seconds = 60
+        self.maint._due['checkpoint'] = time.time() - 1
+        self.maint.note_activity()
+        self.assertIsNone(self.maint.tick())
+        self.assertEqual(self.maint.stats['deferred'], 1)
+
+        self.maint.quiet_seconds = 0
+        record = self.maint.tick()
+        self.assertEqual(list(record['tasks']), ['checkpoint'])
+        self.assertEqual(self.maint.due(), [])
+        self.assertIsNone(self.maint.tick())
+
+    @unittest.skipIf(maintenance.fcntl is None, 'no flock on this platform')
+    def test_one_process_at_a_time(self):
+        other = maintenance.Maintenance(self.path)
+        held = other._lock_file()
+        try:
+            self.assertIsNone(self.maint.run(['checkpoint']))
+        finally:
+            held.close()
+        self.assertEqual(self.maint.stats['locked_elsewhere'], 1)
+        self.assertIsNotNone(self.maint.run(['checkpoint']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import unittest.mock
+import migrations
+import repository
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.path)
+
+    def test_fresh_database_reaches_latest_and_rerun_is_noop(self):
+        applied = migrations.migrate(self.conn)
+        self.assertEqual(applied, len(migrations.MIGRATIONS))
+        self.assertEqual(migrations.current_version(self.conn), migrations.latest_version())
+        users = [r['username'] for r in self.conn.execute("SELECT username FROM users ORDER BY username")]
+        self.assertEqual(users, ['admin', 'cashier', 'superadmin'])
+        self.assertEqual(migrations.migrate(self.conn), 0)
+
+    def test_holds_from_before_expiry_never_expire(self):
+        with unittest.mock.patch.object(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:7]):
+            migrations.migrate(self.conn)
+        self.conn.execute("INSERT INTO holds (date, cashier, note, items, subtotal, vat, total) "
+                          "VALUES ('2023-05-01 09:00:00', 'cashier', 'parked', ?, 100, 16, 116)",
+                          ('[{"productId": 1, "name": "Blender", "quantity": 2, "price": 50}]',))
+        self.conn.commit()
+        migrations.migrate(self.conn)
+        hold = self.conn.execute("SELECT id, expires_at FROM holds WHERE note = 'parked'").fetchone()
+        self.assertIsNone(hold['expires_at'])
+        self.assertEqual(self.conn.execute("SELECT quantity FROM hold_items WHERE hold_id = ?", (hold['id'],)).fetchone()[0], 2)
+
+        repo = repository.SQLiteRepository(lambda: sqlite3.connect(self.path))
+        self.assertEqual(repo.purge_expired_holds(), 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM holds WHERE note = 'parked'").fetchone()[0], 1)
+
+    def test_legacy_schema_is_upgraded(self):
+        # Schema as created by the original server.js
+        self.conn.executescript('''
+            CREATE TABLE products (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                                   price REAL NOT NULL, stock INTEGER NOT NULL, category TEXT);
+            CREATE TABLE sales (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT DEFAULT CURRENT_TIMESTAMP,
+                                total REAL NOT NULL, items TEXT NOT NULL);
+            INSERT INTO products (name, price, stock, category) VALUES ('Blender 500W', 4500, 20, 'Kitchenware');
+        ''')
+        migrations.migrate(self.conn)
+        cols = [r['name'] for r in self.conn.execute("PRAGMA table_info(products)")]
+        for col in ('parent_id', 'barcode', 'low_stock_threshold', 'image_url', 'min_price'):
+            self.assertIn(col, cols)
+        row = self.conn.execute("SELECT barcode, low_stock_threshold FROM products WHERE name = 'Blender 500W'").fetchone()
+        self.assertEqual(row['barcode'], '890100000002')
+        self.assertEqual(row['low_stock_threshold'], 5)
+        sales_cols = [r['name'] for r in self.conn.execute("PRAGMA table_info(sales)")]
+        self.assertIn('status', sales_cols)
+
+if __name__ == '__main__':
+    unittest.main()
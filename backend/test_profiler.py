@@ -0,0 +1,102 @@
+import unittest
+import json
+import tempfile
+import threading
+import time
+import profiler
+
+def slow_handler(seconds=0.2):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+def serve(prof, endpoint, seconds=0.2):
+    def run():
+        prof.begin_request(endpoint)
+        try:
+            slow_handler(seconds)
+        finally:
+            prof.end_request()
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_sampled_requests_fold_into_endpoint_stacks(self):
+        prof = profiler.Profiler(rate=1.0, interval=0.002)
+        prof.configure(True)
+        try:
+            serve(prof, 'report_daily')
+        finally:
+            prof.stop()
+        self.assertEqual(prof._active, {})
+        collapsed = prof.collapsed()
+        first = collapsed.splitlines()[0]
+        stack, count = first.rsplit(' ', 1)
+        self.assertTrue(stack.startswith('report_daily;'))
+        self.assertIn('slow_handler (test_profiler.py:8)', stack)
+        self.assertGreater(int(count), 5)
+
+        scope = prof.speedscope()
+        self.assertEqual(len(scope['profiles']), 1)
+        profile = scope['profiles'][0]
+        self.assertEqual(profile['name'], 'report_daily (1 requests)')
+        self.assertEqual(len(profile['samples']), len(profile['weights']))
+        names = {scope['shared']['frames'][i]['name'] for i in profile['samples'][0]}
+        self.assertIn('slow_handler', names)
+        info = prof.info()
+        self.assertEqual(info['endpoints'][0]['endpoint'], 'report_daily')
+        self.assertFalse(info['enabled'])
+
+    def test_off_or_unsampled_requests_are_not_registered(self):
+        prof = profiler.Profiler(rate=1.0)
+        self.assertFalse(prof.begin_request('products'))
+        self.assertEqual(prof._active, {})
+        prof.end_request()
+        prof.configure(True, rate=0.000001)
+        try:
+            self.assertFalse(any(prof.begin_request('products') for _ in range(1000)))
+        finally:
+            prof.stop()
+        self.assertIsNone(prof._thread)
+
+    def test_workers_share_the_switch_and_the_samples(self):
+        first = profiler.Profiler(state_dir=self.dir.name, sync_interval=0, worker_id='1')
+        second = profiler.Profiler(state_dir=self.dir.name, sync_interval=0, worker_id='2')
+        first.configure(True, rate=1.0, interval=0.002, duration=30)
+        try:
+            # The second worker follows control.json on its next request.
+            serve(second, 'list_products')
+            self.assertTrue(second.enabled)
+            self.assertEqual(second.session, first.session)
+        finally:
+            first.configure(False)
+            second.sync()
+            second.stop()
+        self.assertFalse(second.enabled)
+        counts = first.counts()
+        self.assertEqual(counts['list_products']['requests'], 1)
+        self.assertGreater(sum(counts['list_products']['stacks'].values()), 5)
+        with open(f"{self.dir.name}/control.json") as f:
+            self.assertFalse(json.load(f)['enabled'])
+
+        # A new session starts from zero.
+        first.configure(True, duration=30)
+        first.stop()
+        self.assertEqual(first.counts(), {})
+
+    def test_profiling_switches_itself_off(self):
+        prof = profiler.Profiler(rate=1.0, interval=0.002)
+        prof.configure(True, duration=0.05)
+        prof._thread.join(2)
+        self.assertFalse(prof.enabled)
+        self.assertFalse(prof.begin_request('products'))
+
+if __name__ == '__main__':
+    unittest.main()
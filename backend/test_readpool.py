@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import migrations
+import readpool
+import repository
+
+class ReadPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'pos.db')
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def sell_one(self, repo):
+        product = repo.get_product_by_barcode('890100000002')
+        return repo.create_sale([{'productId': product['id'], 'quantity': 1, 'price': product['price']}],
+                                'cash', None, 'cashier')
+
+    def test_ro_mode_reads_live_data_and_cannot_write(self):
+        pool = readpool.ReadPool(self.path, mode='ro', size=2)
+        repo = repository.SQLiteRepository(self.connect, read_pool=pool)
+        self.sell_one(repo)
+        self.assertEqual(repo.daily_sales_summary()[0]['total_sales'], 1)
+        with pool.connection() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM sales")
+        self.assertEqual(self.connect().execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        # Connections are reused rather than reopened per request
+        list(repo.iter_products_export())
+        self.assertEqual(pool.stats['opened'], 1)
+        pool.close()
+
+    def test_snapshot_mode_refreshes_after_interval(self):
+        pool = readpool.ReadPool(self.path, mode='snapshot', refresh_seconds=3600)
+        repo = repository.SQLiteRepository(self.connect, read_pool=pool)
+        self.assertEqual(list(repo.iter_sales_export()), [])
+        self.sell_one(repo)
+        # Still within the refresh interval: the snapshot lags the live file
+        self.assertEqual(list(repo.iter_sales_export()), [])
+        pool.refresh_seconds = 0
+        self.assertEqual(len(list(repo.iter_sales_export())), 1)
+        self.assertEqual(pool.stats['snapshots'], 2)
+        pool.close()
+
+    def test_concurrent_refreshes_never_publish_a_partial_copy(self):
+        # Two workers' pools on one database, refreshing at the same time.
+        pools = [readpool.ReadPool(self.path, mode='snapshot', size=1) for _ in range(2)]
+        errors = []
+
+        def refresh(pool):
+            try:
+                for _ in range(20):
+                    pool.refresh()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=refresh, args=(pool,)) for pool in pools]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(integrity_check(pools[0].snapshot_path), 'ok')
+        self.assertEqual([n for n in os.listdir(self.dir) if n.endswith('.tmp')], [])
+
+def integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
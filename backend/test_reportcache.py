@@ -0,0 +1,54 @@
+import unittest
+import datetime
+import shutil
+import tempfile
+import reportcache
+
+class ReportCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_closed_ranges(self):
+        today = datetime.date(2024, 3, 10)
+        self.assertTrue(reportcache.is_closed('2024-02-01', '2024-02-29', today))
+        self.assertFalse(reportcache.is_closed('2024-03-01', '2024-03-10', today))
+        self.assertFalse(reportcache.is_closed(None, None, today))
+        self.assertFalse(reportcache.is_closed('2024-02-01', 'garbage', today))
+        self.assertEqual(reportcache.make_key('items', period='Daily', start=' 2024-01-01', end=None),
+                         reportcache.make_key('items', start='2024-01-01', period='daily'))
+
+    def test_live_entries_invalidate_and_closed_entries_persist(self):
+        cache = reportcache.ReportCache(maxsize=2, disk_dir=self.dir)
+        calls = []
+        def compute():
+            calls.append(1)
+            return [{'total_sum': len(calls)}]
+        self.assertEqual(cache.get_or_compute('live', compute), [{'total_sum': 1}])
+        self.assertEqual(cache.get_or_compute('live', compute), [{'total_sum': 1}])
+        cache.get_or_compute('closed', compute, closed=True)
+        cache.invalidate_live()
+        self.assertEqual(cache.get_or_compute('live', compute), [{'total_sum': 3}])
+        self.assertEqual(cache.get_or_compute('closed', compute, closed=True), [{'total_sum': 2}])
+        self.assertEqual(len(calls), 3)
+
+        # A fresh process finds closed results on disk
+        other = reportcache.ReportCache(disk_dir=self.dir)
+        self.assertEqual(other.get('closed'), [{'total_sum': 2}])
+        self.assertEqual(other.stats['disk_hits'], 1)
+        self.assertIsNone(other.get('live'))
+        other.clear()
+        self.assertIsNone(reportcache.ReportCache(disk_dir=self.dir).get('closed'))
+
+    def test_result_computed_across_a_write_is_not_cached(self):
+        cache = reportcache.ReportCache()
+        def compute():
+            cache.invalidate_live()
+            return []
+        cache.get_or_compute('live', compute)
+        self.assertIsNone(cache.get('live'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+import unittest
+import itertools
+import os
+import sqlite3
+import tempfile
+import threading
+import migrations
+import repository
+
+class RepositoryContract:
+    """Behaviour both storage engines must share."""
+
+    def first_product(self):
+        return self.repo.get_product_by_barcode('890100000002')
+
+    def test_users_and_lookups(self):
+        user = self.repo.get_user_by_username('cashier')
+        self.assertEqual(user['role'], 'cashier')
+        self.assertEqual(self.repo.get_user_by_id(user['id'])['username'], 'cashier')
+        self.assertEqual([u['username'] for u in self.repo.list_users('cashier')], ['cashier'])
+        self.repo.add_bank('Test Bank')
+        with self.assertRaises(repository.IntegrityError):
+            self.repo.add_bank('Test Bank')
+
+    def test_sale_refund_and_reports(self):
+        product = self.first_product()
+        seen = []
+        sale_id = self.repo.create_sale(
+            [{'productId': product['id'], 'quantity': 2, 'price': product['price']}], 'cash', None, 'cashier',
+            before_commit=lambda conn, sid, totals: seen.append((sid, totals['subtotal'])))
+        self.assertEqual(seen, [(sale_id, product['price'] * 2)])
+        self.assertEqual(self.repo.get_product(product['id'])['stock'], product['stock'] - 2)
+        sale, items = self.repo.get_sale(sale_id)
+        self.assertEqual(sale['status'], 'completed')
+        self.assertEqual(items[0]['name'], product['name'])
+        self.assertIn(sale_id, [r['id'] for r in self.repo.recent_sales(q=str(sale_id))])
+
+        day = sale['date'][:10]
+        daily = self.repo.report_daily(day, day)
+        self.assertEqual(daily[0]['total_sum'], sale['total'])
+        items_report = self.repo.report_items('monthly', day, day)
+        self.assertEqual(items_report[0]['units_sold'], 2)
+        self.assertEqual(self.repo.report_payment_methods('daily', day, day)[0]['payment_method'], 'cash')
+
+        self.repo.reverse_sale(sale_id, 'refund', 'Returned', 'admin')
+        self.assertEqual(self.repo.get_product(product['id'])['stock'], product['stock'])
+        with self.assertRaises(ValueError):
+            self.repo.reverse_sale(sale_id, 'void', 'again', 'admin')
+        self.assertEqual([r['status'] for r in self.repo.iter_sales_export(day, day)], ['refunded'])
+
+    def test_failed_sale_rolls_back(self):
+        product = self.first_product()
+        with self.assertRaises(ValueError):
+            self.repo.create_sale([{'productId': product['id'], 'quantity': 1, 'price': product['price']},
+                                   {'productId': product['id'], 'quantity': 10 ** 6, 'price': product['price']}],
+                                  'cash', None, 'cashier')
+        self.assertEqual(self.repo.get_product(product['id'])['stock'], product['stock'])
+        self.assertEqual(self.repo.recent_sales(), [])
+
+    def test_sync_sales_per_sale_results(self):
+        product = self.first_product()
+        line = {'productId': product['id'], 'quantity': 1, 'price': product['price']}
+        queued = [
+            {'client_key': 'till1-a', 'items': [line], 'payment_method': 'cash', 'date': '2024-03-01 10:00:00'},
+            {'client_key': 'till1-b', 'items': [dict(line, quantity=10 ** 6)], 'payment_method': 'cash'},
+            {'client_key': 'till1-a', 'items': [line], 'payment_method': 'cash'},
+            {'client_key': 'till1-c', 'items': [dict(line, quantity=2)], 'payment_method': 'mpesa', 'payment_reference': 'QX1'},
+        ]
+        results = self.repo.sync_sales(queued, 'cashier')
+        self.assertEqual([r['status'] for r in results], ['applied', 'rejected', 'duplicate', 'applied'])
+        self.assertEqual(results[1]['error'], 'Insufficient stock')
+        self.assertEqual(results[2]['saleId'], results[0]['saleId'])
+        self.assertEqual(self.repo.get_product(product['id'])['stock'], product['stock'] - 3)
+        self.assertEqual(self.repo.get_sale(results[0]['saleId'])[0]['date'], '2024-03-01 10:00:00')
+        # Re-sending the whole batch applies nothing new
+        again = self.repo.sync_sales(queued[:1] + queued[3:], 'cashier')
+        self.assertEqual([r['status'] for r in again], ['duplicate', 'duplicate'])
+        self.assertEqual(self.repo.get_product(product['id'])['stock'], product['stock'] - 3)
+
+    def test_idempotency_keys(self):
+        self.assertIsNone(self.repo.claim_idempotency_key('u1:/api/sales:k', 'h1', 60, now=1000))
+        self.assertIsNone(self.repo.claim_idempotency_key('u1:/api/sales:k', 'h1', 60, now=1010)['status_code'])
+        self.repo.complete_idempotency_key('u1:/api/sales:k', 200, '{"saleId": 1}', 3600, now=1020)
+        self.repo.complete_idempotency_key('u1:/api/sales:k', 400, '{}', 3600, now=1021)
+        stored = self.repo.claim_idempotency_key('u1:/api/sales:k', 'h1', 60, now=2000)
+        self.assertEqual((stored['status_code'], stored['response']), (200, '{"saleId": 1}'))
+        # Expired keys are purged, or replaced when claimed again
+        self.assertIsNone(self.repo.claim_idempotency_key('u1:/api/sales:k', 'h2', 60, now=5000))
+        self.assertIsNone(self.repo.claim_idempotency_key('u1:/api/sales:other', 'h', 60, now=5000))
+        self.repo.release_idempotency_key('u1:/api/sales:other')
+        self.assertEqual(self.repo.purge_idempotency_keys(now=5060), 1)
+
+    def test_audit_batch_and_query(self):
+        self.repo.insert_audit_entries([(None, 1, 'stock_change', None, 'admin', '{"old":1,"new":2}', '2024-01-01 10:00:00'),
+                                        (5, None, 'refund', 'Returned', 'admin', None, '2024-01-02 10:00:00'),
+                                        (None, 2, 'min_price_change', None, 'other', None, '2024-01-03 10:00:00')])
+        self.assertEqual([r['action'] for r in self.repo.query_audit(actor='admin')], ['refund', 'stock_change'])
+        self.assertEqual(self.repo.query_audit(sale_id=5)[0]['reason'], 'Returned')
+        self.assertEqual(len(self.repo.query_audit(start='2024-01-02', end='2024-01-03')), 1)
+        rows = list(itertools.chain.from_iterable(self.repo.audit_rows('2024-01-01', '2024-02-01')))
+        self.assertEqual(self.repo.archive_audit_range('2024-01-01', '2024-02-01', 'a.jsonl.gz', '2024-01',
+                                                       rows[0][0], rows[-1][0], len(rows)), 3)
+        self.assertEqual(self.repo.query_audit(), [])
+
+    def test_closed_days_freeze_into_z_reports(self):
+        product = self.first_product()
+        line = {'productId': product['id'], 'quantity': 1, 'price': product['price']}
+        queued = [{'client_key': f'z-{i}', 'items': [line], 'payment_method': method, 'date': date}
+                  for i, (method, date) in enumerate([('cash', '2024-03-01 09:00:00'), ('mpesa', '2024-03-01 17:30:00'),
+                                                      ('cash', '2024-03-02 12:00:00'), ('cash', '2024-03-04 08:00:00')])]
+        results = self.repo.sync_sales(queued, 'cashier')
+        self.repo.reverse_sale(results[1]['saleId'], 'refund', 'Returned', 'admin')
+        today = self.repo.get_sale(self.repo.create_sale([line], 'cash', None, 'cashier'))[0]['date'][:10]
+
+        def reports():
+            return (self.repo.report_daily('2024-03-01', '2024-03-04'), self.repo.report_by_cashier(),
+                    self.repo.report_payment_methods('monthly', '2024-03-01', '2024-03-04'),
+                    self.repo.daily_sales_summary())
+        live = reports()
+        with self.assertRaises(ValueError):
+            self.repo.close_day(today, 'admin')
+        self.assertEqual(self.repo.open_days('2024-03-03'), ['2024-03-01', '2024-03-02', '2024-03-03'])
+        header = self.repo.close_day('2024-03-01', 'admin')
+        self.assertEqual((header['sales_count'], header['refund_count'], header['void_count']), (2, 1, 0))
+        self.assertEqual(header['total_sum'], live[0][-1]['total_sum'])
+        with self.assertRaises(repository.IntegrityError):
+            self.repo.close_day('2024-03-01', 'admin')
+        self.assertEqual(reports(), live)
+
+        # A sale synced late onto a closed day is still counted, once.
+        late = self.repo.sync_sales([dict(queued[0], client_key='z-late')], 'cashier')[0]['saleId']
+        self.assertEqual(self.repo.report_daily('2024-03-01', '2024-03-01')[0]['total_sales'], 3)
+        self.assertEqual(self.repo.close_day('2024-03-02', 'admin')['late_lines'], 1)
+        self.assertEqual(self.repo.report_daily('2024-03-01', '2024-03-01')[0]['total_sales'], 3)
+        self.assertEqual([(r['sale_date'], r['total_sales']) for r in self.repo.report_daily('2024-03-01', '2024-03-04')],
+                         [('2024-03-04', 1), ('2024-03-02', 1), ('2024-03-01', 3)])
+        closes = self.repo.list_z_reports('2024-03-01', '2024-03-31')
+        self.assertEqual([z['day'] for z in closes], ['2024-03-02', '2024-03-01'])
+        self.assertEqual([(l['day'], l['sales_count']) for l in closes[0]['lines']], [('2024-03-01', 1), ('2024-03-02', 1)])
+        self.assertEqual(self.repo.get_sale(late)[0]['date'], '2024-03-01 09:00:00')
+
+        # Snapshots are immutable.
+        for sql in ("UPDATE z_reports SET total_sum = 0", "DELETE FROM z_report_lines"):
+            with self.assertRaises(Exception):
+                with self.repo.connection() as conn:
+                    try:
+                        self.repo.execute(conn, sql)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+        self.assertEqual(len(self.repo.list_z_reports()), 2)
+
+    def test_variants_and_holds(self):
+        product = self.first_product()
+        ids = self.repo.create_variants(product['id'], [{'size': 'L', 'color': 'Red', 'stock': 3}])
+        child = self.repo.get_product(ids[0])
+        self.assertEqual(child['name'], product['name'] + ' (L Red)')
+        self.assertEqual(child['parent_id'], product['id'])
+        self.assertIsNone(self.repo.create_variants(10 ** 6, []))
+        hold_id = self.repo.create_hold('cashier', 'table 4', [], 'cash', None, 0, 0, 0)
+        self.assertEqual(self.repo.list_holds('cashier')[0]['id'], hold_id)
+        self.repo.delete_hold(hold_id)
+        self.assertIsNone(self.repo.get_hold(hold_id))
+
+    def test_product_groups_nest_variants_with_their_stock(self):
+        product = self.first_product()
+        size_ids = self.repo.create_variants(product['id'], [{'size': 'S', 'stock': 3}, {'size': 'M', 'stock': 4}])
+        colour_ids = self.repo.create_variants(size_ids[0], [{'color': 'Red', 'stock': 5}])
+        rows = self.repo.product_groups(product['id'], ['id', 'parent_id', 'stock'])
+        self.assertEqual([(r['id'], r['depth']) for r in rows],
+                         [(product['id'], 0), (size_ids[0], 1), (size_ids[1], 1), (colour_ids[0], 2)])
+        self.assertEqual({(r['root_id'], r['variant_stock'], r['variant_count']) for r in rows}, {(product['id'], 12, 3)})
+
+        groups = {r['root_id'] for r in self.repo.product_groups()}
+        self.assertIn(product['id'], groups)
+        self.assertNotIn(size_ids[0], groups)
+        self.assertEqual(self.repo.product_groups(10 ** 6), [])
+        with self.assertRaises(ValueError):
+            self.repo.product_groups(columns=['id', 'password'])
+
+    def test_hold_items_reservation_and_expiry(self):
+        product = self.first_product()
+        line = {'productId': product['id'], 'name': product['name'], 'quantity': product['stock'] - 1, 'price': product['price']}
+        reserved = self.repo.create_hold('cashier', 'A', [line, dict(line, quantity=1)], 'cash', None, 0, 0, 0,
+                                         ttl_seconds=600, reserve=True, now=1000)
+        self.assertEqual(self.repo.get_hold(reserved, now=1500)['items'], [line, dict(line, quantity=1)])
+        self.assertEqual(self.repo.reserved_stock(now=1500), {product['id']: product['stock']})
+        with self.assertRaises(ValueError):
+            self.repo.create_hold('cashier', 'B', [dict(line, quantity=1)], 'cash', None, 0, 0, 0, reserve=True, now=1500)
+        # Unreserved holds are always allowed
+        plain = self.repo.create_hold('other', 'C', [dict(line, quantity=1)], 'cash', None, 0, 0, 0, ttl_seconds=60, now=1500)
+        self.assertEqual([h['id'] for h in self.repo.list_holds('cashier', now=1500)], [reserved])
+        # Expired holds disappear, release their stock and are purged
+        self.assertIsNone(self.repo.get_hold(reserved, now=1600))
+        self.assertEqual(self.repo.list_holds(now=1600), [])
+        self.assertEqual(self.repo.reserved_stock(now=1600), {})
+        self.assertEqual(self.repo.purge_expired_holds(now=1600), 2)
+        self.assertIsNone(self.repo.get_hold(plain, now=0))
+
+class SQLiteRepositoryTestCase(RepositoryContract, unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = self.connect()
+        migrations.migrate(conn)
+        conn.close()
+        self.repo = repository.SQLiteRepository(self.connect)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_concurrent_sales_in_wal_mode(self):
+        # Several workers selling at once: each sale reads stock and then
+        # writes, which must wait for the lock rather than fail with
+        # "database is locked".
+        conn = self.connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("UPDATE products SET stock = 1000 WHERE barcode = '890100000002'")
+        conn.commit()
+        conn.close()
+        product = self.first_product()
+        errors = []
+
+        def sell():
+            for _ in range(10):
+                try:
+                    self.repo.create_sale([{'productId': product['id'], 'quantity': 1, 'price': product['price']}],
+                                          'cash', None, 'cashier')
+                except Exception as e:
+                    errors.append(e)
+        threads = [threading.Thread(target=sell) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.repo.get_product(product['id'])['stock'], product['stock'] - 60)
+
+@unittest.skipUnless(os.environ.get('POS_TEST_DATABASE_URL'), 'POS_TEST_DATABASE_URL not set')
+class PostgresRepositoryTestCase(RepositoryContract, unittest.TestCase):
+    def setUp(self):
+        self.repo = repository.PostgresRepository(os.environ['POS_TEST_DATABASE_URL'])
+        with self.repo.connection() as conn:
+            self.repo.execute(conn, "DROP TABLE IF EXISTS sale_items, sales, sales_buckets, sale_sync_keys, idempotency_keys, audit_log, audit_archives, "
+                              "z_reports, z_report_lines, "
+                              "holds, hold_items, products, table_revisions, users, banks, categories")
+            conn.commit()
+        self.repo.ensure_schema()
+
+    def tearDown(self):
+        self.repo.close()
+
+if __name__ == '__main__':
+    unittest.main()
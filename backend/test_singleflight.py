@@ -0,0 +1,67 @@
+import unittest
+import threading
+import time
+import singleflight
+
+class SingleFlightTestCase(unittest.TestCase):
+    def run_concurrently(self, flight, key, fn, n):
+        results = [None] * n
+        errors = [None] * n
+
+        def call(i):
+            try:
+                results[i] = flight.do(key, fn, name='test')
+            except Exception as e:
+                errors[i] = e
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def test_concurrent_callers_share_one_computation(self):
+        flight = singleflight.SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'products'
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(flight, 'k', compute, 8)
+        self.assertEqual(calls, [1])
+        self.assertEqual([r[0] for r in results], ['products'] * 8)
+        self.assertEqual(sum(1 for r in results if r[1]), 7)
+        info = flight.info()
+        self.assertEqual((info['leaders'], info['coalesced'], info['in_flight']), (1, 7, 0))
+        self.assertEqual(info['endpoints']['test'], {'leaders': 1, 'coalesced': 7})
+
+        # Once landed, the next caller computes afresh.
+        self.assertEqual(flight.do('k', compute), ('products', False))
+        self.assertEqual(len(calls), 2)
+
+    def test_leader_error_reaches_followers(self):
+        flight = singleflight.SingleFlight()
+
+        def fail():
+            time.sleep(0.2)
+            raise RuntimeError('db down')
+        results, errors = self.run_concurrently(flight, 'k', fail, 4)
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors))
+        self.assertEqual(flight.info()['errors'], 1)
+
+    def test_follower_gives_up_on_a_hung_leader(self):
+        flight = singleflight.SingleFlight(timeout=0.1)
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=('k', lambda: release.wait(5)))
+        leader.start()
+        time.sleep(0.05)
+        self.assertEqual(flight.do('k', lambda: 'own'), ('own', False))
+        release.set()
+        leader.join()
+        self.assertEqual(flight.info()['timeouts'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import os
+import random
+import sqlite3
+import tempfile
+import datetime
+import stress_data
+
+class StressDataTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        stress_data.ensure_schema(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.path)
+
+    def test_generates_consistent_history(self):
+        rng = random.Random(1)
+        sellable = stress_data.generate_products(self.conn, rng, 200, 0.5)
+        self.assertEqual(len(sellable), 200)
+        cashiers = stress_data.ensure_cashiers(self.conn, 4)
+        totals = stress_data.generate_history(self.conn, rng, sellable, cashiers, days=7, sales_per_day=50,
+                                              refund_rate=0.1, void_rate=0.05, holds=10, batch_size=100,
+                                              end_date=datetime.date(2024, 1, 7), log=lambda *_: None)
+        c = self.conn
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM sales WHERE date >= '2024-01-01'").fetchone()[0], totals['sales'])
+        self.assertGreater(totals['sale_items'], totals['sales'])
+        variants = c.execute("SELECT COUNT(*) FROM products WHERE parent_id IS NOT NULL").fetchone()[0]
+        self.assertGreater(variants, 0)
+        orphans = c.execute("""
+            SELECT COUNT(*) FROM sale_items si LEFT JOIN sales s ON s.id = si.sale_id WHERE s.id IS NULL
+        """).fetchone()[0]
+        self.assertEqual(orphans, 0)
+        non_completed = c.execute("SELECT COUNT(*) FROM sales WHERE status != 'completed' AND date >= '2024-01-01'").fetchone()[0]
+        self.assertEqual(non_completed, totals['audit_log'])
+        hours = [r[0] for r in c.execute("SELECT DISTINCT CAST(strftime('%H', date) AS INTEGER) FROM sales WHERE date >= '2024-01-01'")]
+        self.assertTrue(all(h in stress_data.HOURLY_WEIGHTS for h in hours))
+        self.assertGreaterEqual(c.execute("SELECT COUNT(*) FROM holds").fetchone()[0], 10)
+
+if __name__ == '__main__':
+    unittest.main()